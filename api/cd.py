@@ -1,5 +1,6 @@
 from services.bottom.V0 import Bottom
 from uuid import UUID
+import weakref
 
 class CDAPI:
     def __init__(self, state, m: UUID):
@@ -49,6 +50,9 @@ class CDAPI:
         self.transitive_sub_types = { type_name: set(get_transitive_sub_types(type_name)) for type_name in self.direct_sub_types } 
         self.transitive_super_types = { type_name: set(get_transitive_super_types(type_name)) for type_name in self.direct_super_types }
 
+        # (class name, attribute name) -> AttributeLink, filled in by 'find_attribute_type'
+        self.attribute_types = {}
+
     def get(self, type_name: str):
         return self.bottom.read_outgoing_elements(self.m, type_name)[0]
 
@@ -74,15 +78,63 @@ class CDAPI:
 
     # Attributes are inherited, so when we instantiate an attribute of a class, the AttributeLink may contain the name of the superclass
     def find_attribute_type(self, class_name: str, attr_name: str):
+        result = self.attribute_types.get((class_name, attr_name))
+        if result == None:
+            result = self._find_attribute_type(class_name, attr_name)
+            if result != None:
+                self.attribute_types[(class_name, attr_name)] = result
+        return result
+
+    def _find_attribute_type(self, class_name: str, attr_name: str):
         assoc_name = f"{class_name}_{attr_name}"
         type_edges = self.bottom.read_outgoing_elements(self.m, assoc_name)
         if len(type_edges) == 1:
             return type_edges[0]
         else:
             for supertype in self.direct_super_types[class_name]:
-                result = self.find_attribute_type(supertype, attr_name)
+                result = self._find_attribute_type(supertype, attr_name)
                 if result != None:
                     return result
 
     def get_type(self, type_name: str):
         return next(k for k, v in self.type_model_names.items() if v == type_name)
+
+# Building a CDAPI means reading the whole type model, so CDAPIs are shared (see 'get_cdapi').
+# They are shared by all states with the same owner of the type model (see State.read_owner), and only live as long as that owner.
+# A CDAPI is only rebuilt if an element was added to or removed from the type model since it was built.
+# This is checked (by reading the elements of the type model) at most once for every version of the owner.
+# Only the set of elements is compared (re-creating an inheritance link or association with another source or target makes it a different element).
+# Changes that keep the elements, e.g., to the slots of a class or the name of an attribute, are not detected:
+# type models are assumed not to be modified in that way while they are in use.
+class CDAPIRegistry:
+    def __init__(self):
+        # owner -> type model -> (version of owner, elements of type model, CDAPI)
+        self.entries = weakref.WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, state, m: UUID) -> CDAPI:
+        owner = state.read_owner(m)
+        entries = self.entries.setdefault(owner, {})
+        entry = entries.get(m)
+        version = owner.read_version()
+        if entry != None and version != None and entry[0] == version:
+            self.hits += 1
+        else:
+            # the elements of a model are the targets of its outgoing edges, so the edges identify them
+            elements = frozenset(owner.read_outgoing(m) or ())
+            if entry != None and entry[1] == elements:
+                self.hits += 1
+                entry = (version, elements, entry[2])
+            else:
+                self.misses += 1
+                # (the CDAPI must not keep its owner alive)
+                entry = (version, elements, CDAPI(weakref.proxy(owner), m))
+            entries[m] = entry
+        return entry[2]
+
+registry = CDAPIRegistry()
+
+# Get the (shared) CDAPI of type model m
+def get_cdapi(state, m: UUID) -> CDAPI:
+    return registry.get(state, m)
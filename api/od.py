@@ -8,6 +8,7 @@ from services.primitives.actioncode_type import ActionCode
 from services.primitives.bytes_type import Bytes
 from uuid import UUID
 from typing import Optional
+from contextlib import contextmanager
 from util.timer import Timer
 
 NEXT_LINK_ID = 0
@@ -37,31 +38,194 @@ class ODAPI:
         self.m = m
         self.mm = mm
         self.od = od.OD(mm, m, state)
-        self.cdapi = cd.CDAPI(state, mm)
+        self.cdapi = cd.get_cdapi(state, mm)
 
-        self.create_boolean_value = self.od.create_boolean_value
-        self.create_integer_value = self.od.create_integer_value
-        self.create_string_value = self.od.create_string_value
-        self.create_actioncode_value = self.od.create_actioncode_value
-        self.create_bytes_value = self.od.create_bytes_value
+        # (name, element)-pairs that still have to be added to the index (see 'batch')
+        self.__pending = None
+        # Functions called with (name, element) for every element of our model that is created, updated or deleted through this API.
+        # Deleted elements are reported just before they are deleted.
+        self.change_listeners = []
+        self.__recompute_mappings()
 
+    # Rebuild all indexes from scratch.
+    # Every mutation performed through this API updates the indexes incrementally.
+    # If our model (m) is modified without going through this API (e.g., through Bottom, or another ODAPI), all indexed reads
+    # (names, types, instances, links of an object) return stale results, until this is called.
+    # Changes to other models (e.g., patterns, or other models in the same state) do not affect the indexes.
+    def reindex(self):
         self.__recompute_mappings()
 
-    # Called after every change - makes querying faster but modifying slower
+    # Full (re)build of the indexes - done at construction time, and by 'reindex'.
     def __recompute_mappings(self):
+        if self.__pending != None:
+            self.__pending = [] # (inside 'batch') the pending elements are indexed below
+        # Slot index, filled in lazily by 'get_slot_link': (object, attribute name) -> slot-link
+        self.__slots = {}
+        # slot-link -> (object, attribute name)
+        self.__slot_keys = {}
+        # Links of our model per object, grouped by type name: object -> type name -> list of links
+        # (a list rather than an ordered set: hashing a UUID is slow, and an object usually has few links of a type)
+        # Built on first use by 'get_outgoing'/'get_incoming'
+        self.__outgoing = None
+        self.__incoming = None
+
         self.m_obj_to_name = build_name_mapping(self.state, self.m)
+        self.m_name_to_obj = { name: element for element, name in self.m_obj_to_name.items() }
         self.mm_obj_to_name = build_name_mapping(self.state, self.mm)
         self.type_to_objs = { type_name : set() for type_name in self.bottom.read_keys(self.mm)}
+        # element -> type name
+        self.m_obj_to_type = {}
         for m_name in self.bottom.read_keys(self.m):
             m_element, = self.bottom.read_outgoing_elements(self.m, m_name)
-            tm_element = self.get_type(m_element)
-            if tm_element in self.mm_obj_to_name:
-                tm_name = self.mm_obj_to_name[tm_element]
-                # self.obj_to_type[m_name] = tm_name
+            tm_name = self.__get_indexed_type_name(m_element)
+            if tm_name != None:
+                self.m_obj_to_type[m_element] = tm_name
                 self.type_to_objs[tm_name].add(m_name)
 
+    # Type name under which an element is indexed in 'type_to_objs', or None if not indexed
+    def __get_indexed_type_name(self, m_element: UUID):
+        tm_element = self.get_type(m_element)
+        return self.mm_obj_to_name.get(tm_element)
+
+    # Add a newly created element of our model to the index
+    def __index_element(self, name: str, element: UUID):
+        self.__notify_change(name, element)
+        if self.__pending != None:
+            self.__pending.append((name, element))
+        else:
+            self.__add_to_index(name, element)
+
+    def __add_to_index(self, name: str, element: UUID):
+        self.m_obj_to_name[element] = name
+        self.m_name_to_obj.setdefault(name, element)
+        if self.m == self.mm:
+            # the model is its own meta-model (e.g., SCD): it also gets a new type
+            self.mm_obj_to_name[element] = name
+            self.type_to_objs.setdefault(name, set())
+        tm_name = self.__get_indexed_type_name(element)
+        if tm_name != None:
+            self.m_obj_to_type[element] = tm_name
+            self.type_to_objs[tm_name].add(name)
+            if self.__outgoing != None:
+                self.__add_to_adjacency(element, tm_name)
+
+    # Remove elements (that are about to be deleted) from the index
+    def __unindex_elements(self, elements):
+        self.__flush_index()
+        for element in elements:
+            self.__unindex_slot(element)
+            name = self.m_obj_to_name.get(element)
+            if name == None:
+                continue
+            self.__notify_change(name, element)
+            del self.m_obj_to_name[element]
+            if self.m_name_to_obj.get(name) == element:
+                del self.m_name_to_obj[name]
+            tm_name = self.m_obj_to_type.pop(element, None)
+            if tm_name != None:
+                self.type_to_objs[tm_name].discard(name)
+                if self.__outgoing != None:
+                    self.__remove_from_adjacency(element, tm_name)
+            if self.m == self.mm:
+                self.mm_obj_to_name.pop(element, None)
+                self.type_to_objs.pop(name, None)
+
+    def __index_slot(self, obj: UUID, attr_name: str, link: UUID):
+        self.__unindex_slot(self.__slots.get((obj, attr_name)))
+        self.__slots[(obj, attr_name)] = link
+        self.__slot_keys[link] = (obj, attr_name)
+
+    def __unindex_slot(self, link: UUID):
+        key = self.__slot_keys.pop(link, None)
+        if key != None:
+            del self.__slots[key]
+
+    def __notify_change(self, name: str, element: UUID):
+        for listener in self.change_listeners:
+            listener(name, element)
+
+    def __build_adjacency(self):
+        self.__flush_index()
+        outgoing = {}
+        incoming = {}
+        read_edge = self.state.read_edge
+        # (same as calling __add_to_adjacency for every element, but this is a single pass over possibly many links)
+        for element, tm_name in self.m_obj_to_type.items():
+            src, tgt = read_edge(element)
+            if src != None:
+                outgoing.setdefault(src, {}).setdefault(tm_name, []).append(element)
+                incoming.setdefault(tgt, {}).setdefault(tm_name, []).append(element)
+        self.__outgoing = outgoing
+        self.__incoming = incoming
+
+    def __add_to_adjacency(self, element: UUID, tm_name: str):
+        src, tgt = self.state.read_edge(element)
+        if src != None:
+            self.__outgoing.setdefault(src, {}).setdefault(tm_name, []).append(element)
+            self.__incoming.setdefault(tgt, {}).setdefault(tm_name, []).append(element)
+
+    def __remove_from_adjacency(self, element: UUID, tm_name: str):
+        src, tgt = self.state.read_edge(element)
+        if src != None:
+            for links in (self.__outgoing.get(src, {}).get(tm_name, []), self.__incoming.get(tgt, {}).get(tm_name, [])):
+                if element in links:
+                    links.remove(element)
+
+    # The links of obj in the adjacency index ('outgoing' or 'incoming') that are typed by the given association, grouped by type
+    def __get_adjacent(self, direction: str, obj: UUID, assoc_name: str, include_subtypes: bool):
+        if self.__outgoing == None:
+            self.__build_adjacency()
+        self.__flush_index()
+        adjacency = self.__outgoing if direction == "outgoing" else self.__incoming
+        if include_subtypes:
+            types = self.cdapi.transitive_sub_types[assoc_name]
+        else:
+            types = (assoc_name,)
+        return [links for type_name, links in adjacency.get(obj, {}).items() if type_name in types]
+
+    def __flush_index(self):
+        if self.__pending:
+            pending, self.__pending = self.__pending, []
+            for name, element in pending:
+                self.__add_to_index(name, element)
+
+    # Returns all elements that disappear when the given element is deleted:
+    # the element itself, and (recursively) all edges connected to it.
+    def __get_deleted_with(self, element: UUID):
+        result = []
+        visited = set()
+        todo = [element]
+        while len(todo) > 0:
+            el = todo.pop()
+            if el in visited:
+                continue
+            visited.add(el)
+            result.append(el)
+            todo.extend(self.state.read_outgoing(el) or [])
+            todo.extend(self.state.read_incoming(el) or [])
+        return result
+
+    # Within this context, adding new elements to the name/type index is deferred until the index is queried, or the end of the block is reached.
+    # Useful when creating many elements at once (e.g., in the RHS of a rule).
+    @contextmanager
+    def batch(self):
+        if self.__pending != None:
+            # nested batch: the outer one will commit
+            yield self
+            return
+        self.__pending = []
+        try:
+            yield self
+        finally:
+            self.__flush_index()
+            self.__pending = None
+
     def get_value(self, obj: UUID):
-        return od.read_primitive_value(self.bottom, obj, self.mm)[0]
+        # same as od.read_primitive_value, but with the type name from our index
+        type_name = self.get_type_name(obj)
+        if type_name not in od.PRIMITIVE_KEYS:
+            raise Exception("Unimplemented type:", type_name)
+        return od.read_modelref_value(self.bottom, obj, od.PRIMITIVE_KEYS[type_name])
 
     def get_target(self, link: UUID):
         return self.bottom.read_edge_target(link)
@@ -70,51 +234,59 @@ class ODAPI:
         return self.bottom.read_edge_source(link)
 
     def get_slot(self, obj: UUID, attr_name: str):
-        slot = self.od.get_slot(obj, attr_name)
-        if slot == None:
+        link = self.get_slot_link(obj, attr_name)
+        if link == None:
             raise NoSuchSlotException(f"Object '{self.m_obj_to_name[obj]}' has no slot '{attr_name}'")
-        return slot
+        return self.bottom.read_edge_target(link)
 
     def get_slot_link(self, obj: UUID, attr_name: str):
-        return self.od.get_slot_link(obj, attr_name)
+        link = self.__slots.get((obj, attr_name))
+        # the model may also have been changed without going through this API (e.g., by the rewriter),
+        # so we check that the indexed link still exists
+        if link != None:
+            if self.bottom.read_edge_source(link) == obj:
+                return link
+            self.__unindex_slot(link)
+        link = self.od.get_slot_link(obj, attr_name)
+        if link != None:
+            self.__index_slot(obj, attr_name, link)
+        return link
 
     # Parameter 'include_subtypes': whether to include subtypes of the given association
     def get_outgoing(self, obj: UUID, assoc_name: str, include_subtypes=True):
-        outgoing = self.bottom.read_outgoing_edges(obj)
-        result = []
-        for o in outgoing:
-            try:
-                type_of_outgoing_link = self.get_type_name(o)
-            except:
-                continue # OK, not all edges are typed
-            if (include_subtypes and self.cdapi.is_subtype(super_type_name=assoc_name, sub_type_name=type_of_outgoing_link)
-                or not include_subtypes and type_of_outgoing_link == assoc_name):
-                    result.append(o)
-        return result
+        return [link for links in self.__get_adjacent("outgoing", obj, assoc_name, include_subtypes) for link in links]
 
 
     # Parameter 'include_subtypes': whether to include subtypes of the given association
     def get_incoming(self, obj: UUID, assoc_name: str, include_subtypes=True):
-        incoming = self.bottom.read_incoming_edges(obj)
-        result = []
-        for i in incoming:
-            try:
-                type_of_incoming_link = self.get_type_name(i)
-            except:
-                continue # OK, not all edges are typed
-            if (include_subtypes and self.cdapi.is_subtype(super_type_name=assoc_name, sub_type_name=type_of_incoming_link)
-                or not include_subtypes and type_of_incoming_link == assoc_name):
-                    result.append(i)
-        return result
+        return [link for links in self.__get_adjacent("incoming", obj, assoc_name, include_subtypes) for link in links]
+
+    # Same as len(get_outgoing(...)), but without building the list
+    def count_outgoing(self, obj: UUID, assoc_name: str, include_subtypes=True):
+        return sum(len(links) for links in self.__get_adjacent("outgoing", obj, assoc_name, include_subtypes))
+
+    # Same as len(get_incoming(...)), but without building the list
+    def count_incoming(self, obj: UUID, assoc_name: str, include_subtypes=True):
+        return sum(len(links) for links in self.__get_adjacent("incoming", obj, assoc_name, include_subtypes))
 
     # Returns list of tuples (name, obj)
     def get_all_instances(self, type_name: str, include_subtypes=True):
+        self.__flush_index()
         if include_subtypes:
             all_types = self.cdapi.transitive_sub_types[type_name]
         else:
             all_types = set([type_name])
         obj_names = [obj_name for type_name in all_types for obj_name in self.type_to_objs[type_name]]
-        return [(obj_name, self.bottom.read_outgoing_elements(self.m, obj_name)[0]) for obj_name in obj_names]
+        return [(obj_name, self.m_name_to_obj[obj_name]) for obj_name in obj_names]
+
+    # Same as len(get_all_instances(...)), but without building the list
+    def count_instances(self, type_name: str, include_subtypes=True):
+        self.__flush_index()
+        if include_subtypes:
+            all_types = self.cdapi.transitive_sub_types[type_name]
+        else:
+            all_types = [type_name]
+        return sum(len(self.type_to_objs[type_name]) for type_name in all_types)
 
     def get_type(self, obj: UUID):
         types = self.bottom.read_outgoing_elements(obj, "Morphism")
@@ -123,6 +295,7 @@ class ODAPI:
         return types[0]
 
     def get_name(self, obj: UUID):
+        self.__flush_index()
         if obj in self.m_obj_to_name:
             return self.m_obj_to_name[obj]
         elif obj in self.mm_obj_to_name:
@@ -140,6 +313,10 @@ class ODAPI:
             raise Exception(f"No such element in model: '{name}'")
 
     def get_type_name(self, obj: UUID):
+        self.__flush_index()
+        type_name = self.m_obj_to_type.get(obj)
+        if type_name != None:
+            return type_name
         return self.get_name(self.get_type(obj))
 
     def is_instance(self, obj: UUID, type_name: str, include_subtypes=True):
@@ -151,12 +328,12 @@ class ODAPI:
         return False
 
     def delete(self, obj: UUID):
+        self.__unindex_elements(self.__get_deleted_with(obj))
         self.bottom.delete_element(obj)
-        self.__recompute_mappings()
 
     # Does the the object have the given attribute?
     def has_slot(self, obj: UUID, attr_name: str):
-        return self.od.get_slot_link(obj, attr_name) != None
+        return self.get_slot_link(obj, attr_name) != None
 
     def get_slots(self, obj: UUID) -> list[str]:
         return [attr_name for attr_name, _ in self.od.get_slots(obj)]
@@ -191,61 +368,96 @@ class ODAPI:
         if old_slot_link != None:
             old_target = self.get_target(old_slot_link)
             # if old_target != None:
-            self.bottom.delete_element(old_target) # this also deletes the slot-link
+            self.delete(old_target) # this also deletes the slot-link
 
         new_target = self.create_primitive_value(target_name, new_value, is_code)
         slot_type = self.cdapi.find_attribute_type(self.get_type_name(obj), attr_name)
         new_link = self.od._create_link(link_name, slot_type, obj, new_target)
-        self.__recompute_mappings()
+        self.__index_element(link_name, new_link)
+        self.__index_slot(obj, attr_name, new_link)
 
     def create_primitive_value(self, name: str, value: any, is_code=False):
         # watch out: in Python, 'bool' is subtype of 'int'
         #  so we must check for 'bool' first
         if isinstance(value, bool):
-            tgt = self.create_boolean_value(name, value)
+            return self.create_boolean_value(name, value)
         elif isinstance(value, int):
-            tgt = self.create_integer_value(name, value)
+            return self.create_integer_value(name, value)
         elif isinstance(value, str):
             if is_code:
-                tgt = self.create_actioncode_value(name, value)
+                return self.create_actioncode_value(name, value)
             else:
-                tgt = self.create_string_value(name, value)
+                return self.create_string_value(name, value)
         elif isinstance(value, bytes):
-            tgt = self.create_bytes_value(name, value)
+            return self.create_bytes_value(name, value)
         else:
             raise Exception("Unimplemented type "+value)
-        self.__recompute_mappings()
+
+    def create_boolean_value(self, name: str, value: bool):
+        return self.__create_value(self.od.create_boolean_value, name, value)
+
+    def create_integer_value(self, name: str, value: int):
+        return self.__create_value(self.od.create_integer_value, name, value)
+
+    def create_string_value(self, name: str, value: str):
+        return self.__create_value(self.od.create_string_value, name, value)
+
+    def create_actioncode_value(self, name: str, value: str):
+        return self.__create_value(self.od.create_actioncode_value, name, value)
+
+    def create_bytes_value(self, name: str, value: bytes):
+        return self.__create_value(self.od.create_bytes_value, name, value)
+
+    def __create_value(self, create, name: str, value):
+        tgt = create(name, value)
+        self.__index_element(name, tgt)
         return tgt
 
     def overwrite_primitive_value(self, name: str, value: any, is_code=False):
-        referred_model = UUID(self.bottom.read_value(self.get(name)))
-        to_overwrite_type = self.get_type_name(self.get(name))
+        node = self.get(name)
+        to_overwrite_type = self.get_type_name(node)
         # watch out: in Python, 'bool' is subtype of 'int'
         #  so we must check for 'bool' first
         if isinstance(value, bool):
             if to_overwrite_type != "Boolean":
                 raise Exception(f"Cannot assign boolean value '{value}' to value of type {to_overwrite_type}.")
-            Boolean(referred_model, self.state).create(value)
+            service = Boolean
         elif isinstance(value, int):
             if to_overwrite_type != "Integer":
                 raise Exception(f"Cannot assign integer value '{value}' to value of type {to_overwrite_type}.")
-            Integer(referred_model, self.state).create(value)
+            service = Integer
         elif isinstance(value, str):
             if is_code:
                 if to_overwrite_type != "ActionCode":
                     raise Exception(f"Cannot assign code to value of type {to_overwrite_type}.")
-                ActionCode(referred_model, self.state).create(value)
+                service = ActionCode
             else:
                 if to_overwrite_type != "String":
                     raise Exception(f"Cannot assign string value '{value}' to value of type {to_overwrite_type}.")
-                String(referred_model, self.state).create(value)
+                service = String
         elif isinstance(value, bytes):
             if to_overwrite_type != "Bytes":
                 raise Exception(f"Cannot assign bytes value '{value}' to value of type {to_overwrite_type}.")
-            Bytes(referred_model, self.state).create(value)
+            service = Bytes
         else:
             raise Exception("Unimplemented type "+value)
 
+        referred_model = od.get_referred_model(self.bottom, node)
+        if referred_model != None:
+            # value is stored by reference: overwrite it in the referred model
+            service(referred_model, self.state).create(value)
+            self.__notify_change(name, node)
+        else:
+            # value is stored inline: nodes cannot be updated, so we replace the node and the slot-links pointing to it
+            self.__flush_index()
+            links = [(self.m_obj_to_name[link], self.get_type(link), self.get_source(link))
+                for link in self.bottom.read_incoming_edges(node) if link in self.m_obj_to_name]
+            self.delete(node) # this also deletes the slot-links
+            new_node = self.create_primitive_value(name, value, is_code)
+            for link_name, link_type, src in links:
+                new_link = self.od._create_link(link_name, link_type, src, new_node)
+                self.__index_element(link_name, new_link)
+
     def create_link(self, link_name: Optional[str], assoc_name: str, src: UUID, tgt: UUID):
         global NEXT_LINK_ID
         types = self.bottom.read_outgoing_elements(self.mm, assoc_name) 
@@ -258,7 +470,7 @@ class ODAPI:
             link_name = f"__{assoc_name}{NEXT_LINK_ID}"
             NEXT_LINK_ID += 1
         link_id = self.od._create_link(link_name, typ, src, tgt)
-        self.__recompute_mappings()
+        self.__index_element(link_name, link_id)
 
         return link_id
 
@@ -268,7 +480,7 @@ class ODAPI:
             object_name = f"__{class_name}{NEXT_OBJ_ID}"
             NEXT_OBJ_ID += 1
         obj = self.od.create_object(object_name, class_name)
-        self.__recompute_mappings()
+        self.__index_element(object_name, obj)
         return obj
 
 # internal use
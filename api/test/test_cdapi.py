@@ -0,0 +1,64 @@
+import gc
+import weakref
+
+from state.pystate import PyState
+from state.overlaystate import OverlayState
+from bootstrap.scd import bootstrap_scd
+from util import loader
+from api.od import ODAPI
+from api.cd import get_cdapi, registry
+
+mm_cs = """
+    Man:Class
+    Bear:Class
+    afraidOf:Association (Man -> Bear)
+"""
+
+m_cs = """
+    george:Man
+    teddy:Bear
+    :afraidOf (george -> teddy)
+"""
+
+def load():
+    state = PyState()
+    scd = bootstrap_scd(state)
+    mm = loader.parse_and_check(state, mm_cs, scd, "mm")
+    m = loader.parse_and_check(state, m_cs, mm, "m")
+    return state, m, mm
+
+def test_overlays_share_cdapi_of_base():
+    state, m, mm = load()
+    cdapi = get_cdapi(state, mm)
+    misses = registry.misses
+    overlay1 = OverlayState(state)
+    overlay2 = OverlayState(state)
+    # changing the instance model does not change the type model
+    ODAPI(overlay1, m, mm).create_object("bill", "Man")
+    assert get_cdapi(overlay1, mm) is cdapi
+    assert get_cdapi(overlay2, mm) is cdapi
+    assert ODAPI(overlay2, m, mm).cdapi is cdapi
+    assert registry.misses == misses
+    assert overlay1 not in registry.entries and overlay2 not in registry.entries
+
+def test_overlay_that_changes_type_model_gets_own_cdapi():
+    state, m, mm = load()
+    cdapi = get_cdapi(state, mm)
+    overlay = OverlayState(state)
+    ODAPI(overlay, mm, cdapi.mm).create_object("Fish", "Class")
+    overlay_cdapi = get_cdapi(overlay, mm)
+    assert overlay_cdapi is not cdapi
+    assert "Fish" in overlay_cdapi.transitive_sub_types
+    assert "Fish" not in get_cdapi(state, mm).transitive_sub_types
+
+def test_dropping_state_frees_cdapi():
+    state, m, mm = load()
+    cdapi = weakref.ref(get_cdapi(state, mm))
+    state_ref = weakref.ref(state)
+    assert state in registry.entries
+    entries = len(registry.entries)
+    del state
+    gc.collect()
+    assert state_ref() == None
+    assert cdapi() == None
+    assert len(registry.entries) == entries - 1
@@ -0,0 +1,267 @@
+import pytest
+
+from state.pystate import PyState
+from bootstrap.scd import bootstrap_scd
+from util import loader
+from api.od import ODAPI
+from services import od
+from services.bottom.V0 import Bottom
+from services.primitives.string_type import String
+from services.primitives.integer_type import Integer
+from framework.conformance import Conformance
+from transformation.cloner import clone_od
+
+mm_cs = """
+    Man:Class
+    Man_weight:AttributeLink (Man -> Integer) {
+        name = "weight";
+        optional = True;
+    }
+    # (only so that the meta-model contains these primitive types)
+    Man_nickname:AttributeLink (Man -> String) {
+        name = "nickname";
+        optional = True;
+    }
+    Man_brave:AttributeLink (Man -> Boolean) {
+        name = "brave";
+        optional = True;
+    }
+    Man_action:AttributeLink (Man -> ActionCode) {
+        name = "action";
+        optional = True;
+    }
+    Man_photo:AttributeLink (Man -> Bytes) {
+        name = "photo";
+        optional = True;
+    }
+    Bear:Class
+    afraidOf:Association (Man -> Bear)
+"""
+
+m_cs = """
+    george:Man { weight = 80; }
+    bill:Man
+    teddy:Bear
+    :afraidOf (george -> teddy)
+"""
+
+@pytest.fixture
+def model():
+    state = PyState()
+    scd = bootstrap_scd(state)
+    mm = loader.parse_and_check(state, mm_cs, scd, "mm")
+    m = loader.parse_and_check(state, m_cs, mm, "m")
+    return state, m, mm
+
+# Everything that can be read through the indexes of an ODAPI
+def read_indexed(odapi):
+    # (inside a batch, the dicts are only brought up to date by a query)
+    odapi.count_instances("Man")
+    result = {
+        "names": sorted(odapi.m_name_to_obj.items()),
+        "types": sorted((odapi.get_name(obj), type_name) for obj, type_name in odapi.m_obj_to_type.items()),
+    }
+    for type_name in ("Man", "Bear", "afraidOf", "Integer", "String", "Boolean", "ActionCode", "Bytes"):
+        result[type_name] = sorted(odapi.get_all_instances(type_name))
+        result["count " + type_name] = odapi.count_instances(type_name)
+    for obj_name, obj in odapi.get_all_instances("Man"):
+        result[obj_name] = (
+            sorted(odapi.get_outgoing(obj, "afraidOf")),
+            odapi.count_outgoing(obj, "afraidOf"),
+            odapi.get_slot_value_default(obj, "weight", None),
+        )
+    for obj_name, obj in odapi.get_all_instances("Bear"):
+        result[obj_name] = (
+            sorted(odapi.get_incoming(obj, "afraidOf")),
+            odapi.count_incoming(obj, "afraidOf"),
+        )
+    return result
+
+def assert_same_as_fresh(odapi):
+    assert read_indexed(odapi) == read_indexed(ODAPI(odapi.state, odapi.m, odapi.mm))
+
+def test_reindex(model):
+    state, m, mm = model
+    odapi = ODAPI(state, m, mm)
+    read_indexed(odapi) # builds the lazy indexes
+
+    # modify the model behind the back of odapi
+    other = ODAPI(state, m, mm)
+    bill, teddy = other.get("bill"), other.get("teddy")
+    other.create_link("billAfraid", "afraidOf", bill, teddy)
+    other.set_slot_value(bill, "weight", 70)
+    other.set_slot_value(other.get("george"), "weight", 90)
+    other.delete(other.get("george"))
+    other.create_object("winnie", "Bear")
+    # all indexed reads are stale (consistently), until reindex
+    assert "winnie" not in odapi.m_name_to_obj and odapi.count_instances("Bear") == 1
+    assert odapi.count_outgoing(bill, "afraidOf") == 0
+
+    odapi.reindex()
+    assert_same_as_fresh(odapi)
+
+    with odapi.batch():
+        odapi.create_object("yogi", "Bear")
+        odapi.reindex()
+        odapi.create_link("yogiAfraid", "afraidOf", bill, odapi.get("yogi"))
+    assert_same_as_fresh(odapi)
+
+def test_reindex_after_external_edit(model):
+    state, m, mm = model
+    odapi = ODAPI(state, m, mm)
+    bottom = Bottom(state)
+    bill, teddy = odapi.get("bill"), odapi.get("teddy")
+    assert odapi.get_outgoing(bill, "afraidOf") == [] # builds the adjacency index
+
+    # create a link directly in the state
+    link = bottom.create_edge(bill, teddy)
+    bottom.create_edge(m, link, "billAfraid")
+    bottom.create_edge(link, bottom.read_outgoing_elements(mm, "afraidOf")[0], "Morphism")
+
+    odapi.reindex()
+    assert odapi.get_outgoing(bill, "afraidOf") == [link]
+    assert odapi.count_incoming(teddy, "afraidOf") == 2
+    assert_same_as_fresh(odapi)
+
+    # changes to other models in the same state do not affect the indexes
+    loader.parse_and_check(state, "yogi:Bear", mm, "other")
+    assert odapi.count_instances("Bear") == 1
+    assert_same_as_fresh(odapi)
+
+def mutate(odapi):
+    george, teddy = odapi.get("george"), odapi.get("teddy")
+    joe = odapi.create_object("joe", "Man")
+    odapi.create_link("joeAfraid", "afraidOf", joe, teddy)
+    odapi.set_slot_value(joe, "weight", 60)
+    odapi.set_slot_value(george, "weight", 85) # replaces the existing slot
+    odapi.create_integer_value("answer", 42)
+    odapi.create_string_value("greeting", "hello")
+    odapi.create_boolean_value("flag", True)
+    odapi.create_actioncode_value("code", "1+1")
+    odapi.create_bytes_value("data", b"\x00")
+    odapi.delete(odapi.get("bill"))
+    odapi.delete(odapi.get("joeAfraid"))
+    odapi.create_link("joeAfraidAgain", "afraidOf", joe, teddy)
+
+@pytest.mark.parametrize("in_batch", [False, True])
+def test_incremental_index(model, in_batch):
+    state, m, mm = model
+    odapi = ODAPI(state, m, mm)
+    read_indexed(odapi) # builds the lazy indexes
+    changed = []
+    odapi.change_listeners.append(lambda name, element: changed.append(name))
+    if in_batch:
+        with odapi.batch():
+            mutate(odapi)
+            # queries inside the batch see the changes
+            assert_same_as_fresh(odapi)
+            odapi.create_object("winnie", "Bear")
+    else:
+        mutate(odapi)
+        odapi.create_object("winnie", "Bear")
+    assert_same_as_fresh(odapi)
+
+    fresh = ODAPI(state, m, mm)
+    for name in ("answer", "greeting", "flag", "code", "data"):
+        assert odapi.get_name(fresh.get(name)) == name
+    assert fresh.get_value(fresh.get("answer")) == 42
+    assert {"joe", "joeAfraid", "answer", "greeting", "flag", "code", "data", "bill", "winnie"} <= set(changed)
+
+def test_slot_index_after_replacing_slot(model):
+    state, m, mm = model
+    odapi = ODAPI(state, m, mm)
+    george, bill = odapi.get("george"), odapi.get("bill")
+    old_link = odapi.get_slot_link(george, "weight") # (indexed)
+    for weight in (90, 100):
+        odapi.set_slot_value(george, "weight", weight)
+        link = odapi.get_slot_link(george, "weight")
+        assert link != old_link and state.read_edge(old_link) == (None, None)
+        assert state.read_edge(link) == (george, odapi.get_slot(george, "weight"))
+        assert odapi.get_slot_value(george, "weight") == weight
+        old_link = link
+    # created slot
+    odapi.set_slot_value(bill, "weight", 110)
+    assert odapi.get_slot_value(bill, "weight") == 110
+    # replaced by overwrite_primitive_value, which does not update the slot index itself
+    odapi.overwrite_primitive_value(odapi.get_name(odapi.get_slot(george, "weight")), 120)
+    link = odapi.get_slot_link(george, "weight")
+    assert link != old_link and state.read_edge(link)[0] == george
+    assert odapi.get_slot_value(george, "weight") == 120
+    assert odapi.get_slots(george) == ["weight"]
+    fresh = ODAPI(state, m, mm)
+    for obj in (george, bill):
+        assert odapi.get_slot_link(obj, "weight") == fresh.get_slot_link(obj, "weight")
+    assert_same_as_fresh(odapi)
+
+def test_inline_string_that_looks_like_a_reference(model):
+    state, m, mm = model
+    bottom = Bottom(state)
+    # a String stored by reference, in a model of its own
+    referred_model = state.create_node()
+    String(referred_model, state).create("not my nickname")
+    ref = bottom.create_node(str(referred_model))
+    assert od.read_modelref_value(bottom, ref, "string") == "not my nickname"
+
+    odapi = ODAPI(state, m, mm)
+    george = odapi.get("george")
+    odapi.set_slot_value(george, "nickname", str(referred_model))
+    assert odapi.get_slot_value(george, "nickname") == str(referred_model)
+    # the value is stored inline, escaped, and nothing but its type is attached to the value node
+    value_node = odapi.get_slot(george, "nickname")
+    assert state.read_value(value_node) == od.INLINE_ESCAPE + str(referred_model)
+    assert state.read_outgoing(value_node) == bottom.read_outgoing_edges(value_node, "Morphism")
+    assert od.get_referred_model(bottom, value_node) == None
+    odapi.set_slot_value(george, "nickname", od.INLINE_ESCAPE + "x")
+    assert odapi.get_slot_value(george, "nickname") == od.INLINE_ESCAPE + "x"
+    odapi.set_slot_value(george, "nickname", str(referred_model))
+    assert Conformance(state, m, mm).check_nominal() == []
+
+    cloned_m = clone_od(state, m, mm)
+    cloned = ODAPI(state, cloned_m, mm)
+    assert cloned.get_slot_value(cloned.get("george"), "nickname") == str(referred_model)
+
+    odapi.set_slot_value(george, "nickname", "georgie")
+    assert cloned.get_slot_value(cloned.get("george"), "nickname") == str(referred_model)
+
+def test_migrate_to_inline(model):
+    state, m, mm = model
+    bottom = Bottom(state)
+    odapi = ODAPI(state, m, mm)
+    george = odapi.get("george")
+    # store the weight of george by reference, like older models do
+    value_node = odapi.get_slot(george, "weight")
+    value_name, value_type = odapi.get_name(value_node), odapi.get_type(value_node)
+    referred_model = state.create_node()
+    Integer(referred_model, state).create(odapi.get_slot_value(george, "weight"))
+    odapi.delete(value_node)
+    value_node = bottom.create_node(str(referred_model))
+    bottom.create_edge(m, value_node, value_name)
+    bottom.create_edge(value_node, value_type, "Morphism")
+    link = bottom.create_edge(george, value_node)
+    bottom.create_edge(m, link, "george_weight")
+    bottom.create_edge(link, odapi.cdapi.find_attribute_type("Man", "weight"), "Morphism")
+    odapi.reindex()
+    weight = odapi.get_slot_value(george, "weight")
+    assert od.get_referred_model(bottom, odapi.get_slot(george, "weight")) == referred_model
+
+    assert od.migrate_to_inline(bottom, m, mm) == 1
+    odapi.reindex()
+    value_node = odapi.get_slot(george, "weight")
+    assert od.get_referred_model(bottom, value_node) == None
+    assert state.read_value(value_node) == weight
+    assert odapi.get_name(value_node) == value_name
+    assert odapi.get_slot_value(george, "weight") == weight
+    assert state.read_edge(odapi.get("george_weight")) == (george, value_node)
+    assert Conformance(state, m, mm).check_nominal() == []
+    # nothing left to convert
+    assert od.migrate_to_inline(bottom, m, mm) == 0
+
+def test_bool_is_not_an_integer(model):
+    state, m, mm = model
+    odapi = ODAPI(state, m, mm)
+    bill = odapi.get("bill")
+    # (ODAPI.set_slot_value would store a bool as a Boolean)
+    value = odapi.od.create_integer_value("bill.weight", True)
+    odapi.od._create_link("bill_weight", odapi.cdapi.find_attribute_type("Man", "weight"), bill, value)
+    errors = Conformance(state, m, mm).check_nominal()
+    assert len(errors) == 1 and "Integer" in errors[0], errors
@@ -0,0 +1,63 @@
+# Compares the performance of cloning a model by rendering+parsing it, with copying it directly in the state graph.
+# Run from the root of the repository:
+#   python -m examples.performance.clone_runner
+
+import time
+
+from state.devstate import DevState
+from bootstrap.scd import bootstrap_scd
+from framework.conformance import Conformance, render_conformance_check_result
+from concrete_syntax.textual_od.renderer import render_od
+from transformation.cloner import clone_od, clone_od_textual
+from util import loader
+from examples.cbd import models as cbd_models
+
+import os
+THIS_DIR = os.path.dirname(__file__)
+
+ITERATIONS = 50
+
+def load_petrinet(state, scd_mmm):
+    def read_file(filename):
+        with open(THIS_DIR+'/../petrinet/'+filename) as file:
+            return file.read()
+    mm_rt_cs = read_file('metamodels/mm_design.od') + read_file('metamodels/mm_runtime.od')
+    m_rt_cs = read_file('models/m_example_mutex.od') + read_file('models/m_example_mutex_rt_initial.od')
+    mm_rt = loader.parse_and_check(state, mm_rt_cs, scd_mmm, "Petri-Net Runtime meta-model")
+    m_rt = loader.parse_and_check(state, m_rt_cs, mm_rt, "Petri-Net mutex initial state")
+    return (mm_rt, m_rt)
+
+def load_cbd(state, scd_mmm):
+    _, mm_rt, _, m_rt_initial = cbd_models.load_fibonacci(state, scd_mmm)
+    return (mm_rt, m_rt_initial)
+
+def bench(clone_fn, state, m, mm):
+    time_start = time.perf_counter_ns()
+    for i in range(ITERATIONS):
+        cloned_m = clone_fn(state, m, mm)
+    time_end = time.perf_counter_ns()
+    return cloned_m, (time_end - time_start)/ITERATIONS/1000000
+
+if __name__ == "__main__":
+    state = DevState()
+    scd_mmm = bootstrap_scd(state)
+
+    for descr, load in [("Petri Net (mutex)", load_petrinet), ("CBD (fibonacci)", load_cbd)]:
+        mm, m = load(state, scd_mmm)
+
+        # sanity check: both clones must be identical to the original
+        expected = sorted(render_od(state, m, mm, hide_names=False).split('\n'))
+        for clone_fn in [clone_od_textual, clone_od]:
+            cloned_m = clone_fn(state, m, mm)
+            if sorted(render_od(state, cloned_m, mm, hide_names=False).split('\n')) != expected:
+                raise Exception(f"{clone_fn.__name__}: clone differs from original")
+            errors = Conformance(state, cloned_m, mm).check_nominal()
+            if len(errors) > 0:
+                raise Exception(f"{clone_fn.__name__}: " + render_conformance_check_result(errors))
+
+        _, textual_ms = bench(clone_od_textual, state, m, mm)
+        _, structural_ms = bench(clone_od, state, m, mm)
+        print(f"{descr}:")
+        print(f"  render+parse: {textual_ms:.3f} ms per clone")
+        print(f"  structural:   {structural_ms:.3f} ms per clone")
+        print(f"  speedup:      {textual_ms/structural_ms:.1f}x")
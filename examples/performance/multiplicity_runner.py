@@ -0,0 +1,133 @@
+# Measures the multiplicity check of the conformance checker on a large generated model (100k links).
+# Compares a one-shot check (counting all links in a single pass), a check with an existing ODAPI (using its adjacency index),
+# and the way multiplicities used to be checked (scanning and reading the type of every edge of every object).
+# Run from the root of the repository:
+#   python -m examples.performance.multiplicity_runner
+
+import gc
+import random
+import time
+
+from state.devstate import DevState
+from bootstrap.scd import bootstrap_scd
+from framework.conformance import Conformance
+from api.od import ODAPI
+from util import loader
+
+NUM_OBJECTS = 10000
+NUM_LINKS = 100000
+
+mm_cs = """
+    Person:Class
+    Student:Class
+    :Inheritance (Student -> Person)
+    Course:Class
+
+    follows:Association (Person -> Course) {
+        target_lower_cardinality = 1;
+        target_upper_cardinality = 15;
+    }
+    # every student follows at least one course, but also has a mentor
+    mentor:Association (Student -> Person) {
+        target_upper_cardinality = 1;
+        source_upper_cardinality = 20;
+    }
+    Person_age:AttributeLink (Person -> Integer) {
+        name = "age";
+        optional = False;
+    }
+"""
+
+def generate_model(state, mm):
+    r = random.Random(0)
+    m = state.create_node()
+    odapi = ODAPI(state, m, mm)
+    with odapi.batch():
+        persons = [odapi.create_object(f"person{i}", "Student" if i % 2 else "Person") for i in range(NUM_OBJECTS)]
+        courses = [odapi.create_object(f"course{i}", "Course") for i in range(NUM_OBJECTS // 10)]
+        for i, person in enumerate(persons):
+            if i % 100 != 0: # some persons have no age
+                odapi.set_slot_value(person, "age", 20)
+        students = persons[1::2]
+        for i in range(NUM_LINKS - len(persons)):
+            if i % 10 == 0:
+                odapi.create_link(None, "mentor", r.choice(students), r.choice(persons))
+            else:
+                odapi.create_link(None, "follows", r.choice(persons), r.choice(courses))
+    return m
+
+# The multiplicity check as it used to be (before the ODAPI had a type index and an adjacency index):
+# the links of every object are counted by scanning all its edges, and reading the type of every edge.
+def check_multiplicities_scanning(conf):
+    conf.precompute_multiplicities()
+    def get_type_name(edge):
+        return conf.odapi.get_name(conf.odapi.get_type(edge))
+    def get_all_instances(type_name):
+        return [(obj_name, conf.bottom.read_outgoing_elements(conf.model, obj_name)[0])
+            for sub_type_name in conf.cdapi.transitive_sub_types[type_name]
+                for obj_name in conf.odapi.type_to_objs[sub_type_name]]
+    def count(edges, assoc_name):
+        result = 0
+        for edge in edges:
+            try:
+                type_name = get_type_name(edge)
+            except:
+                continue # not all edges are typed
+            if conf.cdapi.is_subtype(super_type_name=assoc_name, sub_type_name=type_name):
+                result += 1
+        return result
+    errors = []
+    for assoc_name, _ in conf.type_odapi.get_all_instances("Association") + conf.type_odapi.get_all_instances("AttributeLink"):
+        assoc = conf.cdapi.get(assoc_name)
+        if assoc_name in conf.source_multiplicities:
+            lc, uc = conf.source_multiplicities[assoc_name]
+            for obj_name, obj in get_all_instances(conf.odapi.mm_obj_to_name[conf.bottom.read_edge_target(assoc)]):
+                n = count(conf.bottom.read_incoming_edges(obj), assoc_name)
+                if n < lc or n > uc:
+                    errors.append(f"Source cardinality of type '{assoc_name}' ({n}) out of bounds ({lc}..{uc}) in '{obj_name}'.")
+        if assoc_name in conf.target_multiplicities:
+            lc, uc = conf.target_multiplicities[assoc_name]
+            for obj_name, obj in get_all_instances(conf.odapi.mm_obj_to_name[conf.bottom.read_edge_source(assoc)]):
+                n = count(conf.bottom.read_outgoing_edges(obj), assoc_name)
+                if n < lc or n > uc:
+                    errors.append(f"Target cardinality of type '{assoc_name}' ({n}) out of bounds ({lc}..{uc}) in '{obj_name}'.")
+    return errors
+
+# (the garbage collector is disabled while measuring, because its run time, on a state with millions of objects, varies wildly)
+def bench(check, conf):
+    gc.collect()
+    gc.disable()
+    try:
+        time_start = time.perf_counter_ns()
+        errors = check(conf)
+        return errors, (time.perf_counter_ns() - time_start)/1000000
+    finally:
+        gc.enable()
+
+if __name__ == "__main__":
+    state = DevState()
+    scd_mmm = bootstrap_scd(state)
+    mm = loader.parse_and_check(state, mm_cs, scd_mmm, "University meta-model")
+
+    time_start = time.perf_counter_ns()
+    m = generate_model(state, mm)
+    print(f"Generated model with {NUM_LINKS} links in {(time.perf_counter_ns() - time_start)/1000000000:.1f} s")
+
+    odapi, odapi_ms = bench(lambda _: ODAPI(state, m, mm), None)
+
+    # one-shot check: counts the links in a single pass over all links
+    counting_errors, counting_ms = bench(Conformance.check_multiplicities, Conformance(state, m, mm))
+    scanning_errors, scanning_ms = bench(check_multiplicities_scanning, Conformance(state, m, mm))
+    # with an existing ODAPI: the first check builds its adjacency index, which is reused by later checks
+    conf = Conformance(state, m, mm, odapi=odapi)
+    errors, first_ms = bench(Conformance.check_multiplicities, conf)
+    _, indexed_ms = bench(Conformance.check_multiplicities, conf)
+    if not (sorted(errors) == sorted(counting_errors) == sorted(scanning_errors)):
+        raise Exception("All ways of checking multiplicities should give the same errors")
+
+    print(f"{len(errors)} multiplicity errors")
+    print(f"  (building the ODAPI of the model, needed by every conformance check: {odapi_ms:.0f} ms)")
+    print(f"  scanning all edges of every object (old):  {scanning_ms:.0f} ms")
+    print(f"  counting in a single pass (one-shot):      {counting_ms:.0f} ms")
+    print(f"  existing ODAPI, first check (builds index): {first_ms:.0f} ms")
+    print(f"  existing ODAPI, indexed:                    {indexed_ms:.0f} ms")
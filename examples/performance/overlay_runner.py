@@ -0,0 +1,42 @@
+# Measures the cost of forking a model with an OverlayState (as make_actions_pure does for every candidate action),
+# depending on the size of the delta of the overlay that is forked, and compares it with cloning the model.
+# Run from the root of the repository:
+#   python -m examples.performance.overlay_runner
+
+import time
+
+from state.devstate import DevState
+from state.overlaystate import OverlayState
+from bootstrap.scd import bootstrap_scd
+from api.od import ODAPI
+from transformation.cloner import clone_od
+from examples.performance.clone_runner import load_petrinet
+
+ITERATIONS = 200
+
+def bench(fn):
+    time_start = time.perf_counter_ns()
+    for i in range(ITERATIONS):
+        fn()
+    return (time.perf_counter_ns() - time_start)/ITERATIONS/1000000
+
+if __name__ == "__main__":
+    base = DevState()
+    scd_mmm = bootstrap_scd(base)
+    mm, m = load_petrinet(base, scd_mmm)
+    print(f"base: {len(base.nodes) + len(base.edges)} elements")
+
+    overlay = OverlayState(base)
+    odapi = ODAPI(overlay, m, mm)
+    places = len(odapi.get_all_instances("PNPlace"))
+    # grow the delta of the overlay, as a simulation does with every step
+    for objects in [0, 10, 100, 1000]:
+        while len(odapi.get_all_instances("PNPlace")) < places + objects:
+            odapi.create_object(f"extra{len(overlay.nodes)}", "PNPlace")
+        materializes = overlay._delta_size() > max(OverlayState.MATERIALIZE_MIN, overlay._base_size() // OverlayState.MATERIALIZE_FRACTION)
+        fork_ms = bench(lambda: OverlayState(overlay))
+        print(f"delta of {overlay._delta_size():5} elements: fork {fork_ms:.3f} ms" + (" (materializes)" if materializes else ""))
+
+    # (last, because the clones are added to the base)
+    clone_ms = bench(lambda: clone_od(base, m, mm))
+    print(f"clone_od: {clone_ms:.3f} ms")
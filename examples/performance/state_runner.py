@@ -0,0 +1,62 @@
+# Compares memory usage and throughput of the State implementations.
+# Run from the root of the repository:
+#   python -m examples.performance.state_runner
+
+import time
+import tracemalloc
+
+from state.pystate import PyState
+from state.devstate import DevState
+from state.compactstate import CompactState
+from bootstrap.scd import bootstrap_scd
+from framework.conformance import Conformance, render_conformance_check_result
+from concrete_syntax.textual_od.renderer import render_od
+from examples.performance.clone_runner import load_petrinet, load_cbd
+
+ITERATIONS = 5
+
+# Bootstraps the meta-meta-model and loads (and checks) all example models
+def load_all(state):
+    scd_mmm = bootstrap_scd(state)
+    return [load(state, scd_mmm) for load in [load_petrinet, load_cbd]]
+
+def bench(state_class):
+    # memory
+    tracemalloc.start()
+    state = state_class()
+    models = load_all(state)
+    mem, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # time
+    time_start = time.perf_counter_ns()
+    for i in range(ITERATIONS):
+        load_all(state_class())
+    load_ms = (time.perf_counter_ns() - time_start)/ITERATIONS/1000000
+
+    time_start = time.perf_counter_ns()
+    for i in range(ITERATIONS):
+        for mm, m in models:
+            errors = Conformance(state, m, mm).check_nominal()
+            if len(errors) > 0:
+                raise Exception(f"{state_class.__name__}: " + render_conformance_check_result(errors))
+    check_ms = (time.perf_counter_ns() - time_start)/ITERATIONS/1000000
+
+    rendered = [sorted(render_od(state, m, mm, hide_names=True).split('\n')) for mm, m in models]
+    num_elements = len(state.kind) if isinstance(state, CompactState) else len(state.nodes) + len(state.edges)
+    return rendered, num_elements, mem, load_ms, check_ms
+
+if __name__ == "__main__":
+    expected = None
+    for state_class in [PyState, DevState, CompactState]:
+        rendered, num_elements, mem, load_ms, check_ms = bench(state_class)
+        # sanity check: all states must produce the same models
+        if expected == None:
+            expected = rendered
+        elif rendered != expected:
+            raise Exception(f"{state_class.__name__}: models differ")
+        print(f"{state_class.__name__}:")
+        print(f"  elements:    {num_elements}")
+        print(f"  memory:      {mem/1024/1024:.2f} MB ({mem/num_elements:.0f} bytes per element)")
+        print(f"  load:        {load_ms:.1f} ms")
+        print(f"  conformance: {check_ms:.1f} ms")
@@ -8,6 +8,8 @@ from framework.conformance import Conformance, render_conformance_check_result
 from concrete_syntax.common import indent
 from concrete_syntax.textual_od.renderer import render_od
 from transformation.cloner import clone_od
+from state.pystate import PyState
+from state.overlaystate import OverlayState
 from api.od import ODAPI
 
 from util.simulator import MinimalSimulator, DecisionMaker, RandomDecisionMaker, InteractiveDecisionMaker
@@ -38,7 +40,7 @@ class Simulator(MinimalSimulator):
         self._print(indent(self.renderer(od), 2))
         self._print("--------------")
         if self.check_conformance:
-            conf = Conformance(od.state, od.m, od.mm)
+            conf = Conformance(od.state, od.m, od.mm, odapi=od)
             self._print(render_conformance_check_result(conf.check_nominal()))
             self._print()
         return self.actual_termination_condition(od)
@@ -46,8 +48,15 @@ class Simulator(MinimalSimulator):
 def make_actions_pure(actions, od):
     # Copy model before modifying it
     def exec_pure(action, od):
-        cloned_rt_m = clone_od(od.state, od.m, od.mm)
-        new_od = ODAPI(od.state, cloned_rt_m, od.mm)
+        if isinstance(od.state, (PyState, OverlayState)):
+            # Copy-on-write: the action's changes are recorded in an overlay, the original state is left untouched.
+            # If od.state is itself an overlay (e.g., created in an earlier step), its delta is copied, so this takes time proportional
+            # to that delta, which is at most max(MATERIALIZE_MIN, base / MATERIALIZE_FRACTION) elements (see OverlayState).
+            # (e.g., 0.6 ms for a delta of 700 elements, compared to 2.9 ms to clone the Petri net example, see examples/performance/overlay_runner.py)
+            new_od = ODAPI(OverlayState(od.state), od.m, od.mm)
+        else:
+            cloned_rt_m = clone_od(od.state, od.m, od.mm)
+            new_od = ODAPI(od.state, cloned_rt_m, od.mm)
         msgs = action(new_od)
         return (new_od, msgs)
 
@@ -61,7 +70,8 @@ def filter_valid_actions(pure_actions):
     for name, callback in pure_actions:
         # print(f"attempt '{name}' ...", end='\r')
         (new_od, msgs) = callback()
-        conf = Conformance(new_od.state, new_od.m, new_od.mm)
+        # (the action modified new_od through the ODAPI, so its indexes are up to date)
+        conf = Conformance(new_od.state, new_od.m, new_od.mm, odapi=new_od)
         errors = conf.check_nominal()
         # erase current line:
         # print("                                                                                ", end='\r')
@@ -1,15 +1,20 @@
 from services.bottom.V0 import Bottom
-from services.primitives.actioncode_type import ActionCode
+from services import od
 from uuid import UUID
 from state.base import State
 from typing import Dict, Tuple, Set, Any, List
 from pprint import pprint
 import traceback
+import sys
+import os
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from concrete_syntax.common import indent
 
 from util.eval import exec_then_eval
 
-from api.cd import CDAPI
+from api.cd import get_cdapi
 from api.od import ODAPI, bind_api_readonly
 
 import functools
@@ -25,20 +30,33 @@ def render_conformance_check_result(error_list):
 
 class Conformance:
     # Parameter 'constraint_check_subtypes': whether to check local type-level constraints also on subtypes.
-    def __init__(self, state: State, model: UUID, type_model: UUID, constraint_check_subtypes=True):
+    # Parameter 'parallel': whether to evaluate local constraints in a pool of 'max_workers' processes (default: number of CPUs).
+    #   The processes are forked from this process, so they get a copy-on-write snapshot of the state, and a copy of this Conformance.
+    #   They are forked when first needed, and reused by later checks as long as the state is unchanged (otherwise, they are forked again).
+    #   Forking takes a few milliseconds, so this is only worth it for models with many (thousands of) constrained objects.
+    #   If processes cannot be forked on this platform, the constraints are evaluated in this process instead. Call 'shutdown' when done.
+    # Parameter 'odapi': an existing ODAPI of the model, whose (up to date) indexes are reused, instead of building new ones.
+    #   Links are then counted with the adjacency index of the ODAPI, which is worth building (once) if the model is checked repeatedly.
+    def __init__(self, state: State, model: UUID, type_model: UUID, constraint_check_subtypes=True, parallel=False, max_workers=None, odapi: ODAPI = None):
         self.state = state
         self.bottom = Bottom(state)
         self.model = model
         self.type_model = type_model
         self.constraint_check_subtypes = constraint_check_subtypes
+        # without fork, the state would have to be pickled
+        self.parallel = parallel and "fork" in multiprocessing.get_all_start_methods()
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.executor = None
+        self.executor_version = None # version of the state when the processes were forked
 
         # MCL
         type_model_id = state.read_dict(state.read_root(), "SCD")
         self.scd_model = UUID(state.read_value(type_model_id))
 
         # Helpers
-        self.cdapi = CDAPI(state, type_model)
-        self.odapi = ODAPI(state, model, type_model)
+        self.cdapi = get_cdapi(state, type_model)
+        self.odapi = odapi if odapi != None else ODAPI(state, model, type_model)
+        self.use_odapi_adjacency = odapi != None
         self.type_odapi = ODAPI(state, type_model, self.scd_model)
 
         # Pre-computed:
@@ -97,6 +115,10 @@ class Conformance:
         Creates an internal representation of type multiplicities that is
         more easily queryable that the state graph
         """
+        self.abstract_types = []
+        self.multiplicities = {}
+        self.source_multiplicities = {}
+        self.target_multiplicities = {}
         for clss_name, clss in self.type_odapi.get_all_instances("Class"):
             abstract = self.type_odapi.get_slot_value_default(clss, "abstract", default=False)
             if abstract:
@@ -135,10 +157,18 @@ class Conformance:
         # Recursively do a conformance check for each ModelRef
         for ref_name, ref in self.type_odapi.get_all_instances("ModelRef"):
             sub_mm = UUID(self.bottom.read_value(ref))
+            key = od.PRIMITIVE_KEYS.get(ref_name)
             for ref_inst_name, ref_inst in self.odapi.get_all_instances(ref_name):
-                sub_m = UUID(self.bottom.read_value(ref_inst))
-                nested_errors = Conformance(self.state, sub_m, sub_mm).check_nominal()
-                errors += [f"In ModelRef ({ref_name}):" + err for err in nested_errors]
+                def check_instance():
+                    if key != None and od.get_referred_model(self.bottom, ref_inst) == None:
+                        # primitive value stored inline - there is no model to check
+                        if not od.is_primitive_value(ref_name, od.read_modelref_value(self.bottom, ref_inst, key)):
+                            return [f"In ModelRef ({ref_name}): Value of '{ref_inst_name}' is not of type {ref_name}"]
+                        return []
+                    sub_m = UUID(self.bottom.read_value(ref_inst))
+                    nested_errors = Conformance(self.state, sub_m, sub_mm).check_nominal()
+                    return [f"In ModelRef ({ref_name}):" + err for err in nested_errors]
+                errors += self._check_element(("typing", ref_inst), ref_inst, check_instance)
 
         return errors
 
@@ -149,26 +179,32 @@ class Conformance:
         errors = []
         for tm_name, tm_element in self.type_odapi.get_all_instances("Association") + self.type_odapi.get_all_instances("AttributeLink"):
             for m_name, m_element in self.odapi.get_all_instances(tm_name):
-                m_source = self.bottom.read_edge_source(m_element)
-                m_target = self.bottom.read_edge_target(m_element)
-                if m_source == None or m_target == None:
-                    # element is not a link
-                    continue
-                # tm_element, = self.bottom.read_outgoing_elements(self.type_model, tm_name)
-                tm_source = self.bottom.read_edge_source(tm_element)
-                tm_target = self.bottom.read_edge_target(tm_element)
-                # check if source is typed correctly
-                # source_name = self.odapi.m_obj_to_name[m_source]
-                source_type_actual = self.odapi.get_type_name(m_source)
-                source_type_expected = self.odapi.mm_obj_to_name[tm_source]
-                if not self.cdapi.is_subtype(super_type_name=source_type_expected, sub_type_name=source_type_actual):
-                    errors.append(f"Invalid source type '{source_type_actual}' for link '{m_name}:{tm_name}'")
-                # check if target is typed correctly
-                # target_name = self.odapi.m_obj_to_name[m_target]
-                target_type_actual = self.odapi.get_type_name(m_target)
-                target_type_expected = self.odapi.mm_obj_to_name[tm_target]
-                if not self.cdapi.is_subtype(super_type_name=source_type_expected, sub_type_name=source_type_actual):
-                    errors.append(f"Invalid target type '{target_type_actual}' for link '{m_name}:{tm_name}'")
+                errors += self._check_element(("link_typing", m_element), m_element,
+                    functools.partial(self._check_link_typing, tm_name, tm_element, m_name, m_element))
+        return errors
+
+    def _check_link_typing(self, tm_name, tm_element, m_name, m_element):
+        errors = []
+        m_source = self.bottom.read_edge_source(m_element)
+        m_target = self.bottom.read_edge_target(m_element)
+        if m_source == None or m_target == None:
+            # element is not a link
+            return errors
+        # tm_element, = self.bottom.read_outgoing_elements(self.type_model, tm_name)
+        tm_source = self.bottom.read_edge_source(tm_element)
+        tm_target = self.bottom.read_edge_target(tm_element)
+        # check if source is typed correctly
+        # source_name = self.odapi.m_obj_to_name[m_source]
+        source_type_actual = self.odapi.get_type_name(m_source)
+        source_type_expected = self.odapi.mm_obj_to_name[tm_source]
+        if not self.cdapi.is_subtype(super_type_name=source_type_expected, sub_type_name=source_type_actual):
+            errors.append(f"Invalid source type '{source_type_actual}' for link '{m_name}:{tm_name}'")
+        # check if target is typed correctly
+        # target_name = self.odapi.m_obj_to_name[m_target]
+        target_type_actual = self.odapi.get_type_name(m_target)
+        target_type_expected = self.odapi.mm_obj_to_name[tm_target]
+        if not self.cdapi.is_subtype(super_type_name=source_type_expected, sub_type_name=source_type_actual):
+            errors.append(f"Invalid target type '{target_type_actual}' for link '{m_name}:{tm_name}'")
         return errors
 
     def check_multiplicities(self):
@@ -176,6 +212,11 @@ class Conformance:
         Check whether multiplicities for all types are respected
         """
         self.precompute_multiplicities()
+        if self.use_odapi_adjacency:
+            count_incoming = functools.partial(self.odapi.count_incoming, include_subtypes=True)
+            count_outgoing = functools.partial(self.odapi.count_outgoing, include_subtypes=True)
+        else:
+            count_incoming, count_outgoing = self._count_links()
         errors = []
         for class_name, clss in self.type_odapi.get_all_instances("Class"):
         # for type_name in self.odapi.mm_obj_to_name.values():
@@ -200,10 +241,13 @@ class Conformance:
                 tgt_type_name = self.odapi.mm_obj_to_name[tgt_type_obj]
                 lc, uc = self.source_multiplicities[assoc_name]
                 for obj_name, obj in self.odapi.get_all_instances(tgt_type_name, include_subtypes=True):
-                    # obj's type has this incoming association -> now we will count the number of links typed by it
-                    count = len(self.odapi.get_incoming(obj, assoc_name, include_subtypes=True))
-                    if count < lc or count > uc:
-                        errors.append(f"Source cardinality of type '{assoc_name}' ({count}) out of bounds ({lc}..{uc}) in '{obj_name}'.")
+                    def check_source_cardinality():
+                        # obj's type has this incoming association -> now we will count the number of links typed by it
+                        count = count_incoming(obj, assoc_name)
+                        if count < lc or count > uc:
+                            return [f"Source cardinality of type '{assoc_name}' ({count}) out of bounds ({lc}..{uc}) in '{obj_name}'."]
+                        return []
+                    errors += self._check_element(("source_cardinality", assoc_name, obj), obj, check_source_cardinality)
 
             # association/attribute target multiplicities
             if assoc_name in self.target_multiplicities:
@@ -213,12 +257,33 @@ class Conformance:
                 src_type_name = self.odapi.mm_obj_to_name[src_type_obj]
                 lc, uc = self.target_multiplicities[assoc_name]
                 for obj_name, obj in self.odapi.get_all_instances(src_type_name, include_subtypes=True):
-                    # obj's type has this outgoing association -> now we will count the number of links typed by it
-                    count = len(self.odapi.get_outgoing(obj, assoc_name, include_subtypes=True))
-                    if count < lc or count > uc:
-                        errors.append(f"Target cardinality of type '{assoc_name}' ({count}) out of bounds ({lc}..{uc}) in '{obj_name}'.")
+                    def check_target_cardinality():
+                        # obj's type has this outgoing association -> now we will count the number of links typed by it
+                        count = count_outgoing(obj, assoc_name)
+                        if count < lc or count > uc:
+                            return [f"Target cardinality of type '{assoc_name}' ({count}) out of bounds ({lc}..{uc}) in '{obj_name}'."]
+                        return []
+                    errors += self._check_element(("target_cardinality", assoc_name, obj), obj, check_target_cardinality)
         return errors
 
+    # Counts the links of every object, per type, in a single pass over all links of the model.
+    # Returns functions (object, association name) -> number of incoming/outgoing links typed by the association or one of its subtypes.
+    def _count_links(self):
+        outgoing = {} # object -> type name -> number of links
+        incoming = {}
+        read_edge = self.state.read_edge
+        for element, tm_name in self.odapi.m_obj_to_type.items():
+            src, tgt = read_edge(element)
+            if src != None:
+                counts = outgoing.setdefault(src, {})
+                counts[tm_name] = counts.get(tm_name, 0) + 1
+                counts = incoming.setdefault(tgt, {})
+                counts[tm_name] = counts.get(tm_name, 0) + 1
+        def count(adjacency, obj, assoc_name):
+            types = self.cdapi.transitive_sub_types[assoc_name]
+            return sum(n for type_name, n in adjacency.get(obj, {}).items() if type_name in types)
+        return functools.partial(count, incoming), functools.partial(count, outgoing)
+
     def check_constraints(self):
         """
         Check whether all constraints defined for a model are respected
@@ -229,37 +294,25 @@ class Conformance:
             constraints = self.bottom.read_outgoing_elements(self.type_model, f"{tm_name}.constraint")
             if len(constraints) == 1:
                 constraint = constraints[0]
-                code = ActionCode(UUID(self.bottom.read_value(constraint)), self.bottom.state).read()
+                code = od.read_modelref_value(self.bottom, constraint, "code")
                 return code
 
-        def check_result(result, description):
-            if result == None:
-                return # OK
-            if isinstance(result, str):
-                errors.append(f"{description} not satisfied. Reason: {result}")
-            elif isinstance(result, bool):
-                if not result:
-                    errors.append(f"{description} not satisfied.")
-            elif isinstance(result, list):
-                if len(result) > 0:
-                    reasons = indent('\n'.join(result), 4)
-                    errors.append(f"{description} not satisfied. Reasons:\n{reasons}")
-            else:
-                raise Exception(f"{description} evaluation result should be boolean or string! Instead got {result}")
-
         # local constraints
+        local_constraints = [] # (type name, code, description, obj)
         for type_name in self.bottom.read_keys(self.type_model):
             code = get_code(type_name)
             if code != None:
                 instances = self.odapi.get_all_instances(type_name, include_subtypes=self.constraint_check_subtypes)
                 for obj_name, obj_id in instances:
                     description = f"Local constraint of \"{type_name}\" in \"{obj_name}\""
-                    # print(description)
-                    try:
-                        result = exec_then_eval(code, _globals=bind_api_readonly(self.odapi), _locals={'this': obj_id}) # may raise
-                        check_result(result, description)
-                    except:
-                        errors.append(f"Runtime error during evaluation of {description}:\n{indent(traceback.format_exc(), 6)}")
+                    local_constraints.append((type_name, code, description, obj_id))
+        if self.parallel:
+            errors += self._check_local_constraints_parallel(local_constraints)
+        else:
+            for type_name, code, description, obj_id in local_constraints:
+                # print(description)
+                errors += self._check_element(("constraint", type_name, obj_id), obj_id,
+                    functools.partial(self._check_constraint, code, description, {'this': obj_id}))
 
         # global constraints
         glob_constraints = []
@@ -277,13 +330,64 @@ class Conformance:
             code = get_code(tm_name)
             if code != None:
                 description = f"Global constraint \"{tm_name}\""
-                try:
-                    result = exec_then_eval(code, _globals=bind_api_readonly(self.odapi)) # may raise
-                    check_result(result, description)
-                except:
-                    errors.append(f"Runtime error during evaluation of {description}:\n{indent(traceback.format_exc(), 6)}")
+                errors += self._check_constraint(code, description, {})
+        return errors
+
+    def _check_constraint(self, code, description, _locals):
+        errors = []
+        try:
+            result = exec_then_eval(code, _globals=self._get_api(), _locals=_locals) # may raise
+            if result == None:
+                pass # OK
+            elif isinstance(result, str):
+                errors.append(f"{description} not satisfied. Reason: {result}")
+            elif isinstance(result, bool):
+                if not result:
+                    errors.append(f"{description} not satisfied.")
+            elif isinstance(result, list):
+                if len(result) > 0:
+                    reasons = indent('\n'.join(result), 4)
+                    errors.append(f"{description} not satisfied. Reasons:\n{reasons}")
+            else:
+                raise Exception(f"{description} evaluation result should be boolean or string! Instead got {result}")
+        except:
+            errors.append(f"Runtime error during evaluation of {description}:\n{indent(self._format_exc(), 6)}")
         return errors
 
+    def _format_exc(self):
+        return traceback.format_exc()
+
+    def _check_local_constraints_parallel(self, local_constraints):
+        # Every process gets a contiguous part of the constraints, so the errors can be concatenated in the same order as a serial check.
+        # (A few parts per process, to balance the load.)
+        chunk_size = max(1, math.ceil(len(local_constraints) / (self.max_workers*4)))
+        chunks = [[(code, description, obj_id) for _, code, description, obj_id in local_constraints[i:i+chunk_size]]
+            for i in range(0, len(local_constraints), chunk_size)]
+        if len(chunks) == 0:
+            return []
+        version = self.state.read_version()
+        if self.executor == None or self.executor_version != version:
+            self.shutdown()
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("fork"),
+                initializer=_init_constraint_worker, initargs=(self,))
+            self.executor_version = version
+        return [err for chunk_errors in self.executor.map(_check_local_constraints, chunks) for err in chunk_errors]
+
+    # Stops the processes of the parallel mode
+    def shutdown(self):
+        if self.executor != None:
+            self.executor.shutdown()
+            self.executor = None
+
+    # Check one element of the model. 'check' returns the list of errors.
+    # Overridden by IncrementalConformance, to reuse the errors of an earlier check of the same element.
+    def _check_element(self, key, element, check):
+        return check()
+
+    # API that is passed to constraints
+    def _get_api(self):
+        return bind_api_readonly(self.odapi)
+
     def precompute_structures(self):
         """
         Make an internal representation of type structures such that comparing type structures is easier
@@ -313,13 +417,9 @@ class Conformance:
                 name_model_node, = filter(lambda x: self.odapi.m_obj_to_name.get(x, "").endswith(".name"), attrs)
                 opt_model_node, = filter(lambda x: self.odapi.m_obj_to_name.get(x, "").endswith(".optional"), attrs)
                 # get attr name value
-                name_model = UUID(self.bottom.read_value(name_model_node))
-                name_node, = self.bottom.read_outgoing_elements(name_model)
-                name = self.bottom.read_value(name_node)
+                name = od.read_modelref_value(self.bottom, name_model_node, "string")
                 # get attr opt value
-                opt_model = UUID(self.bottom.read_value(opt_model_node))
-                opt_node, = self.bottom.read_outgoing_elements(opt_model)
-                opt = self.bottom.read_value(opt_node)
+                opt = od.read_modelref_value(self.bottom, opt_model_node, "boolean")
                 # get attr type name
                 source_type_node = self.bottom.read_edge_source(tm_element)
                 source_type_name = self.odapi.mm_obj_to_name[source_type_node]
@@ -346,9 +446,7 @@ class Conformance:
             if class_abs_element == morphism:
                 # retrieve 'abstract' attribute value
                 target_node = self.bottom.read_edge_target(tm_element)
-                abst_model = UUID(self.bottom.read_value(target_node))
-                abst_node, = self.bottom.read_outgoing_elements(abst_model)
-                is_abstract = self.bottom.read_value(abst_node)
+                is_abstract = od.read_modelref_value(self.bottom, target_node, "boolean")
                 # retrieve type name
                 source_node = self.bottom.read_edge_source(tm_element)
                 type_name = self.odapi.mm_obj_to_name[source_node]
@@ -384,9 +482,14 @@ class Conformance:
                             if ref_element in morphisms:
                                 # check conformance of reference model
                                 type_model_uuid = UUID(self.bottom.read_value(attr_tm))
-                                model_uuid = UUID(self.bottom.read_value(attr))
-                                attr_conforms = Conformance(self.state, model_uuid, type_model_uuid)\
-                                    .check_nominal()
+                                key = od.PRIMITIVE_KEYS.get(attr_type)
+                                if key != None and od.get_referred_model(self.bottom, attr) == None:
+                                    # primitive value stored inline
+                                    attr_conforms = od.is_primitive_value(attr_type, od.read_modelref_value(self.bottom, attr, key))
+                                else:
+                                    model_uuid = UUID(self.bottom.read_value(attr))
+                                    attr_conforms = Conformance(self.state, model_uuid, type_model_uuid)\
+                                        .check_nominal()
                             else:
                                 # eval constraints
                                 code = self.read_attribute(attr_tm, "constraint")
@@ -463,6 +566,114 @@ class Conformance:
                     pass
 
 
+# Every process of the parallel mode of Conformance has its own copy of the Conformance, and of the (read-only) state
+_worker_conformance = None
+
+def _init_constraint_worker(conformance):
+    global _worker_conformance
+    _worker_conformance = conformance
+
+def _check_local_constraints(chunk):
+    return [err
+        for code, description, obj_id in chunk
+            for err in _worker_conformance._check_constraint(code, description, {'this': obj_id})]
+
+
+# Conformance checker that can be run repeatedly on a model that changes, and only re-checks what may have changed.
+#
+# It listens to the changes made through the given ODAPI. If the model is modified in some other way, use check(full=True).
+# The errors of every element (its typing, link typing, multiplicities and local constraints) are remembered,
+# and only recomputed if the element, or anything that was read while checking it, has changed.
+# Local constraints are assumed to only read the model through the API they are given.
+# The class-level checks (abstract classes, class multiplicities) and global constraints are always performed.
+class IncrementalConformance(Conformance):
+    def __init__(self, odapi: ODAPI, constraint_check_subtypes=True):
+        super().__init__(odapi.state, odapi.m, odapi.mm, constraint_check_subtypes, odapi=odapi)
+        odapi.change_listeners.append(self.__on_change)
+
+        # key -> (errors, elements/names that were read)
+        # None: next check will be a full one
+        self.results = None
+        # elements, names and type names that changed since the last check
+        self.changed = set()
+        self.version = None
+        # number of element checks that were reused/recomputed
+        self.hits = 0
+        self.misses = 0
+
+        # during a check:
+        self.__new_results = None
+        self.__reads = None
+
+    def __on_change(self, name: str, element: UUID):
+        self.changed.add(element)
+        self.changed.add(name)
+        type_name = self.odapi.mm_obj_to_name.get(self.odapi.get_type(element))
+        if type_name != None:
+            # get_all_instances of a super type also returns the element
+            self.changed.update(self.cdapi.transitive_super_types.get(type_name, [type_name]))
+        src, tgt = self.state.read_edge(element)
+        if src != None:
+            # the number of incoming/outgoing links and the slots of the source and target change
+            self.changed.add(src)
+            self.changed.add(tgt)
+
+    def check(self, full=False):
+        if self.version != None and self.version != self.state.read_version() and len(self.changed) == 0:
+            # modified without us knowing
+            full = True
+        if full:
+            self.results = None
+        self.__new_results = {}
+        try:
+            errors = self.check_nominal()
+        finally:
+            self.results, self.__new_results = self.__new_results, None
+            self.changed = set()
+            self.version = self.state.read_version()
+        return errors
+
+    def _check_element(self, key, element, check):
+        if self.__new_results == None:
+            # not called from 'check'
+            return check()
+        if self.results != None and key in self.results:
+            errors, reads = self.results[key]
+            if reads.isdisjoint(self.changed):
+                self.hits += 1
+                self.__new_results[key] = (errors, reads)
+                return errors
+        self.misses += 1
+        self.__reads = set([element])
+        try:
+            errors = check()
+        finally:
+            reads, self.__reads = self.__reads, None
+        self.__new_results[key] = (errors, reads)
+        return errors
+
+    def _get_api(self):
+        api = super()._get_api()
+        if self.__reads == None:
+            return api
+        # Record the arguments of every call, so we know what the result of the check depends on.
+        # (Strings: names of elements and types, e.g., get("x"), get_all_instances("Clock"))
+        reads = self.__reads
+        def record(f):
+            def recording(*args, **kwargs):
+                reads.update(arg for arg in args if isinstance(arg, (UUID, str)))
+                return f(*args, **kwargs)
+            return recording
+        return { name: record(f) for name, f in api.items() }
+
+    def _format_exc(self):
+        # leave out our 'recording' functions, so errors are the same as those of a full check
+        exc = traceback.TracebackException(*sys.exc_info())
+        exc.stack = traceback.StackSummary.from_list(
+            [frame for frame in exc.stack if not (frame.filename == __file__ and frame.name == "recording")])
+        return ''.join(exc.format())
+
+
 if __name__ == '__main__':
     from state.devstate import DevState as State
     s = State()
@@ -0,0 +1,150 @@
+import pytest
+
+from state.pystate import PyState
+from state.overlaystate import OverlayState
+from bootstrap.scd import bootstrap_scd
+from util import loader
+from api.od import ODAPI
+from framework.conformance import Conformance, IncrementalConformance
+
+mm_cs = """
+    Clock:Class {
+        lower_cardinality = 1;
+        upper_cardinality = 1;
+    }
+    Clock_time:AttributeLink (Clock -> Integer) {
+        name = "time";
+        optional = False;
+    }
+    Man:Class {
+        upper_cardinality = 3;
+        constraint = `get_slot_value(this, "weight") > 20`;
+    }
+    Man_weight:AttributeLink (Man -> Integer) {
+        name = "weight";
+        optional = False;
+    }
+    Bear:Class
+    afraidOf:Association (Man -> Bear) {
+        target_lower_cardinality = 1;
+        source_upper_cardinality = 2;
+    }
+    # reads the clock, which is not connected to the link
+    afraidOf_since:AttributeLink (afraidOf -> Integer) {
+        name = "since";
+        optional = True;
+        constraint = ```
+            _, clock = get_all_instances("Clock")[0]
+            get_value(get_target(this)) <= get_slot_value(clock, "time")
+        ```;
+    }
+    heavyMen:GlobalConstraint {
+        constraint = `len([m for _, m in get_all_instances("Man") if get_slot_value(m, "weight") > 100]) <= 1`;
+    }
+"""
+
+m_cs = """
+    clock:Clock { time = 5; }
+    george:Man { weight = 80; }
+    bill:Man { weight = 70; }
+    teddy:Bear
+    :afraidOf (george -> teddy) { since = 3; }
+    :afraidOf (bill -> teddy)
+"""
+
+@pytest.fixture(params=[PyState, lambda: OverlayState(PyState())])
+def model(request):
+    state = request.param()
+    scd = bootstrap_scd(state)
+    mm = loader.parse_and_check(state, mm_cs, scd, "mm")
+    m = loader.parse_and_check(state, m_cs, mm, "m")
+    return state, m, mm
+
+def assert_same_errors(incremental, state, m, mm):
+    errors = incremental.check()
+    assert sorted(errors) == sorted(Conformance(state, m, mm).check_nominal())
+    assert errors == incremental.check(full=True)
+    return errors
+
+def test_incremental_conformance(model):
+    state, m, mm = model
+    odapi = ODAPI(state, m, mm)
+    incremental = IncrementalConformance(odapi)
+    assert assert_same_errors(incremental, state, m, mm) == []
+
+    # local constraint of the changed object
+    george = odapi.get("george")
+    odapi.set_slot_value(george, "weight", 10)
+    assert len(assert_same_errors(incremental, state, m, mm)) == 1
+    odapi.set_slot_value(george, "weight", 200)
+    assert assert_same_errors(incremental, state, m, mm) == []
+
+    # global constraint
+    odapi.set_slot_value(odapi.get("bill"), "weight", 150)
+    assert len(assert_same_errors(incremental, state, m, mm)) == 1
+
+    # class and association multiplicities
+    joe = odapi.create_object("joe", "Man")
+    odapi.set_slot_value(joe, "weight", 60)
+    assert len(assert_same_errors(incremental, state, m, mm)) == 2
+    odapi.create_link(None, "afraidOf", joe, odapi.get("teddy"))
+    assert len(assert_same_errors(incremental, state, m, mm)) == 2
+
+    # constraint that reads an element that is not connected to the checked element
+    odapi.set_slot_value(odapi.get("clock"), "time", 1)
+    assert len(assert_same_errors(incremental, state, m, mm)) == 3
+
+    # deletion
+    odapi.delete(odapi.get("teddy"))
+    assert len(assert_same_errors(incremental, state, m, mm)) == 4
+
+def test_incremental_conformance_reuses_results(model):
+    state, m, mm = model
+    odapi = ODAPI(state, m, mm)
+    incremental = IncrementalConformance(odapi)
+    incremental.check()
+    assert incremental.hits == 0
+    checked = incremental.misses
+
+    odapi.set_slot_value(odapi.get("bill"), "weight", 50)
+    incremental.misses = 0
+    assert incremental.check() == []
+    assert 0 < incremental.misses < checked
+
+    # nothing changed
+    incremental.misses = 0
+    assert incremental.check() == []
+    assert incremental.misses == 0
+
+def test_incremental_conformance_runtime_error(model):
+    state, m, mm = model
+    odapi = ODAPI(state, m, mm)
+    incremental = IncrementalConformance(odapi)
+    incremental.check()
+    # object without the slot that its constraint reads
+    odapi.create_object("joe", "Man")
+    errors = assert_same_errors(incremental, state, m, mm)
+    assert any(error.startswith("Runtime error") for error in errors)
+
+def test_conformance_reuses_odapi(model):
+    state, m, mm = model
+    odapi = ODAPI(state, m, mm)
+    def check():
+        conf = Conformance(state, m, mm, odapi=odapi)
+        assert conf.odapi is odapi
+        errors = conf.check_nominal()
+        assert sorted(errors) == sorted(Conformance(state, m, mm).check_nominal())
+        return errors
+    assert check() == []
+
+    # the links of every object are now indexed, and are updated by the following changes
+    joe = odapi.create_object("joe", "Man")
+    odapi.set_slot_value(joe, "weight", 60)
+    assert len(check()) == 1
+    link = odapi.create_link(None, "afraidOf", joe, odapi.get("teddy"))
+    assert len(check()) == 1 # now teddy is feared too much
+    odapi.delete(link)
+    assert len(check()) == 1
+    # (also deletes the links to teddy)
+    odapi.delete(odapi.get("teddy"))
+    assert len(check()) == 3
@@ -0,0 +1,66 @@
+import multiprocessing
+
+from state.pystate import PyState
+from state.overlaystate import OverlayState
+from bootstrap.scd import bootstrap_scd
+from util import loader
+from framework.conformance import Conformance
+
+mm_cs = """
+    A:Class {
+        constraint = ```
+            x = get_slot_value(this, "x")
+            if x % 7 == 0:
+                raise Exception("multiple of 7")
+            x % 5 != 0
+        ```;
+    }
+    A_x:AttributeLink (A -> Integer) {
+        name = "x";
+        optional = True;
+    }
+"""
+
+def test_parallel_conformance_same_errors():
+    state = OverlayState(PyState())
+    scd = bootstrap_scd(state)
+    mm = loader.parse_and_check(state, mm_cs, scd, "mm")
+    m_cs = "\n".join(f"a{i}:A {{ x = {i}; }}" for i in range(1, 50)) + "\nnoX:A"
+    m = loader.parse_and_check(state, m_cs, mm, "m", check_conformance=False)
+
+    serial = Conformance(state, m, mm).check_nominal()
+    parallel = Conformance(state, m, mm, parallel=True, max_workers=3).check_nominal()
+    assert len(serial) == 16 # 8 multiples of 5, 7 multiples of 7, 1 without x
+    assert parallel == serial
+
+def test_parallel_conformance_reuses_processes():
+    state = PyState()
+    scd = bootstrap_scd(state)
+    mm = loader.parse_and_check(state, mm_cs, scd, "mm")
+    m = loader.parse_and_check(state, "a5:A { x = 5; }\na6:A { x = 6; }", mm, "m", check_conformance=False)
+    conf = Conformance(state, m, mm, parallel=True, max_workers=2)
+
+    assert len(conf.check_nominal()) == 1
+    executor = conf.executor
+    assert len(conf.check_nominal()) == 1
+    assert conf.executor is executor
+
+    # the processes must see the new object
+    conf.odapi.create_object("a7", "A")
+    conf.odapi.set_slot_value(conf.odapi.get("a7"), "x", 7)
+    assert len(conf.check_nominal()) == 2
+    assert conf.executor is not executor
+
+    conf.shutdown()
+    assert conf.executor == None
+
+def test_parallel_conformance_without_fork(monkeypatch):
+    monkeypatch.setattr(multiprocessing, "get_all_start_methods", lambda: ["spawn"])
+    state = PyState()
+    scd = bootstrap_scd(state)
+    mm = loader.parse_and_check(state, mm_cs, scd, "mm")
+    m = loader.parse_and_check(state, "a5:A { x = 5; }\na6:A { x = 6; }", mm, "m", check_conformance=False)
+    conf = Conformance(state, m, mm, parallel=True)
+    # falls back to checking in this process
+    assert len(conf.check_nominal()) == 1
+    assert conf.executor == None
@@ -41,7 +41,7 @@ class Bottom:
         if label == None:
             return self.state.create_edge(source, target)
         else:
-            return self.state.create_dict(source, label, target)
+            return self.state.create_labelled_edge(source, label, target)
 
     def read_value(self, node: UUID) -> Any:
         """
@@ -123,31 +123,13 @@ class Bottom:
             List of UUIDs of outgoing edges
         """
 
-        ### PERFORMANCE OPTIMIZATION ###
         if label != None:
-            fast_result = self.state.read_dict_edge_all(source, label)
-            # if set(alt) != set(edges):
-            #     raise Exception("WRONG", alt, edges)
-            return fast_result
-        ### PERFORMANCE OPTIMIZATION ###
-
-        def read_label(_edge: UUID):
-            try:
-                label_edge, = self.state.read_outgoing(_edge)
-                _, tgt = self.state.read_edge(label_edge)
-                _label = self.state.read_value(tgt)
-                return _label
-            except (TypeError, ValueError):
-                return None
+            # labelled edges are indexed by the state
+            return self.state.read_labelled_edges(source, label)
 
         edges = self.state.read_outgoing(source)
         if edges == None:
             return []
-        if label != None:
-            edges = [e for e in edges if read_label(e) == label]
-
-
-
         return edges
 
     def read_incoming_elements(self, target: UUID, label=None) -> List[UUID]:
@@ -196,9 +178,7 @@ class Bottom:
         Returns:
             List of outgoing edge labels
         """
-        key_nodes = self.state.read_dict_keys(element)
-        unique_keys = {self.state.read_value(node) for node in key_nodes}
-        return list(unique_keys)
+        return self.state.read_labels(element) or []
 
     def delete_element(self, element: UUID):
         """
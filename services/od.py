@@ -1,17 +1,54 @@
 from uuid import UUID
 from state.base import State
 from services.bottom.V0 import Bottom
-from services.primitives.integer_type import Integer
-from services.primitives.string_type import String
-from services.primitives.boolean_type import Boolean
-from services.primitives.actioncode_type import ActionCode
-from services.primitives.bytes_type import Bytes
-from api.cd import CDAPI
+from api.cd import get_cdapi
 from typing import Optional
 
 def get_slot_link_name(obj_name: str, attr_name: str):
     return f"{obj_name}_{attr_name}"
 
+# Primitive values (typed by a ModelRef, e.g., "Integer") are stored in one of two ways:
+#  - by reference: the ModelRef-node contains the UUID (as a string) of a model that contains the value, under a key
+#  - inline: the ModelRef-node contains the value itself. A string that would be read as a UUID (or that starts with INLINE_ESCAPE)
+#    is prefixed with INLINE_ESCAPE, so a string value that is a UUID always means 'by reference'.
+# Values created by the OD service are stored inline, but values stored by reference (e.g., created by the SCD service, or in older models)
+# can still be read, and converted with 'migrate_to_inline'.
+PRIMITIVE_KEYS = {
+    "Integer": "integer",
+    "String": "string",
+    "Boolean": "boolean",
+    "ActionCode": "code",
+    "Bytes": "bytes",
+}
+# Python type of the values of each primitive type
+PRIMITIVE_PYTHON_TYPES = {
+    "Integer": int,
+    "String": str,
+    "Boolean": bool,
+    "ActionCode": str,
+    "Bytes": bytes,
+}
+
+# Is `value` a valid (inline) value of the given primitive type?
+def is_primitive_value(type_name: str, value) -> bool:
+    # exact type: in Python, 'bool' is a subtype of 'int', but a Boolean is not an Integer
+    return type(value) is PRIMITIVE_PYTHON_TYPES[type_name]
+
+INLINE_ESCAPE = "\x00"
+
+# Creates the node of a primitive value (stored inline)
+def create_value_node(bottom, value):
+    if isinstance(value, str) and (value.startswith(INLINE_ESCAPE) or _is_uuid(value)):
+        value = INLINE_ESCAPE + value
+    return bottom.create_node(value)
+
+def _is_uuid(value: str) -> bool:
+    try:
+        UUID(value)
+        return True
+    except ValueError:
+        return False
+
 # Object Diagrams service
 
 class OD:
@@ -29,7 +66,7 @@ class OD:
         self.type_model = type_model
         self.model = model
         self.bottom = Bottom(state)
-        self.cd = CDAPI(self.bottom.state, self.type_model)
+        self.cd = get_cdapi(self.bottom.state, self.type_model)
 
 
     def create_object(self, name: str, class_name: str):
@@ -69,6 +106,10 @@ class OD:
 
     def _get_class_of_object(self, object_node: UUID):
         type_el, = self.bottom.read_outgoing_elements(object_node, "Morphism")
+        class_name = self.cd.type_model_names.get(type_el)
+        if class_name != None:
+            return class_name
+        # type created after our CDAPI was constructed
         for key in self.bottom.read_keys(self.type_model):
             type_el2, = self.bottom.read_outgoing_elements(self.type_model, key)
             if type_el == type_el2:
@@ -118,42 +159,29 @@ class OD:
         tgt = self.bottom.read_edge_target(slot_id)
         return read_primitive_value(self.bottom, tgt, self.type_model)
 
+    # By convention, the type model must have a ModelRef named "Integer"
     def create_integer_value(self, name: str, value: int):
-        from services.primitives.integer_type import Integer
-        int_node = self.bottom.create_node()
-        integer_t = Integer(int_node, self.bottom.state)
-        integer_t.create(value)
-        # name = 'int'+str(value) # name of the ref to the created integer
-        # By convention, the type model must have a ModelRef named "Integer"
-        return self.create_model_ref(name, "Integer", int_node)
+        return self.create_inline_value(name, "Integer", value)
 
     def create_boolean_value(self, name: str, value: bool):
-        from services.primitives.boolean_type import Boolean
-        bool_node = self.bottom.create_node()
-        bool_service = Boolean(bool_node, self.bottom.state)
-        bool_service.create(value)
-        return self.create_model_ref(name, "Boolean", bool_node)
+        return self.create_inline_value(name, "Boolean", value)
 
     def create_string_value(self, name: str, value: str):
-        from services.primitives.string_type import String
-        string_node = self.bottom.create_node()
-        string_t = String(string_node, self.bottom.state)
-        string_t.create(value)
-        return self.create_model_ref(name, "String", string_node)
+        return self.create_inline_value(name, "String", value)
 
     def create_actioncode_value(self, name: str, value: str):
-        from services.primitives.actioncode_type import ActionCode
-        actioncode_node = self.bottom.create_node()
-        actioncode_t = ActionCode(actioncode_node, self.bottom.state)
-        actioncode_t.create(value)
-        return self.create_model_ref(name, "ActionCode", actioncode_node)
+        return self.create_inline_value(name, "ActionCode", value)
 
     def create_bytes_value(self, name: str, value: bytes):
-        from services.primitives.bytes_type import Bytes
-        bytes_node = self.bottom.create_node()
-        bytes_t = Bytes(bytes_node, self.bottom.state)
-        bytes_t.create(value)
-        return self.create_model_ref(name, "Bytes", bytes_node)
+        return self.create_inline_value(name, "Bytes", value)
+
+    # Like create_model_ref, but the value is stored in the element itself, instead of in a separate model
+    def create_inline_value(self, name: str, type_name: str, value):
+        element_node = create_value_node(self.bottom, value)  # create element node
+        self.bottom.create_edge(self.model, element_node, name)  # attach to model
+        type_node, = self.bottom.read_outgoing_elements(self.type_model, type_name)  # retrieve type
+        self.bottom.create_edge(element_node, type_node, "Morphism")  # create morphism link
+        return element_node
 
     # Identical to the same SCD method:
     def create_model_ref(self, name: str, type_name: str, model: UUID):
@@ -348,19 +376,58 @@ def find_incoming_typed_by(bottom, tgt: UUID, type_node: UUID):
                 break
     return edges
 
-def navigate_modelref(bottom, node: UUID):
-    uuid = bottom.read_value(node)
-    return UUID(uuid)
+# If the primitive value `modelref` is stored by reference, returns the model containing the value, otherwise None.
+def get_referred_model(bottom, modelref: UUID) -> Optional[UUID]:
+    value = bottom.read_value(modelref)
+    if isinstance(value, str) and _is_uuid(value):
+        return UUID(value)
+
+# Reads the primitive value of `modelref`, whether it is stored by reference (in the referred model, under `key`) or inline.
+def read_modelref_value(bottom, modelref: UUID, key: str):
+    referred_model = get_referred_model(bottom, modelref)
+    if referred_model != None:
+        value_node, = bottom.read_outgoing_elements(referred_model, key)
+        return bottom.read_value(value_node)
+    value = bottom.read_value(modelref)
+    if isinstance(value, str) and value.startswith(INLINE_ESCAPE):
+        return value[len(INLINE_ESCAPE):]
+    return value
+
+# Converts the primitive values of `model` (conforming to `type_model`) that are stored by reference, to inline values.
+# The value nodes are replaced (under the same name), and so are the slot-links pointing to them (also under the same name).
+# The referred models are left as they are (they may be shared with other models).
+# Existing ODAPIs of the model must be reindexed afterwards. Returns the number of converted values.
+def migrate_to_inline(bottom, model: UUID, type_model: UUID) -> int:
+    keys = {} # type node -> key
+    for type_name, key in PRIMITIVE_KEYS.items():
+        for type_node in bottom.read_outgoing_elements(type_model, type_name):
+            keys[type_node] = key
+    names = { el: name for name in bottom.read_keys(model) for el in bottom.read_outgoing_elements(model, name) }
+    converted = 0
+    for el, name in names.items():
+        typ = get_type(bottom, el)
+        if typ not in keys or get_referred_model(bottom, el) == None:
+            continue
+        value = read_modelref_value(bottom, el, keys[typ])
+        slot_links = [(names[link], get_type(bottom, link), bottom.read_edge_source(link))
+            for link in bottom.read_incoming_edges(el) if link in names]
+        bottom.delete_element(el) # also deletes the slot-links
+        new_el = create_value_node(bottom, value)
+        bottom.create_edge(model, new_el, name)
+        bottom.create_edge(new_el, typ, "Morphism")
+        for link_name, link_type, src in slot_links:
+            link = bottom.create_edge(src, new_el)
+            bottom.create_edge(model, link, link_name)
+            bottom.create_edge(link, link_type, "Morphism")
+        converted += 1
+    return converted
 
 def find_cardinality(bottom, class_node: UUID, type_node: UUID):
     upper_card_edges = find_outgoing_typed_by(bottom, class_node, type_node)
     if len(upper_card_edges) == 1:
         ref = bottom.read_edge_target(upper_card_edges[0])
-        integer, = bottom.read_outgoing_elements(
-            navigate_modelref(bottom, ref),
-            "integer")
         # finally, the value we're looking for:
-        return bottom.read_value(integer)
+        return read_modelref_value(bottom, ref, "integer")
 
 def get_attributes(bottom, class_node: UUID):
     attr_link_node = get_scd_mm_attributelink_node(bottom)
@@ -377,28 +444,15 @@ def get_attr_name(bottom, attr_edge: UUID):
     if name_edge == None:
         raise Exception("Expected attribute to have a name...")
     ref_name = bottom.read_edge_target(name_edge)
-    string, = bottom.read_outgoing_elements(
-        navigate_modelref(bottom, ref_name),
-        "string")
-    return bottom.read_value(string)
+    return read_modelref_value(bottom, ref_name, "string")
 
 # We need the meta-model (`mm`) to find out how to read the `modelref`
 def read_primitive_value(bottom, modelref: UUID, mm: UUID):
     typ = get_type(bottom, modelref)
     if not is_typed_by(bottom, typ, get_scd_mm_modelref_node(bottom)):
         raise Exception("Assertion failed: argument must be typed by ModelRef", typ)
-    referred_model = UUID(bottom.read_value(modelref))
     typ_name = get_object_name(bottom, model=mm, object_node=typ)
-    if typ_name == "Integer":
-        return Integer(referred_model, bottom.state).read(), typ_name
-    elif typ_name == "String":
-        return String(referred_model, bottom.state).read(), typ_name
-    elif typ_name == "Boolean":
-        return Boolean(referred_model, bottom.state).read(), typ_name
-    elif typ_name == "ActionCode":
-        return ActionCode(referred_model, bottom.state).read(), typ_name
-    elif typ_name == "Bytes":
-        return Bytes(referred_model, bottom.state).read(), typ_name
-    else:
+    if typ_name not in PRIMITIVE_KEYS:
         raise Exception("Unimplemented type:", typ_name)
+    return read_modelref_value(bottom, modelref, PRIMITIVE_KEYS[typ_name]), typ_name
 
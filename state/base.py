@@ -57,6 +57,26 @@ class State(ABC):
         """
         pass
 
+    def read_version(self) -> Optional[int]:
+        """
+        Reads a number that changes every time the state is modified.
+        Useful for invalidating information that is derived from the state.
+
+        Returns:
+            The version number, or None if the implementation does not keep track of modifications.
+        """
+        return None
+
+    def read_owner(self, elem: Element) -> "State":
+        """
+        Reads the state that owns the given element and its outgoing edges.
+        Information derived from them (e.g., from a model) can be shared by all states with the same owner.
+
+        Returns:
+            The state itself, unless it is a layer on top of another state (see OverlayState), in which the element is unchanged.
+        """
+        return self
+
     # =========================================================================
     # CREATE
     # =========================================================================
@@ -113,6 +133,30 @@ class State(ABC):
         """
         pass
 
+    def create_labelled_edge(self, source: Element, label: Any, target: Element) -> Optional[Edge]:
+        """
+        Creates an edge between two graph elements, labelled with a value.
+
+        For compatibility with the other operations (read_outgoing, read_dict_keys, ...),
+        the label is also visible as an edge from the created edge to a node containing the label.
+        Implementations can store labelled edges natively, and index them by (source, label).
+
+        Args:
+            source: source element of edge
+            label: edge label
+            target: target element of edge
+
+        Returns:
+            The created edge, None if source or target does not exist, or if type of label is not supported.
+        """
+        if not self.is_valid_datavalue(label):
+            return None
+        e = self.create_edge(source, target)
+        if e == None:
+            return None
+        self.create_edge(e, self.create_nodevalue(label))
+        return e
+
     # =========================================================================
     # READ
     # =========================================================================
@@ -218,6 +262,45 @@ class State(ABC):
         """
         pass
 
+    def read_labelled_edges(self, elem: Element, label: Any) -> List[Edge]:
+        """
+        Reads all edges with label = label originating from given element.
+
+        Args:
+            elem: source element
+            label: edge label
+
+        Returns:
+            List of edges with given label originating from elem, empty if elem doesn't exist.
+        """
+        result = []
+        for e1 in self.read_outgoing(elem) or []:
+            if label in [self.read_value(self.read_edge(e2)[1]) for e2 in self.read_outgoing(e1)]:
+                result.append(e1)
+        return result
+
+    def read_labels(self, elem: Element) -> Optional[List[Any]]:
+        """
+        Reads the labels of the labelled edges originating from given element.
+
+        Args:
+            elem: source element
+
+        Returns:
+            If elem exists, list of (unique) edge labels, else None.
+        """
+        key_nodes = self.read_dict_keys(elem)
+        if key_nodes == None:
+            return None
+        labels = [self.read_value(node) for node in key_nodes]
+        return list(dict.fromkeys(label for label in labels if label != None))
+
+    def read_dict_edge_all(self, elem: Element, value: Any) -> List[Edge]:
+        """
+        Same as read_labelled_edges.
+        """
+        return self.read_labelled_edges(elem, value)
+
     @abstractmethod
     def read_dict_node(self, elem: Element, value_node: Node) -> Optional[Element]:
         """
@@ -0,0 +1,296 @@
+from array import array
+from typing import Any, List, Tuple, Optional
+from uuid import UUID
+
+from state.base import State, Node, Edge, Element
+
+# kinds of element
+DELETED = 0
+NODE = 1
+EDGE = 2
+
+NONE = -1
+
+
+class CompactState(State):
+    """
+    State interface implemented with dense integer ids and array-backed adjacency.
+
+    Element i is stored at index i of a number of arrays (source, target, ...).
+    Incoming and outgoing edges of an element are kept in doubly linked lists that are also stored in arrays,
+    so no containers (dicts, sets, tuples) are created per element to store its adjacency.
+    Only the values of nodes and the labelled edges are stored in dicts.
+
+    To the outside, elements are still UUIDs (UUID(int=i)), so this state can be used with the rest of the framework.
+    The UUID of every element is created once, and kept in a list ('ids'), so that the results of queries do not create new ones:
+    this is the one Python object per element.
+    Ids of deleted elements are never reused.
+    """
+    def __init__(self):
+        self.kind = array('b')
+        self.source = array('q')
+        self.target = array('q')
+        # linked list of outgoing/incoming edges of every element
+        self.first_out = array('q')
+        self.first_in = array('q')
+        # next/previous edge in the list of the source (out) or target (in) of an edge
+        self.next_out = array('q')
+        self.prev_out = array('q')
+        self.next_in = array('q')
+        self.prev_in = array('q')
+        # the UUID of every element
+        self.ids = []
+
+        # node -> value
+        self.values = {}
+        # Labelled edges: source -> label -> edges (in order of creation)
+        self.labelled = {}
+
+        # Incremented on every modification
+        self.version = 0
+
+        self.root = self._new_element(NODE)
+
+    def _new_element(self, kind, source=NONE, target=NONE) -> int:
+        i = len(self.kind)
+        self.version += 1
+        self.kind.append(kind)
+        self.source.append(source)
+        self.target.append(target)
+        for a in (self.first_out, self.first_in, self.next_out, self.prev_out, self.next_in, self.prev_in):
+            a.append(NONE)
+        self.ids.append(UUID(int=i))
+        return i
+
+    # UUID -> index, or None if the element does not exist
+    def _index(self, elem) -> Optional[int]:
+        try:
+            i = elem.int
+        except AttributeError:
+            return None
+        if i < len(self.kind) and self.kind[i] != DELETED:
+            return i
+        return None
+
+    def _outgoing(self, i: int):
+        e = self.first_out[i]
+        while e != NONE:
+            yield e
+            e = self.next_out[e]
+
+    def _incoming(self, i: int):
+        e = self.first_in[i]
+        while e != NONE:
+            yield e
+            e = self.next_in[e]
+
+    # If edge e2 labels another edge e (e2: e -> node with a value), return (source of e, label)
+    def _get_label(self, e2: int):
+        e = self.source[e2]
+        if self.kind[e] == EDGE and self.target[e2] in self.values:
+            return self.source[e], self.values[self.target[e2]]
+
+    def create_node(self) -> Node:
+        return self.ids[self._new_element(NODE)]
+
+    def create_edge(self, source: Element, target: Element) -> Optional[Edge]:
+        s = self._index(source)
+        t = self._index(target)
+        if s == None or t == None:
+            return None
+        e = self._new_element(EDGE, s, t)
+        # prepend to outgoing edges of source
+        self.next_out[e] = self.first_out[s]
+        if self.first_out[s] != NONE:
+            self.prev_out[self.first_out[s]] = e
+        self.first_out[s] = e
+        # prepend to incoming edges of target
+        self.next_in[e] = self.first_in[t]
+        if self.first_in[t] != NONE:
+            self.prev_in[self.first_in[t]] = e
+        self.first_in[t] = e
+        label = self._get_label(e)
+        if label != None:
+            # We are creating something dict_readable
+            edges = self.labelled.setdefault(label[0], {}).setdefault(label[1], [])
+            if s not in edges:
+                edges.append(s)
+        return self.ids[e]
+
+    def create_nodevalue(self, value: Any) -> Optional[Node]:
+        if not self.is_valid_datavalue(value):
+            return None
+        n = self._new_element(NODE)
+        self.values[n] = value
+        return self.ids[n]
+
+    def create_dict(self, source: Element, value: Any, target: Element) -> None:
+        self.create_labelled_edge(source, value, target)
+
+    def create_labelled_edge(self, source: Element, label: Any, target: Element) -> Optional[Edge]:
+        if self._index(source) == None or self._index(target) == None:
+            return None
+        elif not self.is_valid_datavalue(label):
+            return None
+        else:
+            n = self.create_nodevalue(label)
+            e = self.create_edge(source, target)
+            assert n != None and e != None
+            self.create_edge(e, n) # also adds e to self.labelled
+            return e
+
+    def read_root(self) -> Node:
+        return self.ids[self.root]
+
+    def read_version(self) -> int:
+        return self.version
+
+    def read_value(self, node: Node) -> Any:
+        i = self._index(node)
+        if i == None:
+            return None
+        return self.values.get(i)
+
+    def read_outgoing(self, elem: Element) -> Optional[List[Edge]]:
+        i = self._index(elem)
+        if i == None:
+            return None
+        return [self.ids[e] for e in self._outgoing(i)]
+
+    def read_incoming(self, elem: Element) -> Optional[List[Edge]]:
+        i = self._index(elem)
+        if i == None:
+            return None
+        return [self.ids[e] for e in self._incoming(i)]
+
+    def read_edge(self, edge: Edge) -> Tuple[Optional[Element], Optional[Element]]:
+        e = self._index(edge)
+        if e == None or self.kind[e] != EDGE:
+            return None, None
+        return self.ids[self.source[e]], self.ids[self.target[e]]
+
+    def is_edge(self, elem: Element) -> bool:
+        i = self._index(elem)
+        return i != None and self.kind[i] == EDGE
+
+    def read_dict(self, elem: Element, value: Any) -> Optional[Element]:
+        e = self.read_dict_edge(elem, value)
+        if e == None:
+            return None
+        else:
+            return self.ids[self.target[e.int]]
+
+    def read_dict_keys(self, elem: Element) -> Optional[List[Element]]:
+        i = self._index(elem)
+        if i == None:
+            return None
+        return [self.ids[self.target[e2]] for e1 in self._outgoing(i) for e2 in self._outgoing(e1)]
+
+    def read_labels(self, elem: Element) -> Optional[List[Any]]:
+        i = self._index(elem)
+        if i == None:
+            return None
+        return list(self.labelled.get(i, ()))
+
+    def read_dict_edge(self, elem: Element, value: Any) -> Optional[Edge]:
+        result = self.read_labelled_edges(elem, value)
+        if len(result) == 0:
+            return None
+        return result[-1] # most recently created
+
+    def read_labelled_edges(self, elem: Element, label: Any) -> List[Edge]:
+        i = self._index(elem)
+        if i == None or i not in self.labelled:
+            return []
+        try:
+            return [self.ids[e] for e in self.labelled[i].get(label, ())]
+        except TypeError:
+            return [] # unhashable label
+
+    def read_dict_node(self, elem: Element, value_node: Node) -> Optional[Element]:
+        e = self.read_dict_node_edge(elem, value_node)
+        if e == None:
+            return None
+        else:
+            return self.ids[self.target[e.int]]
+
+    def read_dict_node_edge(self, elem: Element, value_node: Node) -> Optional[Edge]:
+        i = self._index(elem)
+        n = self._index(value_node)
+        if i == None or n == None:
+            return None
+        for e1 in self._outgoing(i):
+            for e2 in self._outgoing(e1):
+                if self.target[e2] == n:
+                    return self.ids[e1]
+        return None
+
+    def read_reverse_dict(self, elem: Element, value: Any) -> Optional[List[Element]]:
+        i = self._index(elem)
+        if i == None:
+            return None
+        return [self.ids[self.source[e1]]
+            for e1 in self._incoming(i)
+                for e2 in self._outgoing(e1)
+                    if self.values.get(self.target[e2], NONE) == value]
+
+    def delete_node(self, node: Node) -> None:
+        n = self._index(node)
+        if n == None or n == self.root or self.kind[n] != NODE:
+            return
+        self.kind[n] = DELETED
+        self.version += 1
+        for e in list(self._outgoing(n)) + list(self._incoming(n)):
+            self._delete_edge(e)
+        # (only now, the value was still needed to update the labelled edges)
+        self.values.pop(n, None)
+        self.labelled.pop(n, None)
+
+    def delete_edge(self, edge: Edge) -> None:
+        e = self._index(edge)
+        if e == None or self.kind[e] != EDGE:
+            return
+        self._delete_edge(e)
+
+    def _delete_edge(self, e: int):
+        s, t = self.source[e], self.target[e]
+        if self.kind[e] != EDGE:
+            return # already deleted
+        self.version += 1
+        # unlink from outgoing edges of source
+        if self.prev_out[e] != NONE:
+            self.next_out[self.prev_out[e]] = self.next_out[e]
+        else:
+            self.first_out[s] = self.next_out[e]
+        if self.next_out[e] != NONE:
+            self.prev_out[self.next_out[e]] = self.prev_out[e]
+        # unlink from incoming edges of target
+        if self.prev_in[e] != NONE:
+            self.next_in[self.prev_in[e]] = self.next_in[e]
+        else:
+            self.first_in[t] = self.next_in[e]
+        if self.next_in[e] != NONE:
+            self.prev_in[self.next_in[e]] = self.prev_in[e]
+
+        label = self._get_label(e)
+        if label != None:
+            # e labels the dict edge s, but s may have another label with the same value
+            if not any(self.values.get(self.target[e2], NONE) == label[1] for e2 in self._outgoing(s)):
+                self._remove_labelled(label[0], label[1], s)
+        # e may itself be a dict edge
+        for e2 in self._outgoing(e):
+            if self.target[e2] in self.values:
+                self._remove_labelled(s, self.values[self.target[e2]], e)
+
+        self.kind[e] = DELETED
+        self.labelled.pop(e, None)
+
+        for e2 in list(self._outgoing(e)) + list(self._incoming(e)):
+            self._delete_edge(e2)
+
+    def _remove_labelled(self, source: int, label: Any, e: int):
+        labels = self.labelled.get(source)
+        if labels != None and e in labels.get(label, ()):
+            labels[label].remove(e)
+            if len(labels[label]) == 0:
+                del labels[label]
@@ -9,12 +9,13 @@ class DevState(PyState):
     """
 
     def __init__(self):
-        self.free_id = 0
+        # (a list, so that the counter is shared with shallow copies of this state, see OverlayState.materialize)
+        self.free_id = [0]
         super().__init__()
 
     def new_id(self) -> UUID:
-        self.free_id += 1
-        return UUID(int=self.free_id - 1)
+        self.free_id[0] += 1
+        return UUID(int=self.free_id[0] - 1)
 
     def dump(self, path: str, png_path: str = None):
         """Dumps the whole MV graph to a graphviz .dot-file
@@ -0,0 +1,384 @@
+import copy
+from typing import Any, List, Tuple, Optional
+
+from state.base import State, Node, Edge, Element
+from state.pystate import PyState
+
+_EMPTY = frozenset()
+
+
+class OverlayState(State):
+    """
+    Copy-on-write State: a delta layer on top of a (frozen) PyState.
+
+    Reads fall through to the base state, writes are recorded in the overlay,
+    so creating an overlay is O(1), and only the elements that are touched are copied.
+    The base state must not be modified while overlays on top of it are in use.
+
+    Creating an overlay on top of another overlay does not stack them:
+    the new overlay shares the base of the given overlay and starts with a copy of its delta,
+    so reads never have to go through more than one layer.
+    Once that delta has grown larger than a fraction (MATERIALIZE_FRACTION) of the base,
+    the given overlay is materialized into a new base instead (see 'materialize'), and the new overlay starts with an empty delta.
+    This way, the delta that is copied for every overlay (e.g., every step of a simulation) does not keep growing.
+    """
+    # Materialize when the delta is larger than 1/MATERIALIZE_FRACTION of the base (but at least MATERIALIZE_MIN elements)
+    MATERIALIZE_FRACTION = 8
+    MATERIALIZE_MIN = 1024
+
+    def __init__(self, base: State):
+        if isinstance(base, OverlayState) and base._delta_size() > max(self.MATERIALIZE_MIN, base._base_size() // self.MATERIALIZE_FRACTION):
+            base = base.materialize()
+        if isinstance(base, OverlayState):
+            self.base = base.base
+            self.nodes = set(base.nodes)
+            self.edges = dict(base.edges)
+            self.values = dict(base.values)
+            self.deleted = set(base.deleted)
+            self.out_added = {k: set(v) for k, v in base.out_added.items()}
+            self.out_removed = {k: set(v) for k, v in base.out_removed.items()}
+            self.in_added = {k: set(v) for k, v in base.in_added.items()}
+            self.in_removed = {k: set(v) for k, v in base.in_removed.items()}
+            self.labelled = {k: {label: list(edges) for label, edges in v.items()} for k, v in base.labelled.items()}
+            self.version = base.version
+        elif isinstance(base, PyState):
+            self.base = base
+            # Elements created in the overlay
+            self.nodes = set()
+            self.edges = {}
+            self.values = {}
+            # Elements of the base that were deleted in the overlay
+            self.deleted = set()
+            # Changes to the incoming/outgoing edges of (base or overlay) elements
+            self.out_added = {}
+            self.out_removed = {}
+            self.in_added = {}
+            self.in_removed = {}
+            # Labelled edges (same structure as PyState.labelled) of the (source, label)-pairs that were changed in the overlay
+            self.labelled = {}
+            self.version = base.version
+        else:
+            raise Exception(f"Cannot create overlay on top of {type(base).__name__}")
+        self.root = self.base.root
+
+    # Number of elements created or deleted in the overlay
+    def _delta_size(self) -> int:
+        return len(self.nodes) + len(self.edges) + len(self.deleted)
+
+    def _base_size(self) -> int:
+        return len(self.base.nodes) + len(self.base.edges)
+
+    def materialize(self) -> PyState:
+        """
+        Returns a new PyState (of the same class as the base) with the contents of the overlay.
+        Takes time proportional to the size of the base, which is left untouched.
+
+        The new state is a shallow copy of the base, of which the attributes of PyState are replaced.
+        Attributes that a subclass of PyState adds are shared with the base:
+        overlays on top of the base and the new state must be able to use them both.
+        E.g., DevState keeps its ID counter in a list, so that they never generate the same IDs.
+        """
+        base = self.base
+        state = copy.copy(base)
+        state.nodes = (base.nodes - self.deleted) | self.nodes
+        state.edges = {edge: ends for edge, ends in base.edges.items() if edge not in self.deleted}
+        state.edges.update(self.edges)
+        state.values = {node: value for node, value in base.values.items() if node not in self.deleted}
+        state.values.update(self.values)
+        state.outgoing = self._materialize_adjacent(state, base.outgoing, self.out_added, self.out_removed)
+        state.incoming = self._materialize_adjacent(state, base.incoming, self.in_added, self.in_removed)
+        # Rebuild the labelled edges in the same way as PyState.create_edge does.
+        # Edges (of the base, then of the overlay) are in order of creation, so the order of the labelled edges is preserved.
+        state.labelled = {}
+        state.labelled_node = {}
+        for label_edge, (dict_edge, label_node) in state.edges.items():
+            if dict_edge in state.edges:
+                source = state.edges[dict_edge][0]
+                if label_node in state.values:
+                    edges = state.labelled.setdefault(source, {}).setdefault(state.values[label_node], [])
+                    if dict_edge not in edges:
+                        edges.append(dict_edge)
+                edges = state.labelled_node.setdefault(source, {}).setdefault(label_node, [])
+                if dict_edge not in edges:
+                    edges.append(dict_edge)
+        state.to_delete = set()
+        state.version = self.version
+        return state
+
+    def _materialize_adjacent(self, state: PyState, base: dict, added: dict, removed: dict) -> dict:
+        result = {elem: set(edges) for elem, edges in base.items() if elem not in self.deleted}
+        for elem in added.keys() | removed.keys():
+            if elem in state.nodes or elem in state.edges:
+                result[elem] = (base.get(elem, _EMPTY) - removed.get(elem, _EMPTY)) | added.get(elem, _EMPTY)
+        return result
+
+    def read_owner(self, elem: Element) -> State:
+        # The base, if elem is an element of the base, and neither elem nor its outgoing edges were changed in the overlay
+        if elem not in self.deleted and elem not in self.out_added and elem not in self.out_removed \
+                and (elem in self.base.nodes or elem in self.base.edges):
+            return self.base
+        return self
+
+    def new_id(self):
+        # Ask the base, so that all overlays on the same base generate distinct IDs
+        return self.base.new_id()
+
+    def _exists(self, elem: Element) -> bool:
+        if elem in self.nodes or elem in self.edges:
+            return True
+        return elem not in self.deleted and (elem in self.base.nodes or elem in self.base.edges)
+
+    def _read_edge(self, edge: Edge) -> Optional[Tuple[Element, Element]]:
+        if edge in self.edges:
+            return self.edges[edge]
+        if edge in self.deleted:
+            return None
+        return self.base.edges.get(edge)
+
+    def _read_value(self, node: Node) -> Any:
+        if node in self.values:
+            return self.values[node]
+        if node in self.deleted:
+            return None
+        return self.base.values.get(node)
+
+    # Result must not be modified: it may be a set of the base state
+    def _outgoing(self, elem: Element) -> set:
+        return self._adjacent(self.base.outgoing, self.out_added, self.out_removed, elem)
+
+    def _incoming(self, elem: Element) -> set:
+        return self._adjacent(self.base.incoming, self.in_added, self.in_removed, elem)
+
+    def _adjacent(self, base: dict, added: dict, removed: dict, elem: Element) -> set:
+        base_edges = base.get(elem, _EMPTY)
+        if elem not in added and elem not in removed:
+            return base_edges
+        return (base_edges - removed.get(elem, _EMPTY)) | added.get(elem, _EMPTY)
+
+    def _add_adjacent(self, added: dict, removed: dict, elem: Element, edge: Edge):
+        if edge in removed.get(elem, ()):
+            removed[elem].remove(edge)
+        else:
+            added.setdefault(elem, set()).add(edge)
+
+    def _remove_adjacent(self, added: dict, removed: dict, elem: Element, edge: Edge):
+        if edge in added.get(elem, ()):
+            added[elem].remove(edge)
+        else:
+            removed.setdefault(elem, set()).add(edge)
+
+    def create_node(self) -> Node:
+        new_id = self.new_id()
+        self.nodes.add(new_id)
+        self.version += 1
+        return new_id
+
+    def create_edge(self, source: Element, target: Element) -> Optional[Edge]:
+        if not self._exists(source) or not self._exists(target):
+            return None
+        new_id = self.new_id()
+        self.version += 1
+        self._add_adjacent(self.out_added, self.out_removed, source, new_id)
+        self._add_adjacent(self.in_added, self.in_removed, target, new_id)
+        self.edges[new_id] = (source, target)
+        dict_edge = self._read_edge(source)
+        if dict_edge != None:
+            # We are creating something dict_readable
+            value = self._read_value(target)
+            if value != None:
+                edges = self._labelled_for_update(dict_edge[0], value)
+                if source not in edges:
+                    edges.append(source)
+        return new_id
+
+    def create_nodevalue(self, value: Any) -> Optional[Node]:
+        if not self.is_valid_datavalue(value):
+            return None
+        new_id = self.new_id()
+        self.values[new_id] = value
+        self.nodes.add(new_id)
+        self.version += 1
+        return new_id
+
+    def create_dict(self, source: Element, value: Any, target: Element) -> None:
+        self.create_labelled_edge(source, value, target)
+
+    def create_labelled_edge(self, source: Element, label: Any, target: Element) -> Optional[Edge]:
+        if not self._exists(source) or not self._exists(target):
+            return None
+        elif not self.is_valid_datavalue(label):
+            return None
+        else:
+            n = self.create_nodevalue(label)
+            e = self.create_edge(source, target)
+            assert n != None and e != None
+            self.create_edge(e, n) # also adds e to self.labelled
+            return e
+
+    def read_root(self) -> Node:
+        return self.root
+
+    def read_version(self) -> int:
+        return self.version
+
+    def read_value(self, node: Node) -> Any:
+        return self._read_value(node)
+
+    def read_outgoing(self, elem: Element) -> Optional[List[Edge]]:
+        if not self._exists(elem):
+            return None
+        return list(self._outgoing(elem))
+
+    def read_incoming(self, elem: Element) -> Optional[List[Edge]]:
+        if not self._exists(elem):
+            return None
+        return list(self._incoming(elem))
+
+    def read_edge(self, edge: Edge) -> Tuple[Optional[Element], Optional[Element]]:
+        result = self._read_edge(edge)
+        if result == None:
+            return None, None
+        return result
+
+    def is_edge(self, elem: Element) -> bool:
+        return self._read_edge(elem) != None
+
+    def read_dict(self, elem: Element, value: Any) -> Optional[Element]:
+        e = self.read_dict_edge(elem, value)
+        if e == None:
+            return None
+        else:
+            return self._read_edge(e)[1]
+
+    def read_dict_keys(self, elem: Element) -> Optional[List[Element]]:
+        if not self._exists(elem):
+            return None
+        result = []
+        for e1 in self._outgoing(elem):
+            for e2 in self._outgoing(e1):
+                result.append(self._read_edge(e2)[1])
+        return result
+
+    def read_labels(self, elem: Element) -> Optional[List[Any]]:
+        if not self._exists(elem):
+            return None
+        base_labels = self.base.labelled.get(elem, {})
+        if elem not in self.labelled:
+            return list(base_labels)
+        labels = self.labelled[elem]
+        # (labels changed in the overlay may no longer have any edges)
+        return [label for label in base_labels if len(labels.get(label, base_labels[label])) > 0] \
+            + [label for label, edges in labels.items() if label not in base_labels and len(edges) > 0]
+
+    def read_dict_edge(self, elem: Element, value: Any) -> Optional[Edge]:
+        result = self.read_labelled_edges(elem, value)
+        if len(result) == 0:
+            return None
+        return result[-1] # most recently created
+
+    def read_labelled_edges(self, elem: Element, label: Any) -> List[Edge]:
+        if not self._exists(elem):
+            return []
+        try:
+            return list(self._labelled(elem, label))
+        except TypeError:
+            return [] # unhashable label
+
+    # Result must not be modified: it may be a list of the base state
+    def _labelled(self, source: Element, label: Any) -> list:
+        labels = self.labelled.get(source)
+        if labels != None and label in labels:
+            return labels[label]
+        return self.base.labelled.get(source, {}).get(label, ())
+
+    def _labelled_for_update(self, source: Element, label: Any) -> list:
+        labels = self.labelled.setdefault(source, {})
+        if label not in labels:
+            labels[label] = list(self.base.labelled.get(source, {}).get(label, ()))
+        return labels[label]
+
+    def read_dict_node(self, elem: Element, value_node: Node) -> Optional[Element]:
+        e = self.read_dict_node_edge(elem, value_node)
+        if e == None:
+            return None
+        else:
+            return self._read_edge(e)[1]
+
+    def read_dict_node_edge(self, elem: Element, value_node: Node) -> Optional[Edge]:
+        if not self._exists(elem):
+            return None
+        for e1 in self._outgoing(elem):
+            if value_node in [self._read_edge(e2)[1] for e2 in self._outgoing(e1)]:
+                return e1
+        return None
+
+    def read_reverse_dict(self, elem: Element, value: Any) -> Optional[List[Element]]:
+        if not self._exists(elem):
+            return None
+        matches = []
+        for e1 in self._incoming(elem):
+            for e2 in self._outgoing(e1):
+                if self._read_value(self._read_edge(e2)[1]) == value:
+                    matches.append(e1)
+        return [self._read_edge(e)[0] for e in matches]
+
+    def delete_node(self, node: Node) -> None:
+        if node == self.root:
+            return
+        elif not self._exists(node) or self.is_edge(node):
+            return
+
+        s = self._outgoing(node) | self._incoming(node)
+        self.version += 1
+
+        for e in s:
+            self.delete_edge(e)
+
+        # (only now, the value was still needed to update the labelled edges)
+        if node in self.nodes:
+            self.nodes.remove(node)
+            self.values.pop(node, None)
+        else:
+            self.deleted.add(node)
+
+        self._forget_adjacent(node)
+
+    def delete_edge(self, edge: Edge) -> None:
+        if not self.is_edge(edge):
+            return
+
+        s, t = self._read_edge(edge)
+        self.version += 1
+        self._remove_adjacent(self.in_added, self.in_removed, t, edge)
+        self._remove_adjacent(self.out_added, self.out_removed, s, edge)
+
+        if edge in self.edges:
+            del self.edges[edge]
+        else:
+            self.deleted.add(edge)
+
+        label = self._read_value(t)
+        dict_edge = self._read_edge(s)
+        if dict_edge != None and label != None:
+            # edge was a label of edge s, but s may have another label with the same value
+            if label not in [self._read_value(self._read_edge(i)[1]) for i in self._outgoing(s)]:
+                self._remove_labelled(dict_edge[0], label, s)
+        for e in self._outgoing(edge):
+            # edge itself is labelled
+            label = self._read_value(self._read_edge(e)[1])
+            if label != None:
+                self._remove_labelled(s, label, edge)
+
+        for e in self._outgoing(edge) | self._incoming(edge):
+            self.delete_edge(e)
+
+        self._forget_adjacent(edge)
+
+    def _remove_labelled(self, source: Element, label: Any, edge: Edge):
+        if edge in self._labelled(source, label):
+            self._labelled_for_update(source, label).remove(edge)
+
+    def _forget_adjacent(self, elem: Element):
+        # The element no longer exists, so neither do the changes to its incoming/outgoing/labelled edges
+        for d in [self.out_added, self.out_removed, self.in_added, self.in_removed, self.labelled]:
+            d.pop(elem, None)
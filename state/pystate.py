@@ -20,16 +20,20 @@ class PyState(State):
         self.GC = True
         self.to_delete = set()
 
-        self.cache = {}
-        self.cache_node = {}
+        # Labelled edges: source -> label -> edges (in order of creation)
+        self.labelled = {}
+        # Same, but indexed by the node containing the label: source -> label node -> edges
+        self.labelled_node = {}
 
-        self.cache_all = {}
+        # Incremented on every modification
+        self.version = 0
 
         self.root = self.create_node()
 
     def create_node(self) -> Node:
         new_id = self.new_id()
         self.nodes.add(new_id)
+        self.version += 1
         return new_id
 
     def create_edge(self, source: Element, target: Element) -> Optional[Edge]:
@@ -40,17 +44,20 @@ class PyState(State):
             return None
         else:
             new_id = self.new_id()
+            self.version += 1
             self.outgoing.setdefault(source, set()).add(new_id)
             self.incoming.setdefault(target, set()).add(new_id)
             self.edges[new_id] = (source, target)
             if source in self.edges:
                 # We are creating something dict_readable
-                # Fill in the cache already!
                 dict_source, dict_target = self.edges[source]
                 if target in self.values:
-                    self.cache.setdefault(dict_source, {})[self.values[target]] = source
-                    self.cache_all.setdefault(dict_source, {}).setdefault(self.values[target], set()).add(source)
-                self.cache_node.setdefault(dict_source, {})[target] = source
+                    edges = self.labelled.setdefault(dict_source, {}).setdefault(self.values[target], [])
+                    if source not in edges:
+                        edges.append(source)
+                edges = self.labelled_node.setdefault(dict_source, {}).setdefault(target, [])
+                if source not in edges:
+                    edges.append(source)
             return new_id
 
     def create_nodevalue(self, value: Any) -> Optional[Node]:
@@ -59,27 +66,32 @@ class PyState(State):
         new_id = self.new_id()
         self.values[new_id] = value
         self.nodes.add(new_id)
+        self.version += 1
         return new_id
 
     def create_dict(self, source: Element, value: Any, target: Element) -> None:
+        self.create_labelled_edge(source, value, target)
+
+    def create_labelled_edge(self, source: Element, label: Any, target: Element) -> Optional[Edge]:
         if source not in self.nodes and source not in self.edges:
             return None
         elif target not in self.nodes and target not in self.edges:
             return None
-        elif not self.is_valid_datavalue(value):
+        elif not self.is_valid_datavalue(label):
             return None
         else:
-            n = self.create_nodevalue(value)
+            n = self.create_nodevalue(label)
             e = self.create_edge(source, target)
             assert n != None and e != None
-            e2 = self.create_edge(e, n)
-            self.cache.setdefault(source, {})[value] = e
-            self.cache_all.setdefault(source, {}).setdefault(value, set()).add(e)
-            self.cache_node.setdefault(source, {})[n] = e
+            e2 = self.create_edge(e, n) # also adds e to self.labelled
+            return e
 
     def read_root(self) -> Node:
         return self.root
 
+    def read_version(self) -> int:
+        return self.version
+
     def read_value(self, node: Node) -> Any:
         if node in self.values:
             return self.values[node]
@@ -105,10 +117,11 @@ class PyState(State):
             return None
 
     def read_edge(self, edge: Edge) -> Tuple[Optional[Element], Optional[Element]]:
-        if edge in self.edges:
-            return self.edges[edge][0], self.edges[edge][1]
-        else:
+        # (single lookup: this is called a lot, and hashing a UUID is not cheap)
+        result = self.edges.get(edge)
+        if result == None:
             return None, None
+        return result[0], result[1]
 
     def is_edge(self, elem: Element) -> bool:
         return elem in self.edges
@@ -135,58 +148,32 @@ class PyState(State):
         return result
 
     def read_dict_edge(self, elem: Element, value: Any) -> Optional[Edge]:
-        try:
-            first = self.cache[elem][value]
-            # Got hit, so validate
-            if (self.edges[first][0] == elem) and (value in [self.values[self.edges[i][1]]
-                                                             for i in self.outgoing[first]
-                                                             if self.edges[i][1] in self.values]):
-                return first
-            # Hit but invalid now
-            del self.cache[elem][value]
-            self.cache_all[elem][value].remove(first)
-            return None
-        except KeyError:
+        edges = self.read_labelled_edges(elem, value)
+        if len(edges) == 0:
             return None
+        return edges[-1] # most recently created
 
-    def read_dict_edge_all(self, elem: Element, value: Any) -> List[Edge]:
-        result = []
+    def read_labelled_edges(self, elem: Element, label: Any) -> List[Edge]:
         try:
-            all_ = self.cache_all[elem][value]
-            for a in all_:
-                try:
-                    if ((self.edges[a][0] == elem) and (value in [self.values[self.edges[i][1]]
-                             for i in self.outgoing[a]
-                             if self.edges[i][1] in self.values])):
-                        result.append(a)
-                        continue
-                except KeyError:
-                    pass
-
-            if len(result) != len(all_):
-                self.cache_all[elem][value] = set(result)
-        except KeyError:
-            pass
-        return result
+            return list(self.labelled[elem][label])
+        except (KeyError, TypeError):
+            return []
+
+    def read_labels(self, elem: Element) -> Optional[List[Any]]:
+        if elem not in self.nodes and elem not in self.edges:
+            return None
+        return list(self.labelled.get(elem, ()))
 
     def read_dict_node(self, elem: Element, value_node: Node) -> Optional[Element]:
         e = self.read_dict_node_edge(elem, value_node)
         if e == None:
             return None
         else:
-            self.cache_node.setdefault(elem, {})[value_node] = e
             return self.edges[e][1]
 
     def read_dict_node_edge(self, elem: Element, value_node: Node) -> Optional[Edge]:
         try:
-            first = self.cache_node[elem][value_node]
-            # Got hit, so validate
-            if (self.edges[first][0] == elem) and \
-               (value_node in [self.edges[i][1] for i in self.outgoing[first]]):
-                return first
-            # Hit but invalid now
-            del self.cache_node[elem][value_node]
-            return None
+            return self.labelled_node[elem][value_node][-1]
         except KeyError:
             return None
 
@@ -215,9 +202,7 @@ class PyState(State):
             return
 
         self.nodes.remove(node)
-
-        if node in self.values:
-            del self.values[node]
+        self.version += 1
 
         s = set()
         if node in self.outgoing:
@@ -232,10 +217,16 @@ class PyState(State):
         for e in s:
             self.delete_edge(e)
 
+        # (only now, the value was still needed to update the labelled edges)
+        if node in self.values:
+            del self.values[node]
+
         if node in self.outgoing:
             del self.outgoing[node]
         if node in self.incoming:
             del self.incoming[node]
+        self.labelled.pop(node, None)
+        self.labelled_node.pop(node, None)
 
     def delete_edge(self, edge: Edge) -> None:
         if edge not in self.edges:
@@ -248,6 +239,21 @@ class PyState(State):
             self.outgoing[s].remove(edge)
 
         del self.edges[edge]
+        self.version += 1
+
+        if s in self.edges:
+            # edge was a label of edge s, but s may have another label with the same value
+            label_nodes = [self.edges[i][1] for i in self.outgoing.get(s, ())]
+            if t not in label_nodes:
+                self._remove_labelled(self.labelled_node, self.edges[s][0], t, s)
+            if t in self.values and self.values[t] not in [self.values.get(n) for n in label_nodes]:
+                self._remove_labelled(self.labelled, self.edges[s][0], self.values[t], s)
+        for e in self.outgoing.get(edge, ()):
+            # edge itself is labelled
+            label_node = self.edges[e][1]
+            self._remove_labelled(self.labelled_node, s, label_node, edge)
+            if label_node in self.values:
+                self._remove_labelled(self.labelled, s, self.values[label_node], edge)
 
         s = set()
         if edge in self.outgoing:
@@ -265,12 +271,23 @@ class PyState(State):
         if edge in self.incoming:
             del self.incoming[edge]
 
+        self.labelled.pop(edge, None)
+        self.labelled_node.pop(edge, None)
+
         if self.GC and (t in self.incoming and not self.incoming[t]) and (t not in self.edges):
             # Remove this node as well
             # Edges aren't deleted like this, as they might have a reachable target and source!
             # If they haven't, they will be removed because the source was removed.
             self.to_delete.add(t)
 
+    # Removes edge from self.labelled or self.labelled_node
+    def _remove_labelled(self, index: dict, source: Element, label: Any, edge: Edge):
+        labels = index.get(source)
+        if labels != None and edge in labels.get(label, ()):
+            labels[label].remove(edge)
+            if len(labels[label]) == 0:
+                del labels[label]
+
     def purge(self):
         while self.to_delete:
             t = self.to_delete.pop()
@@ -293,21 +310,6 @@ class PyState(State):
                 if elem in self.incoming:
                     visit_list.extend(self.incoming[elem])
 
-        dset = set()
-        for key in self.cache:
-            if key not in self.nodes and key not in self.edges:
-                dset.add(key)
-        for key in dset:
-            del self.cache[key]
-            del self.cache_all[key]
-
-        dset = set()
-        for key in self.cache_node:
-            if key not in self.nodes and key not in self.edges:
-                dset.add(key)
-        for key in dset:
-            del self.cache_node[key]
-
         # All remaining elements are to be purged
         if len(values) > 0:
             while values:
@@ -2,10 +2,18 @@ import pytest
 from state.pystate import PyState
 from state.rdfstate import RDFState
 from state.neo4jstate import Neo4jState
+from state.overlaystate import OverlayState
+from state.compactstate import CompactState
+
+
+def overlay_on_pystate():
+    return OverlayState(PyState())
 
 
 @pytest.fixture(params=[
     (PyState,),
+    (overlay_on_pystate,),
+    (CompactState,),
     (RDFState, "http://example.org/#"),
 #    (Neo4jState,)
 ])
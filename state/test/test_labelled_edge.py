@@ -0,0 +1,73 @@
+import pytest
+
+
+@pytest.mark.usefixtures("state")
+def test_create_labelled_edge(state):
+    a = state.create_node()
+    b = state.create_node()
+    e = state.create_labelled_edge(a, "f", b)
+    assert e != None
+    assert state.read_edge(e) == (a, b)
+    assert state.read_labelled_edges(a, "f") == [e]
+    assert state.read_dict(a, "f") == b
+    # the label is still visible as an edge-on-edge
+    l, = state.read_outgoing(e)
+    assert state.read_value(state.read_edge(l)[1]) == "f"
+
+
+@pytest.mark.usefixtures("state")
+def test_create_labelled_edge_no_source(state):
+    b = state.create_node()
+    assert state.create_labelled_edge(-1, "f", b) == None
+    assert state.read_labelled_edges(-1, "f") == []
+
+
+@pytest.mark.usefixtures("state")
+def test_read_labelled_edges_multiple(state):
+    a = state.create_node()
+    b = state.create_node()
+    c = state.create_node()
+    e1 = state.create_labelled_edge(a, "f", b)
+    e2 = state.create_labelled_edge(a, "f", c)
+    e3 = state.create_labelled_edge(a, "g", c)
+    assert set(state.read_labelled_edges(a, "f")) == set([e1, e2])
+    assert state.read_labelled_edges(a, "g") == [e3]
+    assert state.read_labelled_edges(a, "h") == []
+
+
+@pytest.mark.usefixtures("state")
+def test_read_labelled_edges_reified(state):
+    # labelled edges created in the old way are also found
+    a = state.create_node()
+    b = state.create_node()
+    e = state.create_edge(a, b)
+    n = state.create_nodevalue("f")
+    state.create_edge(e, n)
+    assert state.read_labelled_edges(a, "f") == [e]
+
+
+@pytest.mark.usefixtures("state")
+def test_read_labelled_edges_after_delete(state):
+    a = state.create_node()
+    b = state.create_node()
+    c = state.create_node()
+    e1 = state.create_labelled_edge(a, "f", b)
+    e2 = state.create_labelled_edge(a, "f", c)
+    e3 = state.create_labelled_edge(a, "g", c)
+
+    state.delete_edge(e1)
+    assert state.read_labelled_edges(a, "f") == [e2]
+
+    # deleting the label
+    l, = state.read_outgoing(e3)
+    state.delete_node(state.read_edge(l)[1])
+    assert state.read_labelled_edges(a, "g") == []
+
+    # deleting the target
+    state.delete_node(c)
+    assert state.read_labelled_edges(a, "f") == []
+
+    # deleting the source
+    state.create_labelled_edge(b, "f", a)
+    state.delete_node(b)
+    assert state.read_labelled_edges(b, "f") == []
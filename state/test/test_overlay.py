@@ -0,0 +1,131 @@
+from state.pystate import PyState
+from state.overlaystate import OverlayState
+from state.devstate import DevState
+
+
+def make_base():
+    base = PyState()
+    a = base.create_node()
+    b = base.create_node()
+    base.create_dict(a, "f", b)
+    return base, a, b
+
+
+def test_overlay_reads_base():
+    base, a, b = make_base()
+    overlay = OverlayState(base)
+    assert overlay.read_dict(a, "f") == b
+    assert set(overlay.read_outgoing(a)) == set(base.read_outgoing(a))
+    assert overlay.read_root() == base.read_root()
+
+
+def test_overlay_does_not_modify_base():
+    base, a, b = make_base()
+    overlay = OverlayState(base)
+    c = overlay.create_node()
+    overlay.create_dict(a, "g", c)
+    overlay.delete_node(b)
+
+    assert overlay.read_dict(a, "f") == None
+    assert overlay.read_dict(a, "g") == c
+    assert overlay.read_outgoing(b) == None
+
+    assert base.read_dict(a, "f") == b
+    assert base.read_dict(a, "g") == None
+    assert base.read_outgoing(c) == None
+    assert len(base.read_outgoing(a)) == 1
+
+
+def test_overlay_siblings_independent():
+    base, a, b = make_base()
+    overlay1 = OverlayState(base)
+    overlay2 = OverlayState(base)
+    overlay1.delete_node(b)
+    c = overlay2.create_node()
+    overlay2.create_dict(a, "f", c)
+
+    assert overlay1.read_dict_edge_all(a, "f") == []
+    assert overlay2.read_dict(a, "f") in [b, c]
+    assert len(overlay2.read_dict_edge_all(a, "f")) == 2
+
+
+def test_overlay_on_overlay():
+    base, a, b = make_base()
+    overlay1 = OverlayState(base)
+    c = overlay1.create_node()
+    overlay1.create_dict(a, "g", c)
+
+    overlay2 = OverlayState(overlay1)
+    assert overlay2.base is base
+    assert overlay2.read_dict(a, "g") == c
+    overlay2.delete_node(c)
+    assert overlay2.read_dict(a, "g") == None
+
+    # changes to the new overlay do not affect the overlay it was created from
+    assert overlay1.read_dict(a, "g") == c
+    assert len(overlay1.read_outgoing(a)) == 2
+
+
+# Everything that can be read about the given elements
+def read_all(state, elements):
+    result = {}
+    for elem in elements:
+        outgoing = state.read_outgoing(elem)
+        result[elem] = (
+            state.read_value(elem),
+            state.read_edge(elem),
+            outgoing != None and sorted(outgoing),
+            state.read_incoming(elem) != None and sorted(state.read_incoming(elem)),
+            state.read_labels(elem) != None and sorted(state.read_labels(elem), key=str),
+            state.read_dict_keys(elem) != None and sorted(state.read_dict_keys(elem)),
+        )
+        for label in state.read_labels(elem) or []:
+            result[(elem, label)] = state.read_labelled_edges(elem, label)
+        for key in state.read_dict_keys(elem) or []:
+            result[(elem, key)] = state.read_dict_node_edge(elem, key)
+    return result
+
+
+def test_overlay_materialize(monkeypatch):
+    monkeypatch.setattr(OverlayState, "MATERIALIZE_MIN", 10)
+    # DevState generates the same IDs for the same sequence of operations
+    reference = DevState()
+    state = DevState()
+    a = reference.create_node()
+    assert state.create_node() == a
+    elements = [a]
+    bases = set()
+    for step in range(40):
+        # every step is a new overlay on top of the previous one, like in a simulation
+        state = OverlayState(state)
+        bases.add(id(state.base))
+        for s in (reference, state):
+            n = s.create_nodevalue(step)
+            s.create_dict(a, f"key{step % 5}", n) # labels are reused
+            if step % 3 == 0:
+                s.delete_node(s.read_dict(a, f"key{(step + 2) % 5}"))
+            if step % 7 == 0:
+                s.create_labelled_edge(a, "twice", n)
+        elements += [n]
+        assert read_all(state, elements) == read_all(reference, elements)
+        # the delta does not keep growing
+        assert state._delta_size() <= max(OverlayState.MATERIALIZE_MIN, state._base_size() // OverlayState.MATERIALIZE_FRACTION) + 10
+
+    assert len(bases) > 1
+    materialized = state.materialize()
+    assert isinstance(materialized, DevState)
+    assert read_all(materialized, elements) == read_all(reference, elements)
+    assert materialized.labelled == reference.labelled
+    assert materialized.labelled_node == reference.labelled_node
+
+
+def test_overlay_materialize_ids():
+    base = DevState()
+    overlay = OverlayState(base)
+    overlay.create_node()
+    sibling = OverlayState(base)
+    materialized = overlay.materialize()
+    # the materialized state and (overlays on) its base draw from the same IDs
+    ids = [materialized.create_node(), sibling.create_node(), base.new_id(), materialized.create_nodevalue(1)]
+    assert len(set(ids)) == len(ids)
+    assert materialized.read_outgoing(ids[1]) == None
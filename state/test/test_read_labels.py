@@ -0,0 +1,45 @@
+import pytest
+
+
+@pytest.mark.usefixtures("state")
+def test_read_labels_no_exists(state):
+    assert state.read_labels(-1) == None
+
+
+@pytest.mark.usefixtures("state")
+def test_read_labels_empty(state):
+    a = state.create_node()
+    b = state.create_node()
+    state.create_edge(a, b)
+    assert state.read_labels(a) == []
+
+
+@pytest.mark.usefixtures("state")
+def test_read_labels_unique(state):
+    a = state.create_node()
+    b = state.create_node()
+    c = state.create_node()
+    state.create_dict(a, "f", b)
+    state.create_dict(a, "f", c)
+    state.create_dict(a, "g", c)
+    state.create_dict(b, "h", c)
+    assert sorted(state.read_labels(a)) == ["f", "g"]
+    assert state.read_labels(b) == ["h"]
+    assert state.read_labels(c) == []
+
+
+@pytest.mark.usefixtures("state")
+def test_read_labels_after_delete(state):
+    a = state.create_node()
+    b = state.create_node()
+    c = state.create_node()
+    e1 = state.create_labelled_edge(a, "f", b)
+    e2 = state.create_labelled_edge(a, "f", c)
+    e3 = state.create_labelled_edge(a, "g", c)
+
+    state.delete_edge(e1)
+    assert sorted(state.read_labels(a)) == ["f", "g"]
+    state.delete_edge(e3)
+    assert state.read_labels(a) == ["f"]
+    state.delete_node(c)
+    assert state.read_labels(a) == []
@@ -0,0 +1,45 @@
+import pytest
+
+
+@pytest.mark.usefixtures("state")
+def test_read_version_changes_on_modification(state):
+    v0 = state.read_version()
+    if v0 == None:
+        pytest.skip("state does not keep track of modifications")
+
+    a = state.create_node()
+    v1 = state.read_version()
+    assert v1 != v0
+
+    b = state.create_nodevalue(1)
+    v2 = state.read_version()
+    assert v2 not in [v0, v1]
+
+    e = state.create_edge(a, b)
+    v3 = state.read_version()
+    assert v3 not in [v0, v1, v2]
+
+    state.delete_edge(e)
+    v4 = state.read_version()
+    assert v4 not in [v0, v1, v2, v3]
+
+    state.delete_node(a)
+    v5 = state.read_version()
+    assert v5 not in [v0, v1, v2, v3, v4]
+
+
+@pytest.mark.usefixtures("state")
+def test_read_version_unchanged_on_read(state):
+    a = state.create_node()
+    b = state.create_node()
+    state.create_dict(a, "f", b)
+    v = state.read_version()
+    if v == None:
+        pytest.skip("state does not keep track of modifications")
+
+    state.read_dict(a, "f")
+    state.read_dict_keys(a)
+    state.read_outgoing(a)
+    state.read_incoming(b)
+    state.delete_node(100000) # does not exist
+    assert state.read_version() == v
@@ -1,9 +1,91 @@
 from uuid import UUID
 from concrete_syntax.textual_od import parser, renderer
 from concrete_syntax.common import indent
+from services.bottom.V0 import Bottom
+from services import od
 
 # Clones an object diagram
+# Instead of rendering and re-parsing the model, its elements are copied directly in the state graph.
 def clone_od(state, m: UUID, mm: UUID):
-    # cheap-ass implementation: render and parse
+    bottom = Bottom(state)
+    modelref_node = od.get_scd_mm_modelref_node(bottom)
+
+    cloned_m = bottom.create_node()
+
+    # (name, element) for every element of the model
+    named_elements = [(key, el) for key in bottom.read_keys(m) for el in bottom.read_outgoing_elements(m, key)]
+    in_model = set(el for _, el in named_elements)
+    edge_targets = set(state.read_edge(el)[1] for el in in_model if bottom.is_edge(el))
+
+    mapping = {} # original element -> cloned element
+
+    def copy_types(el, cloned_el):
+        for typ in bottom.read_outgoing_elements(el, "Morphism"):
+            bottom.create_edge(cloned_el, typ, "Morphism")
+
+    # Slot values are ModelRefs, e.g., an Integer, that either contain their value (inline),
+    # or refer to a (primitive value) model that belongs to the slot, e.g., an Integer-model.
+    # We recognize them by their type, which is itself typed by ModelRef.
+    # Returns the key of the value in the referred model ("integer", ...), or None if el is not a slot value.
+    value_type_keys = {}
+    def get_slot_value_key(el):
+        typ = od.get_type(bottom, el)
+        if typ not in value_type_keys:
+            if typ != None and od.is_typed_by(bottom, typ, modelref_node):
+                value_type_keys[typ] = od.PRIMITIVE_KEYS.get(od.get_object_name(bottom, mm, typ), "")
+            else:
+                value_type_keys[typ] = None
+        return value_type_keys[typ]
+
+    # 1. Nodes (objects and slot values)
+    for _, el in named_elements:
+        if bottom.is_edge(el) or el in mapping:
+            continue
+        value = bottom.read_value(el)
+        key = get_slot_value_key(el) if value != None else None
+        if key != None:
+            if el not in edge_targets:
+                # left behind when its object was deleted - don't copy garbage
+                continue
+            if key == "":
+                # not a primitive type: the value is a model of its own (conforming to the model referred to by the type),
+                # which is deep-copied, so that the clone can be modified independently
+                value = str(clone_od(state, UUID(value), UUID(bottom.read_value(od.get_type(bottom, el)))))
+            else:
+                # primitive values are cloned in the same way as the OD service creates them (so cloning also converts values stored by reference to inline values)
+                mapping[el] = od.create_value_node(bottom, od.read_modelref_value(bottom, el, key))
+                copy_types(el, mapping[el])
+                continue
+        mapping[el] = bottom.create_node(value)
+        copy_types(el, mapping[el])
+
+    # 2. Edges (links and slot-links) - an edge can only be created after its source and target
+    todo = [el for _, el in named_elements if bottom.is_edge(el)]
+    while len(todo) > 0:
+        next_round = []
+        for el in todo:
+            if el in mapping:
+                continue
+            src, tgt = state.read_edge(el)
+            if (src in in_model and src not in mapping) or (tgt in in_model and tgt not in mapping):
+                next_round.append(el) # try again later...
+                continue
+            # source/target outside of the model (e.g., a type model) are shared with the clone
+            mapping[el] = bottom.create_edge(mapping.get(src, src), mapping.get(tgt, tgt))
+            copy_types(el, mapping[el])
+        if len(next_round) == len(todo):
+            raise Exception("We got stuck!")
+        todo = next_round
+
+    # 3. Names
+    for key, el in named_elements:
+        if el in mapping:
+            bottom.create_edge(cloned_m, mapping[el], key)
+
+    return cloned_m
+
+# Slower alternative: render and parse
+# Only preserves the elements that can be expressed in the textual syntax.
+def clone_od_textual(state, m: UUID, mm: UUID):
     cs = renderer.render_od(state, m, mm, hide_names=False)
-    return parser.parse_od(state, cs, mm)
\ No newline at end of file
+    return parser.parse_od(state, cs, mm)
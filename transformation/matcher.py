@@ -1,4 +1,4 @@
-from api.cd import CDAPI
+from api.cd import get_cdapi
 from api.od import ODAPI, bind_api_readonly
 from util.eval import exec_then_eval
 from state.base import State
@@ -6,10 +6,10 @@ from uuid import UUID
 from services.bottom.V0 import Bottom
 from services.scd import SCD
 from services import od as services_od
-from transformation.vf2 import Graph, Edge, Vertex, MatcherVF2
+from transformation.vf2 import Graph, Edge, Vertex, MatcherVF2, find_connected_components
 from transformation import ramify
 import itertools
-import re
+import types
 import functools
 
 from util.timer import Timer, counted
@@ -69,16 +69,11 @@ class MVSEdge(NamedNode):
         return f"E({self.name})"
         # return f"E({self.name}{str(self.node_id)[-4:]})"
 
-# dirty way of detecting whether a node is a ModelRef
-UUID_REGEX = re.compile(r"[0-9a-z][0-9a-z][0-9a-z][0-9a-z][0-9a-z][0-9a-z][0-9a-z][0-9a-z]-[0-9a-z][0-9a-z][0-9a-z][0-9a-z]-[0-9a-z][0-9a-z][0-9a-z][0-9a-z]-[0-9a-z][0-9a-z][0-9a-z][0-9a-z]-[0-9a-z][0-9a-z][0-9a-z][0-9a-z][0-9a-z][0-9a-z][0-9a-z][0-9a-z][0-9a-z][0-9a-z][0-9a-z][0-9a-z]")
-
 # Converts an object diagram in MVS state to the pattern matcher graph type
 # ModelRefs are flattened
 def model_to_graph(state: State, model: UUID, metamodel: UUID,
     _filter=lambda node: True, prefix=""):
     # with Timer("model_to_graph"):
-        od = services_od.OD(model, metamodel, state)
-        scd = SCD(model, state)
         scd_mm = SCD(metamodel, state)
 
         bottom = Bottom(state)
@@ -86,26 +81,44 @@ def model_to_graph(state: State, model: UUID, metamodel: UUID,
         graph = Graph()
 
         mvs_edges = []
-        modelrefs = {}
         names = {}
 
+        # The types in the metamodel that are ModelRefs (e.g., Integer, String, ...)
+        modelref_types = set(services_od.get_typed_by(bottom, metamodel, services_od.get_scd_mm_modelref_node(bottom)).values())
+
+        # We add typing information for:
+        #   - classes
+        #   - attributes
+        #   - associations
+        # Put the type straight into the Vertex-object
+        # The benefit is that our Vertex-matching callback can then be coded cleverly, look at the types first, resulting in better performance
+        types_to_add = set()
+        for class_name, class_node in scd_mm.get_classes().items():
+            types_to_add.add(class_node)
+            types_to_add.update(scd_mm.get_attributes(class_name).values())
+        types_to_add.update(scd_mm.get_associations().values())
+
         def to_vtx(el, name):
             # print("name:", name)
+            types = bottom.read_outgoing_elements(el, "Morphism")
+            typ = types[0] if len(types) == 1 else None
             if bottom.is_edge(el):
                 mvs_edges.append(el)
-                edge = MVSEdge(el, name)
-                names[name] = edge
-                return edge
-            # If the value of the el is a ModelRef (only way to detect this is to match a regex - not very clean), then extract it. We'll create a link to the referred model later.
-            value = bottom.read_value(el)
-            if isinstance(value, str):
-                if UUID_REGEX.match(value) != None:
-                    # side-effect
-                    modelrefs[el] = (UUID(value), name)
-                    return MVSNode(IS_MODELREF, el, name)
-            node = MVSNode(value, el, name)
-            names[name] = node
-            return node
+                vtx = MVSEdge(el, name)
+                names[name] = vtx
+            else:
+                value = bottom.read_value(el)
+                if value != None and typ in modelref_types:
+                    # ModelRefs (including primitive values, whether they are stored inline or by reference) are recognized by their type
+                    vtx = MVSNode(IS_MODELREF, el, name)
+                    # type of the referred model
+                    vtx.modelref = typ
+                else:
+                    vtx = MVSNode(value, el, name)
+                    names[name] = vtx
+            if typ in types_to_add:
+                vtx.typ = typ
+            return vtx
 
         # Objects and Links become vertices
         uuid_to_vtx = { node: to_vtx(node, prefix+key) for key in bottom.read_keys(model) for node in bottom.read_outgoing_elements(model, key) if _filter(node) }
@@ -126,40 +139,176 @@ def model_to_graph(state: State, model: UUID, metamodel: UUID,
                     tgt=uuid_to_vtx[mvs_tgt],
                     label="tgt"))
 
-        for node, (ref_m, name) in modelrefs.items():
-            vtx = uuid_to_vtx[node]
-            # Get MM of ref'ed model
-            ref_mm, = bottom.read_outgoing_elements(node, "Morphism")
-            vtx.modelref = (ref_m, ref_mm)
-
-        def add_types(node):
-            vtx = uuid_to_vtx[node]
-            type_node, = bottom.read_outgoing_elements(node, "Morphism")
-            # Put the type straight into the Vertex-object
-            # The benefit is that our Vertex-matching callback can then be coded cleverly, look at the types first, resulting in better performance
-            vtx.typ = type_node
+        return names, graph
 
-        # Add typing information for:
-        #   - classes
-        #   - attributes
-        #   - associations
-        for class_name, class_node in scd_mm.get_classes().items():
-            objects = scd.get_typed_by(class_node)
-            for obj_name, obj_node in objects.items():
-                if _filter(obj_node):
-                    add_types(obj_node)
-            for attr_name, attr_node in scd_mm.get_attributes(class_name).items():
-                attrs = scd.get_typed_by(attr_node)
-                for slot_name, slot_node in attrs.items():
-                    if _filter(slot_node):
-                        add_types(slot_node)
-        for assoc_name, assoc_node in scd_mm.get_associations().items():
-            objects = scd.get_typed_by(assoc_node)
-            for link_name, link_node in objects.items():
-                if _filter(link_node):
-                    add_types(link_node)
+# Everything match_od derives from the host model.
+# This is the same for every pattern that is matched against the same host model, so it can be shared, see HostGraphCache.
+class HostGraph:
+    def __init__(self, state, host_m, host_mm):
+        # compute subtype relations and such:
+        self.cdapi = get_cdapi(state, host_mm)
+        self.odapi = ODAPI(state, host_m, host_mm)
+        self.bound_api = bind_api_readonly(self.odapi)
+        # Convert to format understood by matching algorithm
+        self.names, self.graph = model_to_graph(state, host_m, host_mm)
+        # type name -> vertices of instances (including instances of subtypes)
+        self.candidates = {}
+        self.vtx_index = None
+
+    # Get the host vertices that a guest vertex of the given (un-RAMified) type can be matched with.
+    # They are in the same order as in the host graph, such that the order in which matches are found does not change.
+    def get_candidates(self, type_name):
+        if type_name not in self.candidates:
+            if self.vtx_index == None:
+                self.vtx_index = { vtx: i for i, vtx in enumerate(self.graph.vtxs) }
+            vtxs = [self.names[obj_name]
+                for sub_type_name in self.cdapi.transitive_sub_types[type_name]
+                    for obj_name in self.odapi.type_to_objs[sub_type_name]]
+            vtxs.sort(key=lambda vtx: self.vtx_index[vtx])
+            self.candidates[type_name] = vtxs
+        return self.candidates[type_name]
+
+# Reuses HostGraphs across calls to match_od (e.g., to match the LHS and NACs of a rule, or several rules on the same model).
+# A HostGraph is only reused if the state has not been modified in the meantime.
+class HostGraphCache:
+    def __init__(self, max_size=8):
+        self.max_size = max_size
+        self.entries = {} # (state, host_m, host_mm) -> (state version, HostGraph), least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, state, host_m, host_mm) -> HostGraph:
+        version = state.read_version()
+        if version == None:
+            # we cannot tell if the state has been modified
+            return HostGraph(state, host_m, host_mm)
+        key = (state, host_m, host_mm)
+        entry = self.entries.pop(key, None)
+        if entry != None and entry[0] == version:
+            self.hits += 1
+        else:
+            self.misses += 1
+            entry = (version, HostGraph(state, host_m, host_mm))
+        self.entries[key] = entry
+        if len(self.entries) > self.max_size:
+            del self.entries[next(iter(self.entries))]
+        return entry[1]
+
+# Only match matchable pattern elements
+# E.g., the 'condition'-attribute that is added to every class, cannot be matched with anything
+def _is_matchable(pattern_odapi, pattern_el):
+    pattern_el_name = pattern_odapi.get_name(pattern_el)
+    if pattern_odapi.get_type_name(pattern_el) == "GlobalCondition":
+        return False
+    # Super-cheap and unreliable way of filtering out the 'condition'-attribute, added to every class:
+    return ((not pattern_el_name.endswith("condition")
+        # as an extra safety measure, if the user defined her own 'condition' attribute, RAMification turned this into 'RAM_condition', and we can detect this
+        # of course this breaks if the class name already ended with 'RAM', but let's hope that never happens
+        # also, we are assuming the default "RAM_" prefix is used, but the user can change this...
+        or pattern_el_name.endswith("RAM_condition"))
+    and (
+            not pattern_el_name.endswith("name")
+            or pattern_el_name.endswith("RAM_name") # same thing here as with the condition, explained above.
+        ))
+
+# Everything match_od derives from the pattern model.
+# Patterns (e.g., the LHS, RHS and NACs of a rule) do not change, so this only has to be done once (see Rule.compile).
+# Can be passed to match_od and rewrite instead of the UUID of the pattern.
+class CompiledPattern:
+    def __init__(self, state, pattern_m: UUID, pattern_mm: UUID):
+        self.m = pattern_m
+        self.mm = pattern_mm
+        self.bottom = Bottom(state)
+
+        scd_mm = UUID(state.read_value(state.read_dict(state.read_root(), "SCD")))
+        self.odapi = ODAPI(state, pattern_m, pattern_mm)
+        self.mm_odapi = ODAPI(state, pattern_mm, scd_mm)
+
+        # Convert to format understood by matching algorithm
+        self.names, self.graph = model_to_graph(state, pattern_m, pattern_mm,
+            _filter=lambda pattern_el: _is_matchable(self.odapi, pattern_el))
+        self.components = find_connected_components(self.graph)
+
+        # guest vertex -> the (un-RAMified) type in the host meta-model
+        self.original_types = {
+            g_vtx: ramify.get_original_type(self.bottom, g_vtx.typ)
+                for g_vtx in self.graph.vtxs if hasattr(g_vtx, 'typ')
+        }
 
-        return names, graph
+        # (python code, pattern element name), or (python code, None) for global conditions
+        self.obj_conditions = []
+        for class_name, class_node in self.mm_odapi.get_all_instances("Class"):
+            for obj_name, obj_node in self.odapi.get_all_instances(class_name):
+                python_code = self.odapi.get_slot_value_default(obj_node, "condition", 'True')
+                if class_name == "GlobalCondition":
+                    self.obj_conditions.append((python_code, None))
+                else:
+                    self.obj_conditions.append((python_code, obj_name))
+
+        # guest vertex -> python code, only read when needed
+        self.attr_conditions = {}
+
+        # (un-RAMified) type name -> number of pattern elements of that type, only computed when needed
+        self.type_counts = None
+
+    def get_attr_condition(self, g_vtx):
+        if g_vtx not in self.attr_conditions:
+            self.attr_conditions[g_vtx] = services_od.read_primitive_value(self.bottom, g_vtx.node_id, self.mm)[0]
+        return self.attr_conditions[g_vtx]
+
+    # A match maps every pattern element onto a different host element, so the host model needs at least this many instances of every type (including subtypes).
+    # Only classes and associations are counted.
+    def get_type_counts(self, cdapi):
+        if self.type_counts == None:
+            self.type_counts = {}
+            for typ in self.original_types.values():
+                type_name = cdapi.type_model_names.get(typ)
+                if type_name in cdapi.transitive_sub_types:
+                    self.type_counts[type_name] = self.type_counts.get(type_name, 0) + 1
+        return self.type_counts
+
+# Wraps API functions, such that 'record' is called with the positional arguments of every call
+def _record_calls(funcs: dict, record):
+    def wrap(f):
+        def recording(*args, **kwargs):
+            record(args)
+            return f(*args, **kwargs)
+        return recording
+    return { name: wrap(f) for name, f in funcs.items() }
+
+# Wraps a compare function (see MatcherVF2), such that the names of all host vertices that it is called with are added to 'visited'
+def _record_visits(compare, visited: set):
+    def compare_fn(g_vtx, h_vtx):
+        visited.add(h_vtx.name)
+        return compare(g_vtx, h_vtx)
+    return compare_fn
+
+# Same as _record_calls, for the 'odapi'-object that is available to condition-code
+class _RecordingODAPI:
+    def __init__(self, odapi, record):
+        self._odapi = odapi
+        self._record = record
+
+    def __getattr__(self, attr):
+        value = getattr(self._odapi, attr)
+        if callable(value):
+            return _record_calls({attr: value}, self._record)[attr]
+        return value
+
+# Added to 'reads' (see match_od) when condition-code calls a function from eval_context:
+# the outcome of the condition may then depend on anything in the model
+READS_ANYTHING = object()
+
+# Wraps the (user-defined) functions in eval_context, such that 'record' is called on every call.
+# Classes and builtins (e.g., len) are left alone.
+def _record_helper_calls(eval_context: dict, record):
+    def wrap(f):
+        def recording(*args, **kwargs):
+            record()
+            return f(*args, **kwargs)
+        return recording
+    return { name: wrap(value) if callable(value) and not isinstance(value, (type, types.BuiltinFunctionType)) else value
+        for name, value in eval_context.items() }
 
 class _No_Matched(Exception):
     pass
@@ -171,25 +320,52 @@ def _cannot_call_matched(_):
 def match_od(state,
     host_m, # the host graph, in which to search for matches
     host_mm, # meta-model of the host graph
-    pattern_m, # the pattern to look for
+    pattern_m, # the pattern to look for (UUID or CompiledPattern)
     pattern_mm, # the meta-model of the pattern (typically the RAMified version of host_mm)
     pivot={}, # optional: a partial match (restricts possible matches, and speeds up the match process)
     eval_context={}, # optional: additional variables, functions, ... to be available while evaluating condition-code in the pattern. Will be available as global variables in the condition-code.
+    host_cache=None, # optional: HostGraphCache, to reuse the host graph of an earlier call
+    check_pivot=False, # optional: also check that the pivot itself matches (types, attribute conditions), instead of assuming it does
+    nacs=[], # optional: negative application conditions (UUIDs or CompiledPatterns) - only matches that cannot be extended to a match of any of the NACs are generated
+    reads=None, # optional: set to which the names of the host elements (and the other names, e.g., of types) that are read by condition-code are added (READS_ANYTHING if it calls a function from eval_context)
+    visited=None, # optional: set to which the names of all host elements that the matcher has tried to match with a pattern element are added
 ):
     bottom = Bottom(state)
 
-    # compute subtype relations and such:
-    cdapi = CDAPI(state, host_mm)
-    odapi = ODAPI(state, host_m, host_mm)
-    pattern_odapi = ODAPI(state, pattern_m, pattern_mm)
-    pattern_mm_odapi = ODAPI(state, pattern_mm, cdapi.mm)
+    if host_cache != None:
+        host_graph = host_cache.get(state, host_m, host_mm)
+    else:
+        host_graph = HostGraph(state, host_m, host_mm)
+    cdapi = host_graph.cdapi
+    odapi = host_graph.odapi
+
+    if isinstance(pattern_m, CompiledPattern):
+        pattern = pattern_m
+    else:
+        pattern = CompiledPattern(state, pattern_m, pattern_mm)
 
     # 'globals'-dict used when eval'ing conditions
-    bound_api = bind_api_readonly(odapi)
+    bound_api = host_graph.bound_api
+    api_odapi = odapi
+    if reads != None:
+        # Record the arguments of every call, so we know what the outcome of the conditions depends on.
+        # Elements are recorded by name, because names (unlike UUIDs) are preserved when a model is cloned.
+        def record(args):
+            for arg in args:
+                if isinstance(arg, UUID):
+                    name = odapi.m_obj_to_name.get(arg)
+                    if name != None:
+                        reads.add(name)
+                elif isinstance(arg, str):
+                    reads.add(arg)
+        bound_api = _record_calls(bound_api, record)
+        api_odapi = _RecordingODAPI(odapi, record)
+        # we cannot know what the functions in eval_context read
+        eval_context = _record_helper_calls(eval_context, lambda: reads.add(READS_ANYTHING))
     builtin = {
         **bound_api,
         'matched': _cannot_call_matched,
-        'odapi': odapi,
+        'odapi': api_odapi,
     }
     for key in eval_context:
         if key in builtin:
@@ -201,23 +377,21 @@ def match_od(state,
 
     # Function object for pattern matching. Decides whether to match host and guest vertices, where guest is a RAMified instance (e.g., the attributes are all strings with Python expressions), and the host is an instance (=object diagram) of the original model (=class diagram)
     class RAMCompare:
-        def __init__(self, bottom, host_od):
+        def __init__(self, bottom, pattern):
             self.bottom = bottom
-            self.host_od = host_od
+            self.pattern = pattern
 
             type_model_id = bottom.state.read_dict(bottom.state.read_root(), "SCD")
             self.scd_model = UUID(bottom.state.read_value(type_model_id))
 
             # constraints need to be checked at the very end, after a complete match is established, because constraint code may refer to matched elements by their name
+            # (guest name, host name) -> condition: the result of the comparison is memoized per pair of vertices, and so is the need to check its condition
             self.conditions_to_check = {}
 
-        def match_types(self, g_vtx_type, h_vtx_type):
+        def match_types(self, g_vtx, h_vtx_type):
             # types only match with their supertypes
             # we assume that 'RAMifies'-traceability links have been created between guest and host types
-            try:
-                g_vtx_unramified_type = ramify.get_original_type(self.bottom, g_vtx_type)
-            except:
-                return False
+            g_vtx_unramified_type = self.pattern.original_types[g_vtx]
 
             try:
                 host_type_name = cdapi.type_model_names[h_vtx_type]
@@ -241,14 +415,14 @@ def match_od(state,
                 if not hasattr(h_vtx, 'typ'):
                     # if guest has a type, host must have a type
                     return False
-                if not self.match_types(g_vtx.typ, h_vtx.typ):
+                if not self.match_types(g_vtx, h_vtx.typ):
                     return False
 
             if hasattr(g_vtx, 'modelref'):
                 if not hasattr(h_vtx, 'modelref'):
                     return False
 
-                python_code = services_od.read_primitive_value(self.bottom, g_vtx.node_id, pattern_mm)[0]
+                python_code = self.pattern.get_attr_condition(g_vtx)
 
                 try:
                     # Try to execute code, but the likelyhood of failing is high:
@@ -258,10 +432,9 @@ def match_od(state,
                         ok = exec_then_eval(python_code,
                             _globals=eval_globals,
                             _locals={'this': h_vtx.node_id})
-                    self.conditions_to_check.pop(g_vtx.name, None)
                     return ok
                 except:
-                    self.conditions_to_check[g_vtx.name] = python_code
+                    self.conditions_to_check[(g_vtx.name, h_vtx.name)] = python_code
                     return True # to be determined later, if it's actually a match
 
             if g_vtx.value == None:
@@ -282,48 +455,29 @@ def match_od(state,
 
             return True
 
-    # Convert to format understood by matching algorithm
-    h_names, host = model_to_graph(state, host_m, host_mm)
-
-    # Only match matchable pattern elements
-    # E.g., the 'condition'-attribute that is added to every class, cannot be matched with anything
-    def is_matchable(pattern_el):
-        pattern_el_name = pattern_odapi.get_name(pattern_el)
-        if pattern_odapi.get_type_name(pattern_el) == "GlobalCondition":
-            return False
-        # Super-cheap and unreliable way of filtering out the 'condition'-attribute, added to every class:
-        return ((not pattern_el_name.endswith("condition")
-            # as an extra safety measure, if the user defined her own 'condition' attribute, RAMification turned this into 'RAM_condition', and we can detect this
-            # of course this breaks if the class name already ended with 'RAM', but let's hope that never happens
-            # also, we are assuming the default "RAM_" prefix is used, but the user can change this...
-            or pattern_el_name.endswith("RAM_condition"))
-        and (
-                not pattern_el_name.endswith("name")
-                or pattern_el_name.endswith("RAM_name") # same thing here as with the condition, explained above.
-            ))
-
-    g_names, guest = model_to_graph(state, pattern_m, pattern_mm,
-        _filter=is_matchable)
-
-    # precompute the candidates for every guest vertex:
-    guest_to_host_candidate_vtxs = {}
-    vtxs_of_host_type = {}
-
-    for g_vtx in guest.vtxs:
-        object_node = g_vtx.node_id
-        if hasattr(g_vtx, 'typ'):
-            orig_class_node = ramify.get_original_type(bottom, g_vtx.typ)
-            orig_class_name = odapi.get_name(orig_class_node)
-            if orig_class_name in vtxs_of_host_type:
-                cands = vtxs_of_host_type[orig_class_name]
+    h_names, host = host_graph.names, host_graph.graph
+    g_names, guest = pattern.names, pattern.graph
+
+    # A MatcherVF2 for the pattern, with the candidates of every guest vertex precomputed
+    def make_matcher(pattern, compare):
+        guest_to_host_candidate_vtxs = {} # guest vertex -> number of candidates
+        guest_to_host_candidates = {} # guest vertex -> candidates (only for guest vertices that have a type)
+
+        for g_vtx in pattern.graph.vtxs:
+            if hasattr(g_vtx, 'typ'):
+                orig_class_node = pattern.original_types[g_vtx]
+                orig_class_name = odapi.get_name(orig_class_node)
+                guest_to_host_candidates[g_vtx] = host_graph.get_candidates(orig_class_name)
+                cands = len(guest_to_host_candidates[g_vtx])
             else:
-                cands = vtxs_of_host_type[orig_class_name] = len(odapi.get_all_instances(orig_class_name, include_subtypes=True))
-        else:
-            cands = len(host.vtxs)
-        guest_to_host_candidate_vtxs[g_vtx] = cands
+                cands = len(host.vtxs)
+            guest_to_host_candidate_vtxs[g_vtx] = cands
 
-    # print(guest_to_host_candidate_vtxs)
+        # print(guest_to_host_candidate_vtxs)
 
+        if visited != None:
+            compare = _record_visits(compare, visited)
+        return MatcherVF2(host, pattern.graph, compare, guest_to_host_candidate_vtxs, pattern.components, guest_to_host_candidates)
 
     # transform 'pivot' into something VF2 understands
     graph_pivot = {
@@ -332,21 +486,22 @@ def match_od(state,
                 if guest_name in g_names
     }
 
-    obj_conditions = []
-    for class_name, class_node in pattern_mm_odapi.get_all_instances("Class"):
-        for obj_name, obj_node in pattern_odapi.get_all_instances(class_name):
-            python_code = pattern_odapi.get_slot_value_default(obj_node, "condition", 'True')
-            if class_name == "GlobalCondition":
-                obj_conditions.append((python_code, None))
-            else:
-                obj_conditions.append((python_code, obj_name))
-
+    def to_name_mapping(mapping_vtxs):
+        name_mapping = {}
+        for guest_vtx, host_vtx in mapping_vtxs.items():
+            if isinstance(guest_vtx, NamedNode) and isinstance(host_vtx, NamedNode):
+                name_mapping[guest_vtx.name] = host_vtx.name
+        return name_mapping
 
-    def check_conditions(name_mapping):
+    def check_conditions(pattern, compare, name_mapping):
+        def matched(name):
+            if reads != None:
+                reads.add(name_mapping[name])
+            return bottom.read_outgoing_elements(host_m, name_mapping[name])[0]
         eval_globals = {
             **bound_api,
             # this time, the real 'matched'-function can be used:
-            'matched': lambda name: bottom.read_outgoing_elements(host_m, name_mapping[name])[0],
+            'matched': matched,
             **eval_context,
         }
         def check(python_code: str, loc):
@@ -355,7 +510,7 @@ def match_od(state,
         # Attribute conditions
         for pattern_name, host_name in name_mapping.items():
             try:
-                python_code = compare.conditions_to_check[pattern_name]
+                python_code = compare.conditions_to_check[(pattern_name, host_name)]
             except KeyError:
                 continue
             host_node = odapi.get(host_name)
@@ -363,7 +518,7 @@ def match_od(state,
                 if not check(python_code, {'this': host_node}):
                     return False
 
-        for python_code, pattern_el_name in obj_conditions:
+        for python_code, pattern_el_name in pattern.obj_conditions:
             if pattern_el_name == None:
                 # GlobalCondition
                 with Timer(f'EVAL all global conditions'):
@@ -378,17 +533,51 @@ def match_od(state,
                         return False
         return True
 
-
-    compare = RAMCompare(bottom, services_od.OD(host_mm, host_m, state))
-    matcher = MatcherVF2(host, guest, compare, guest_to_host_candidate_vtxs)
+    # NACs are matched as extensions of the (vertex-level) match of the pattern, on the same host graph.
+    # For every NAC: (NAC, its RAMCompare, its MatcherVF2, (NAC vertex, pattern vertex) for every element they have in common)
+    # Only built once the first match is found.
+    nac_matchers = None
+    def make_nac_matchers():
+        result = []
+        for nac in nacs:
+            if not isinstance(nac, CompiledPattern):
+                nac = CompiledPattern(state, nac, pattern_mm)
+            nac_compare = RAMCompare(bottom, nac)
+            shared = [(nac_vtx, g_names[name]) for name, nac_vtx in nac.names.items() if name in g_names]
+            result.append((nac, nac_compare, make_matcher(nac, nac_compare), shared))
+        return result
+
+    # Can the match be extended to a match of any of the NACs? Stops at the first NAC-match.
+    def nac_matched(mapping_vtxs):
+        for i_nac, (nac, nac_compare, nac_matcher, shared) in enumerate(nac_matchers):
+            nac_pivot = { nac_vtx: mapping_vtxs[g_vtx] for nac_vtx, g_vtx in shared }
+            try:
+                with Timer(f'MATCH NAC{i_nac}'):
+                    for nac_m in nac_matcher.match(nac_pivot):
+                        if check_conditions(nac, nac_compare, to_name_mapping(nac_m.mapping_vtxs)):
+                            return True
+            except Exception as e:
+                e.add_note(f"while matching NAC{i_nac}")
+                raise
+        return False
+
+    compare = RAMCompare(bottom, pattern)
+    if check_pivot:
+        for g_vtx, h_vtx in graph_pivot.items():
+            if not compare(g_vtx, h_vtx):
+                return
+    matcher = make_matcher(pattern, compare)
     for m in matcher.match(graph_pivot):
         # Convert mapping
-        name_mapping = {}
-        for guest_vtx, host_vtx in m.mapping_vtxs.items():
-            if isinstance(guest_vtx, NamedNode) and isinstance(host_vtx, NamedNode):
-                name_mapping[guest_vtx.name] = host_vtx.name
+        name_mapping = to_name_mapping(m.mapping_vtxs)
 
-        if not check_conditions(name_mapping):
+        if not check_conditions(pattern, compare, name_mapping):
             continue # not a match after all...
 
+        if len(nacs) > 0:
+            if nac_matchers == None:
+                nac_matchers = make_nac_matchers()
+            if nac_matched(m.mapping_vtxs):
+                continue
+
         yield name_mapping
@@ -8,9 +8,9 @@ from uuid import UUID
 from api.od import ODAPI, bind_api
 from services.bottom.V0 import Bottom
 from transformation import ramify
+from transformation.matcher import CompiledPattern
 from services import od
 from services.primitives.string_type import String
-from services.primitives.actioncode_type import ActionCode
 from services.primitives.integer_type import Integer
 from util.eval import exec_then_eval, simply_exec
 
@@ -22,15 +22,35 @@ class TryAgainNextRound(Exception):
 
 # Rewrite is performed in-place (modifying `host_m`)
 def rewrite(state,
-    rhs_m: UUID, # RHS-pattern
+    rhs_m: UUID, # RHS-pattern (UUID or CompiledPattern)
     pattern_mm: UUID, # meta-model of both patterns (typically the RAMified host_mm)
     lhs_match: dict, # a match, morphism, from lhs_m to host_m (mapping pattern name -> host name), typically found by the 'match_od'-function.
     host_m: UUID, # host model
     host_mm: UUID, # host meta-model
     eval_context={}, # optional: additional variables/functions to be available while executing condition-code. These will be seen as global variables.
+    change_listeners=[], # optional: functions that are called with (name, element) for every element of host_m that is created, updated or deleted, see ODAPI.change_listeners
+    host_odapi=None, # optional: ODAPI of host_m, to reuse across rewrites of the same model (it is kept up to date)
 ):
+    if host_odapi == None:
+        host_odapi = ODAPI(state, host_m, host_mm)
+    host_odapi.change_listeners.extend(change_listeners)
+    try:
+        return _rewrite(state, rhs_m, pattern_mm, lhs_match, host_m, host_mm, eval_context, host_odapi)
+    finally:
+        # (also if eval'ed code raises: the caller may keep using host_odapi)
+        for listener in change_listeners:
+            host_odapi.change_listeners.remove(listener)
+
+def _rewrite(state, rhs_m, pattern_mm, lhs_match, host_m, host_mm, eval_context, host_odapi):
     bottom = Bottom(state)
 
+    if isinstance(rhs_m, CompiledPattern):
+        rhs_odapi = rhs_m.odapi
+        rhs_mm_odapi = rhs_m.mm_odapi
+        rhs_m = rhs_m.m
+    else:
+        rhs_odapi = None
+
     # Need to come up with a new, unique name when creating new element in host-model:
     def first_available_name(suggested_name: str):
         if len(bottom.read_outgoing_elements(host_m, suggested_name)) == 0:
@@ -56,14 +76,10 @@ def rewrite(state,
     actioncode_type = od.get_scd_mm_actioncode_node(bottom)
     modelref_type = od.get_scd_mm_modelref_node(bottom)
 
-    # To be replaced by ODAPI (below)
-    host_od = od.OD(host_mm, host_m, bottom.state)
-    rhs_od = od.OD(pattern_mm, rhs_m, bottom.state)
-
-    host_odapi = ODAPI(state, host_m, host_mm)
     host_mm_odapi = ODAPI(state, host_mm, scd_metamodel)
-    rhs_odapi = ODAPI(state, rhs_m, pattern_mm)
-    rhs_mm_odapi = ODAPI(state, pattern_mm, scd_metamodel)
+    if rhs_odapi == None:
+        rhs_odapi = ODAPI(state, rhs_m, pattern_mm)
+        rhs_mm_odapi = ODAPI(state, pattern_mm, scd_metamodel)
 
     lhs_keys = lhs_match.keys()
     rhs_keys = set(k for k in bottom.read_keys(rhs_m)
@@ -148,22 +164,19 @@ def rewrite(state,
             try:
                 if od.is_typed_by(bottom, rhs_type, class_type):
                     obj_name = first_available_name(suggested_name)
-                    host_od._create_object(obj_name, host_type)
-                    host_odapi._ODAPI__recompute_mappings()
+                    host_odapi.create_object(obj_name, host_type_name)
                     rhs_match[rhs_name] = obj_name
                 elif od.is_typed_by(bottom, rhs_type, assoc_type):
                     _, _, host_src, host_tgt = get_src_tgt()
                     link_name = first_available_name(suggested_name)
-                    host_od._create_link(link_name, host_type, host_src, host_tgt)
-                    host_odapi._ODAPI__recompute_mappings()
+                    host_odapi.create_link(link_name, host_type_name, host_src, host_tgt)
                     rhs_match[rhs_name] = link_name
                 elif od.is_typed_by(bottom, rhs_type, attr_link_type):
                     host_src_name, _, host_src, host_tgt = get_src_tgt()
                     host_attr_link = ramify.get_original_type(bottom, rhs_type)
                     host_attr_name = host_mm_odapi.get_slot_value(host_attr_link, "name")
                     link_name = f"{host_src_name}_{host_attr_name}" # must follow naming convention here
-                    host_od._create_link(link_name, host_type, host_src, host_tgt)
-                    host_odapi._ODAPI__recompute_mappings()
+                    host_odapi.create_link(link_name, host_type_name, host_src, host_tgt)
                     rhs_match[rhs_name] = link_name
                 elif rhs_type == rhs_mm_odapi.get("ActionCode"):
                     # If we encounter ActionCode in our RHS, we assume that the code computes the value of an attribute...
@@ -187,7 +200,7 @@ def rewrite(state,
                     host_attr_link = ramify.get_original_type(bottom, rhs_attr_link)
                     host_attr_name = host_mm_odapi.get_slot_value(host_attr_link, "name")
                     val_name = f"{host_src_name}.{host_attr_name}"
-                    python_expr = ActionCode(UUID(bottom.read_value(rhs_obj)), bottom.state).read()
+                    python_expr = od.read_modelref_value(bottom, rhs_obj, "code")
                     result = exec_then_eval(python_expr, _globals=eval_globals)
                     host_odapi.create_primitive_value(val_name, result, is_code=False)
                     rhs_match[rhs_name] = val_name
@@ -218,7 +231,7 @@ def rewrite(state,
             pass
         elif od.is_typed_by(bottom, host_type, modelref_type):
             rhs_obj = rhs_odapi.get(common_name)
-            python_expr = ActionCode(UUID(bottom.read_value(rhs_obj)), bottom.state).read()
+            python_expr = od.read_modelref_value(bottom, rhs_obj, "code")
             result = exec_then_eval(python_expr,
                 _globals=eval_globals,
                 _locals={'this': host_obj}) # 'this' can be used to read the previous value of the slot
@@ -244,7 +257,7 @@ def rewrite(state,
             # However I *think* it is also OK to simply ignore this case.
             pass
         elif len(els_to_delete) == 1:
-            bottom.delete_element(els_to_delete[0])
+            host_odapi.delete(els_to_delete[0])
         else:
             raise Exception("This should never happen!")
 
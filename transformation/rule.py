@@ -4,10 +4,13 @@ import pprint
 from typing import Generator, Callable
 from uuid import UUID
 import functools
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 from api.od import ODAPI
 from concrete_syntax.common import indent
-from transformation.matcher import match_od
+from transformation.matcher import match_od, HostGraphCache, CompiledPattern, READS_ANYTHING
 from transformation.rewriter import rewrite
 from transformation.cloner import clone_od
 from util.timer import Timer
@@ -18,11 +21,24 @@ class Rule:
         self.lhs = lhs
         self.rhs = rhs
 
+    # Processes the patterns once, instead of every time the rule is matched or executed
+    def compile(self, state, mm_ramified: UUID):
+        return CompiledRule(
+            nacs=[CompiledPattern(state, nac, mm_ramified) for nac in self.nacs],
+            lhs=CompiledPattern(state, self.lhs, mm_ramified),
+            rhs=CompiledPattern(state, self.rhs, mm_ramified))
 
-PP = pprint.PrettyPrinter(depth=4)
+# Same as Rule, but the patterns are CompiledPatterns instead of UUIDs
+# Can be used wherever a Rule is expected
+class CompiledRule(Rule):
+    def __init__(self, nacs: list[CompiledPattern], lhs: CompiledPattern, rhs: CompiledPattern):
+        super().__init__(nacs, lhs, rhs)
+
+    def compile(self, state, mm_ramified: UUID):
+        return self
 
-class _NAC_MATCHED(Exception):
-    pass
+
+PP = pprint.PrettyPrinter(depth=4)
 
 # Helper for executing NAC/LHS/RHS-type rules
 class RuleMatcherRewriter:
@@ -31,17 +47,14 @@ class RuleMatcherRewriter:
         self.mm = mm
         self.mm_ramified = mm_ramified
         self.eval_context = eval_context
+        # shared by all match_od calls (LHS, NACs, other rules), as long as the model does not change
+        self.host_graph_cache = HostGraphCache()
 
     # Generates matches.
     # Every match is a dictionary with entries LHS_element_name -> model_element_name
     def match_rule(self, m: UUID, lhs: UUID, nacs: list[UUID], rule_name: str) -> Generator[dict, None, None]:
-        lhs_matcher = match_od(self.state,
-            host_m=m,
-            host_mm=self.mm,
-            pattern_m=lhs,
-            pattern_mm=self.mm_ramified,
-            eval_context=self.eval_context,
-        )
+        # NACs are checked by the matcher, as extensions of every LHS-match
+        lhs_matcher = self.match_pattern(m, lhs, nacs=nacs)
 
         try:
             # First we iterate over LHS-matches:
@@ -56,41 +69,6 @@ class RuleMatcherRewriter:
                     # Uncomment to see matches attempted - may give insight into why your rule is not matching
                     # print("  lhs_match:", lhs_match)
 
-                    nac_matched = False
-
-                    with Timer(f"MATCH NACs {rule_name}"):
-                        try:
-                            for i_nac, nac in enumerate(nacs):
-                                # For every LHS-match, we see if there is a NAC-match:
-                                nac_matcher = match_od(self.state,
-                                    host_m=m,
-                                    host_mm=self.mm,
-                                    pattern_m=nac,
-                                    pattern_mm=self.mm_ramified,
-                                    pivot=lhs_match, # try to "grow" LHS-match with NAC-match
-                                    eval_context=self.eval_context,
-                                )
-
-                                try:
-                                    # for nac_match in nac_matcher:
-                                    while True:
-                                        try:
-                                            with Timer(f"MATCH NAC{i_nac} {rule_name}"):
-                                                nac_match = nac_matcher.__next__()
-                                            # The NAC has at least one match
-                                            # (there could be more, but we know enough, so let's not waste CPU/MEM resources and proceed to next LHS match)
-                                            raise _NAC_MATCHED()
-                                        except StopIteration:
-                                            break # no more nac-matches
-
-                                except Exception as e:
-                                    # The exception may originate from eval'ed condition-code in LHS or NAC
-                                    # Decorate exception with some context, to help with debugging
-                                    e.add_note(f"while matching NAC of '{rule_name}'")
-                                    raise
-                        except _NAC_MATCHED:
-                            continue # continue with next LHS-match
-
                     # There were no NAC matches -> yield LHS-match!
                     yield lhs_match
                 except StopIteration:
@@ -103,7 +81,65 @@ class RuleMatcherRewriter:
             e.add_note(f"while matching LHS of '{rule_name}'")
             raise
 
-    def exec_rule(self, m: UUID, lhs: UUID, rhs: UUID, lhs_match: dict, rule_name: str, in_place=False):
+    # Cheap test, to be done before matching: can the LHS possibly match in the model?
+    # It cannot if the model has fewer instances of some type than the LHS, e.g., if there are no instances at all.
+    def could_match(self, od: ODAPI, lhs: CompiledPattern) -> bool:
+        if not isinstance(lhs, CompiledPattern):
+            return True
+        for type_name, count in lhs.get_type_counts(od.cdapi).items():
+            if od.count_instances(type_name) < count:
+                return False
+        return True
+
+    # Generates matches of a pattern (e.g., LHS). For the optional arguments, see match_od.
+    def match_pattern(self, m: UUID, pattern: UUID, pivot={}, check_pivot=False, nacs=[], reads=None):
+        return match_od(self.state,
+            host_m=m,
+            host_mm=self.mm,
+            pattern_m=pattern,
+            pattern_mm=self.mm_ramified,
+            pivot=pivot,
+            eval_context=self.eval_context,
+            host_cache=self.host_graph_cache,
+            check_pivot=check_pivot,
+            nacs=nacs,
+            reads=reads,
+        )
+
+    # Returns a NAC-match that extends the LHS-match, or None if none of the NACs match.
+    # reads, visited: see match_od
+    def match_nacs(self, m: UUID, lhs_match: dict, nacs: list[UUID], rule_name: str, reads=None, visited=None):
+        with Timer(f"MATCH NACs {rule_name}"):
+            for i_nac, nac in enumerate(nacs):
+                # For every LHS-match, we see if there is a NAC-match:
+                nac_matcher = match_od(self.state,
+                    host_m=m,
+                    host_mm=self.mm,
+                    pattern_m=nac,
+                    pattern_mm=self.mm_ramified,
+                    pivot=lhs_match, # try to "grow" LHS-match with NAC-match
+                    eval_context=self.eval_context,
+                    host_cache=self.host_graph_cache,
+                    reads=reads,
+                    visited=visited,
+                )
+
+                try:
+                    with Timer(f"MATCH NAC{i_nac} {rule_name}"):
+                        nac_match = next(nac_matcher, None)
+                    if nac_match != None:
+                        # The NAC has at least one match
+                        # (there could be more, but we know enough, so let's not waste CPU/MEM resources and proceed to next LHS match)
+                        return nac_match
+                except Exception as e:
+                    # The exception may originate from eval'ed condition-code in LHS or NAC
+                    # Decorate exception with some context, to help with debugging
+                    e.add_note(f"while matching NAC of '{rule_name}'")
+                    raise
+        return None
+
+    # change_listeners: see 'rewrite'
+    def exec_rule(self, m: UUID, lhs: UUID, rhs: UUID, lhs_match: dict, rule_name: str, in_place=False, change_listeners=[]):
         if in_place:
             # dangerous
             cloned_m = m
@@ -123,6 +159,7 @@ class RuleMatcherRewriter:
                 host_m=cloned_m,
                 host_mm=self.mm,
                 eval_context=self.eval_context,
+                change_listeners=change_listeners,
             )
         except Exception as e:
             # Make exceptions raised in eval'ed code easier to trace:
@@ -131,22 +168,269 @@ class RuleMatcherRewriter:
 
         return (cloned_m, rhs_match)
 
+    # Executes the rule for all the given matches at once, on a single clone of the model ("ForAll").
+    # The matches are applied one after another, to the same model. A match is skipped if an earlier one has changed anything it depends on
+    # (its elements, or what its condition-code and NACs looked at), because then it may no longer be a match.
+    # The matches that remain do not overlap in deleted or modified elements, and the result is the same as executing the rule for each of them in turn,
+    # but the model is only cloned (and indexed) once, and nothing is matched again.
+    # Returns the new model, and (LHS-match, RHS-match) for every match that was applied.
+    def exec_rule_forall(self, m: UUID, rule: CompiledRule, lhs_matches: list[dict], rule_name: str, in_place=False):
+        # what every match depends on, in the model as it is now
+        footprints = [self._get_footprint(m, rule, lhs_match, rule_name) for lhs_match in lhs_matches]
+
+        if in_place:
+            cloned_m = m
+        else:
+            cloned_m = clone_od(self.state, m, self.mm)
+        host_odapi = ODAPI(self.state, cloned_m, self.mm)
+
+        changed = set()
+        def on_change(name, element):
+            changed.add(name)
+            type_name = host_odapi.mm_obj_to_name.get(host_odapi.get_type(element))
+            if type_name != None:
+                changed.update(host_odapi.cdapi.transitive_super_types.get(type_name, [type_name]))
+            src, tgt = self.state.read_edge(element)
+            if src != None:
+                changed.add(host_odapi.m_obj_to_name.get(src))
+                changed.add(host_odapi.m_obj_to_name.get(tgt))
+        host_odapi.change_listeners.append(on_change)
+
+        applied = []
+        for lhs_match, footprint in zip(lhs_matches, footprints):
+            if not footprint.isdisjoint(changed):
+                continue # conflicts with an earlier match
+            try:
+                rhs_match = rewrite(self.state,
+                    rhs_m=rule.rhs,
+                    pattern_mm=self.mm_ramified,
+                    lhs_match=lhs_match,
+                    host_m=cloned_m,
+                    host_mm=self.mm,
+                    eval_context=self.eval_context,
+                    host_odapi=host_odapi,
+                )
+            except Exception as e:
+                # Make exceptions raised in eval'ed code easier to trace:
+                e.add_note(f"while executing RHS of '{rule_name}'")
+                raise
+            applied.append((lhs_match, rhs_match))
+
+        return (cloned_m, applied)
+
+    # The names of everything a match depends on: if none of them change, it remains a match
+    def _get_footprint(self, m: UUID, rule: CompiledRule, lhs_match: dict, rule_name: str) -> set:
+        footprint = set(lhs_match.values())
+        # what the condition-code of the LHS reads (for this match only)
+        for _ in self.match_pattern(m, rule.lhs, pivot=lhs_match, reads=footprint):
+            break
+        # a new NAC-match would have to be connected to one of the elements that the NACs were matched against
+        self.match_nacs(m, lhs_match, rule.nacs, rule_name, reads=footprint, visited=footprint)
+        # ... unless it is not connected to the LHS at all, then any new element of the right type could do
+        cdapi = self.host_graph_cache.get(self.state, m, self.mm).cdapi
+        for nac in rule.nacs:
+            for component in nac.components[1]:
+                if not any(getattr(vtx, 'name', None) in lhs_match for vtx in component):
+                    footprint.update(cdapi.type_model_names[nac.original_types[vtx]] for vtx in component if vtx in nac.original_types)
+        return footprint
+
     # This is often what you want: find a match, and execute the rule
     def exec_on_first_match(self, host: UUID, rule: Rule, rule_name: str, in_place=False):
         for lhs_match in self.match_rule(host, rule.lhs, rule.nacs, rule_name):
             (rewritten_host, rhs_match) = self.exec_rule(host, rule.lhs, rule.rhs, lhs_match, rule_name, in_place)
             return rewritten_host, lhs_match, rhs_match
 
+# Keeps the matches of rules alive across simulation steps, instead of searching the whole model for every rule at every step.
+# Every step, a rule is executed on a clone of the model. Clones have new UUIDs, but the same names, so matches (which are in terms of names) remain valid.
+# After executing a rule (through 'exec_rule'), the matches in the new model are derived from those in the previous model:
+#  - LHS-matches that contain an element that was created, updated or deleted are dropped,
+#  - new LHS-matches are searched, pivoted at every element that was created or updated (every new LHS-match must contain one),
+#  - the NACs are only checked again for LHS-matches that may be affected: if the NAC-match that blocked it is gone, or if a new NAC-match (pivoted at a changed element) agrees with it,
+#  - if condition-code has read something that changed, the outcome may have changed, so we check again (for the LHS: the rule is matched from scratch).
+#
+# This assumes that models are only modified by executing rules through 'exec_rule', that rules are compiled (see Rule.compile),
+# Everything condition-code reads through the API is recorded. Condition-code that calls a function from eval_context may read anything,
+# so its outcome is recomputed after every step.
+# Matches are not necessarily produced in the same order as 'match_rule' would.
+class IncrementalMatcher:
+    def __init__(self, matcher_rewriter: RuleMatcherRewriter, max_size=8):
+        self.matcher_rewriter = matcher_rewriter
+        self.max_size = max_size
+        # (state, model) -> rule -> (LHS-matches, names read by LHS condition-code, (blocked, names the NAC-check depends on) for every LHS-match)
+        # least recently used first
+        self.entries = {}
+        # (state, model) -> (ODAPI of the model it was derived from, names of the elements that were created/updated/deleted)
+        self.derived = {}
+        # number of rules that were matched incrementally/from scratch
+        self.hits = 0
+        self.misses = 0
+
+    def _put(self, d: dict, key, value):
+        d.pop(key, None)
+        d[key] = value
+        if len(d) > self.max_size:
+            del d[next(iter(d))]
+
+    # Returns the matches (LHS-matches that are not blocked by a NAC) of the rule in the model
+    def match_rule(self, od: ODAPI, rule: CompiledRule, rule_name: str) -> list[dict]:
+        key = (od.state, od.m)
+        rules = self.entries.get(key, {})
+        self._put(self.entries, key, rules)
+        if rule not in rules:
+            try:
+                result = self._update(od, rule, rule_name)
+                if result != None:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                    reads = set()
+                    lhs_matches = list(self.matcher_rewriter.match_pattern(od.m, rule.lhs, reads=reads))
+                    result = (lhs_matches, reads, [self._check_nacs(od, rule, rule_name, lhs_match) for lhs_match in lhs_matches])
+            except Exception as e:
+                e.add_note(f"while matching LHS of '{rule_name}'")
+                raise
+            rules[rule] = result
+        lhs_matches, _, nac_results = rules[rule]
+        return [lhs_match for lhs_match, (blocked, _) in zip(lhs_matches, nac_results) if not blocked]
+
+    def _check_nacs(self, od: ODAPI, rule: CompiledRule, rule_name: str, lhs_match: dict):
+        reads = set()
+        nac_match = self.matcher_rewriter.match_nacs(od.m, lhs_match, rule.nacs, rule_name, reads=reads)
+        if nac_match == None:
+            return (False, reads)
+        # blocked for as long as the NAC-match exists
+        reads.update(nac_match.values())
+        return (True, reads)
+
+    # Derive the matches from those of the model that od.m was derived from, or return None if we cannot
+    def _update(self, od: ODAPI, rule: CompiledRule, rule_name: str):
+        try:
+            prev_od, changed = self.derived[(od.state, od.m)]
+            lhs_matches, reads, nac_results = self.entries[(prev_od.state, prev_od.m)][rule]
+        except KeyError:
+            return None
+
+        # Everything the outcome of condition-code may depend on:
+        # the changed elements, their types (e.g., get_all_instances) and their sources and targets (e.g., get_slot_value, get_outgoing)
+        affected = set(changed)
+        for api in (prev_od, od):
+            for name in changed:
+                element = api.m_name_to_obj.get(name)
+                if element == None:
+                    continue
+                type_name = api.m_obj_to_type.get(element)
+                if type_name != None:
+                    affected.update(api.cdapi.transitive_super_types.get(type_name, [type_name]))
+                src, tgt = od.state.read_edge(element)
+                if src != None:
+                    affected.add(api.m_obj_to_name.get(src))
+                    affected.add(api.m_obj_to_name.get(tgt))
+        if READS_ANYTHING in reads or not reads.isdisjoint(affected):
+            return None
+
+        host_graph = self.matcher_rewriter.host_graph_cache.get(od.state, od.m, od.mm)
+        pivots = []
+        for name in changed:
+            element = od.m_name_to_obj.get(name)
+            if element == None:
+                continue # deleted
+            if name in host_graph.names:
+                pivots.append(name)
+            elif not any(od.m_obj_to_name.get(link) in changed for link in od.state.read_incoming(element)):
+                # a value that can only be matched through a slot-link, but the slot-link did not change
+                return None
+
+        # Matches of a pattern that contain at least one of the changed elements
+        def match_changed(pattern, reads=None):
+            for pattern_name, g_vtx in pattern.names.items():
+                for host_name in pivots:
+                    if self._may_match(host_graph, pattern, g_vtx, host_graph.names[host_name]):
+                        yield from self.matcher_rewriter.match_pattern(od.m, pattern,
+                            pivot={pattern_name: host_name}, check_pivot=True, reads=reads)
+
+        new_nac_matches = [nac_match for nac in rule.nacs for nac_match in match_changed(nac)]
+        def may_be_blocked(lhs_match):
+            return any(all(lhs_match.get(name, host_name) == host_name for name, host_name in nac_match.items())
+                for nac_match in new_nac_matches)
+
+        result = ([], set(reads), [])
+        for lhs_match, (blocked, nac_reads) in zip(lhs_matches, nac_results):
+            if not changed.isdisjoint(lhs_match.values()):
+                continue
+            if READS_ANYTHING in nac_reads or not nac_reads.isdisjoint(affected) or (not blocked and may_be_blocked(lhs_match)):
+                nac_result = self._check_nacs(od, rule, rule_name, lhs_match)
+            else:
+                nac_result = (blocked, nac_reads)
+            result[0].append(lhs_match)
+            result[2].append(nac_result)
+
+        found = {}
+        for lhs_match in match_changed(rule.lhs, reads=result[1]):
+            found.setdefault(frozenset(lhs_match.items()), lhs_match)
+        for lhs_match in found.values():
+            result[0].append(lhs_match)
+            result[2].append(self._check_nacs(od, rule, rule_name, lhs_match))
+        return result
+
+    # Cheap check (only looking at the types) to avoid calling match_od with a pivot that cannot match
+    def _may_match(self, host_graph, pattern, g_vtx, h_vtx):
+        if not hasattr(g_vtx, 'typ'):
+            return True
+        cdapi = host_graph.cdapi
+        try:
+            return cdapi.is_subtype(
+                super_type_name=cdapi.type_model_names[pattern.original_types[g_vtx]],
+                sub_type_name=cdapi.type_model_names[h_vtx.typ])
+        except (AttributeError, KeyError):
+            return False
+
+    # Same as RuleMatcherRewriter.exec_rule, but remembers what changed, so the matches in the new model can be derived from those in od.m
+    def exec_rule(self, od: ODAPI, rule: CompiledRule, lhs_match: dict, rule_name: str):
+        changed = set()
+        new_m, rhs_match = self.matcher_rewriter.exec_rule(od.m, rule.lhs, rule.rhs, lhs_match, rule_name,
+            change_listeners=[lambda name, element: changed.add(name)])
+        self._put(self.derived, (od.state, new_m), (od, changed))
+        return new_m, rhs_match
+
 # Generator that yields actions in the format expected by 'Simulator' class
 class ActionGenerator:
-    def __init__(self, matcher_rewriter: RuleMatcherRewriter, rule_dict: dict[str, Rule]):
+    # incremental: reuse matches across simulation steps (see IncrementalMatcher), may be an IncrementalMatcher to share with other generators
+    # parallel: match the rules concurrently, in a pool of (at most max_workers) processes (see MatchPool), may be a MatchPool to share with other generators.
+    #   Actions are still yielded in the same order. Only pays off if matching the rules takes considerably longer than forking the processes
+    #   (large models, many rules). If processes cannot be forked on this platform, the rules are matched in this process instead.
+    #   Call 'shutdown' when done, to stop the processes.
+    def __init__(self, matcher_rewriter: RuleMatcherRewriter, rule_dict: dict[str, Rule], incremental=False, parallel=False, max_workers=None):
+        if incremental and parallel:
+            raise Exception("Incremental matching cannot be combined with parallel matching")
         self.matcher_rewriter = matcher_rewriter
         self.rule_dict = rule_dict
+        if incremental == True:
+            incremental = IncrementalMatcher(matcher_rewriter)
+        self.incremental = incremental or None
+        if self.incremental != None:
+            self.rule_dict = { rule_name: rule.compile(matcher_rewriter.state, matcher_rewriter.mm_ramified)
+                for rule_name, rule in rule_dict.items() }
+        if parallel == True:
+            parallel = MatchPool(matcher_rewriter, max_workers)
+        self.pool = parallel or None
+        if self.pool != None:
+            self.pool.add_rules(self.rule_dict)
 
     def __call__(self, od: ODAPI):
         at_least_one_match = False
-        for rule_name, rule in self.rule_dict.items():
-            match_iterator = self.matcher_rewriter.match_rule(od.m, rule.lhs, rule.nacs, rule_name)
+        rules = [(rule_name, rule) for rule_name, rule in self.rule_dict.items()
+            if self.matcher_rewriter.could_match(od, rule.lhs)]
+        if self.pool != None and self.pool.can_fork and len(rules) > 1:
+            all_matches = self.pool.match_rules(od, self.rule_dict, [rule_name for rule_name, _ in rules])
+        else:
+            all_matches = None
+        for i, (rule_name, rule) in enumerate(rules):
+            if all_matches != None:
+                match_iterator = iter(all_matches[i])
+            elif self.incremental != None:
+                match_iterator = iter(self.incremental.match_rule(od, rule, rule_name))
+            else:
+                match_iterator = self.matcher_rewriter.match_rule(od.m, rule.lhs, rule.nacs, rule_name)
             x = 0
             while True:
                 try:
@@ -157,7 +441,10 @@ class ActionGenerator:
                     # We got a match!
                     def do_action(od, rule, lhs_match, rule_name):
                         with Timer(f"EXEC RHS {rule_name}"):
-                            new_m, rhs_match = self.matcher_rewriter.exec_rule(od.m, rule.lhs, rule.rhs, lhs_match, rule_name)
+                            if self.incremental != None:
+                                new_m, rhs_match = self.incremental.exec_rule(od, rule, lhs_match, rule_name)
+                            else:
+                                new_m, rhs_match = self.matcher_rewriter.exec_rule(od.m, rule.lhs, rule.rhs, lhs_match, rule_name)
                         msgs = [f"executed rule '{rule_name}'\n" + indent(PP.pformat(rhs_match), 6)]
                         return (ODAPI(od.state, new_m, od.mm), msgs)
                     yield (
@@ -169,10 +456,18 @@ class ActionGenerator:
                     break
         return at_least_one_match
 
+    def shutdown(self):
+        if self.pool != None:
+            self.pool.shutdown()
+
 # Given a list of actions (in high -> low priority), will always yield the highest priority enabled actions.
 class PriorityActionGenerator:
-    def __init__(self, matcher_rewriter: RuleMatcherRewriter, rule_dicts: list[dict[str, Rule]]):
-        self.generators = [ActionGenerator(matcher_rewriter, rule_dict) for rule_dict in rule_dicts]
+    def __init__(self, matcher_rewriter: RuleMatcherRewriter, rule_dicts: list[dict[str, Rule]], incremental=False, parallel=False, max_workers=None):
+        if incremental == True:
+            incremental = IncrementalMatcher(matcher_rewriter)
+        if parallel == True:
+            parallel = MatchPool(matcher_rewriter, max_workers)
+        self.generators = [ActionGenerator(matcher_rewriter, rule_dict, incremental, parallel) for rule_dict in rule_dicts]
 
     def __call__(self, od: ODAPI):
         for generator in self.generators:
@@ -181,21 +476,85 @@ class PriorityActionGenerator:
                 return True
         return False
 
-# class ForAllGenerator:
-#     def __init__(self, matcher_rewriter: RuleMatcherRewriter, rule_dict: dict[str, Rule]):
-#         self.matcher_rewriter = matcher_rewriter
-#         self.rule_dict = rule_dict
-
-#     def __call__(self, od: ODAPI):
-#         matches = []
-#         for rule_name, rule in self.rule_dict.items():
-#             for lhs_match in self.matcher_rewriter.match_rule(od.m, rule.lhs, rule.nacs, rule_name):
-#                 matches.append((rule_name, rule, lhs_match))
-#         def do_action(matches):
-#             pass
-#         if len(matches) > 0:
-#             yield (
-#                 [rule_name for rule_name, _, _ in matches]
-#             )
-#             return True
-#         return False
\ No newline at end of file
+    def shutdown(self):
+        for generator in self.generators:
+            generator.shutdown()
+
+# Pool of processes that match rules in parallel, for (one or more) ActionGenerators.
+# The processes are forked from this process, so they get a copy-on-write snapshot of the state, and a copy of the matcher and the rules
+# (eval_context may contain lambdas, so they cannot be pickled).
+# The pool is created when it is first needed, and kept until 'shutdown' is called. Because a process only sees the state as it was when
+# it was forked, the pool is only reused as long as the state is unchanged, and forked again otherwise (e.g., after executing an action).
+class MatchPool:
+    def __init__(self, matcher_rewriter: RuleMatcherRewriter, max_workers=None):
+        self.matcher_rewriter = matcher_rewriter
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.can_fork = "fork" in multiprocessing.get_all_start_methods()
+        # the rules of every generator using this pool, by id of their rule_dict
+        self.rule_dicts = {}
+        self.executor = None
+        self.version = None # version of the state when the processes were forked
+
+    def add_rules(self, rule_dict: dict[str, Rule]):
+        # a process only knows the rules that were added before it was forked
+        self.shutdown()
+        self.rule_dicts[id(rule_dict)] = rule_dict
+
+    # Returns the matches of every rule, in the same order as 'rule_names'
+    def match_rules(self, od: ODAPI, rule_dict: dict[str, Rule], rule_names: list[str]):
+        version = od.state.read_version()
+        if self.executor == None or self.version != version:
+            self.shutdown()
+            # build the host graph before forking, so every process gets a copy
+            self.matcher_rewriter.host_graph_cache.get(od.state, od.m, self.matcher_rewriter.mm)
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("fork"),
+                initializer=_init_match_worker, initargs=(self.matcher_rewriter, self.rule_dicts))
+            self.version = version
+        return list(self.executor.map(_match_rule, [(od.m, id(rule_dict), rule_name) for rule_name in rule_names]))
+
+    def shutdown(self):
+        if self.executor != None:
+            self.executor.shutdown()
+            self.executor = None
+
+# Every process of a MatchPool matches rules in its own (read-only) copy of the state
+_worker_matcher = None
+
+def _init_match_worker(matcher_rewriter, rule_dicts):
+    global _worker_matcher
+    _worker_matcher = (matcher_rewriter, rule_dicts)
+
+def _match_rule(task):
+    m, rule_dict_id, rule_name = task
+    matcher_rewriter, rule_dicts = _worker_matcher
+    rule = rule_dicts[rule_dict_id][rule_name]
+    return list(matcher_rewriter.match_rule(m, rule.lhs, rule.nacs, rule_name))
+
+# Like ActionGenerator, but yields one action per rule, that executes the rule for all its (non-conflicting) matches at once (see RuleMatcherRewriter.exec_rule_forall)
+class ForAllGenerator:
+    def __init__(self, matcher_rewriter: RuleMatcherRewriter, rule_dict: dict[str, Rule]):
+        self.matcher_rewriter = matcher_rewriter
+        self.rule_dict = { rule_name: rule.compile(matcher_rewriter.state, matcher_rewriter.mm_ramified)
+            for rule_name, rule in rule_dict.items() }
+
+    def __call__(self, od: ODAPI):
+        at_least_one_match = False
+        for rule_name, rule in self.rule_dict.items():
+            if not self.matcher_rewriter.could_match(od, rule.lhs):
+                continue
+            with Timer(f"MATCH RULE {rule_name}"):
+                lhs_matches = list(self.matcher_rewriter.match_rule(od.m, rule.lhs, rule.nacs, rule_name))
+            if len(lhs_matches) == 0:
+                continue
+            def do_action(od, rule, lhs_matches, rule_name):
+                with Timer(f"EXEC RHS {rule_name}"):
+                    new_m, applied = self.matcher_rewriter.exec_rule_forall(od.m, rule, lhs_matches, rule_name)
+                msgs = [f"executed rule '{rule_name}' for {len(applied)} of {len(lhs_matches)} matches\n"
+                    + indent('\n'.join(PP.pformat(rhs_match) for _, rhs_match in applied), 6)]
+                return (ODAPI(od.state, new_m, od.mm), msgs)
+            yield (
+                f"{rule_name} (for all {len(lhs_matches)} matches)", # description of action
+                functools.partial(do_action, od, rule, lhs_matches, rule_name) # the action itself (as a callback)
+            )
+            at_least_one_match = True
+        return at_least_one_match
\ No newline at end of file
@@ -0,0 +1,131 @@
+from uuid import UUID
+
+from state.pystate import PyState
+from bootstrap.scd import bootstrap_scd
+from util import loader
+from api.od import ODAPI
+from services.od import OD
+from services.scd import SCD
+from services.primitives.integer_type import Integer
+from framework.conformance import Conformance
+from concrete_syntax.textual_od.renderer import render_od
+from transformation.cloner import clone_od, clone_od_textual
+
+mm_cs = """
+    Man:Class
+    Man_weight:AttributeLink (Man -> Integer) {
+        name = "weight";
+        optional = True;
+    }
+    Man_nickname:AttributeLink (Man -> String) {
+        name = "nickname";
+        optional = True;
+    }
+    Man_brave:AttributeLink (Man -> Boolean) {
+        name = "brave";
+        optional = True;
+    }
+    Man_action:AttributeLink (Man -> ActionCode) {
+        name = "action";
+        optional = True;
+    }
+    Man_photo:AttributeLink (Man -> Bytes) {
+        name = "photo";
+        optional = True;
+    }
+    Bear:Class
+    afraidOf:Association (Man -> Bear)
+    afraidOf_since:AttributeLink (afraidOf -> Integer) {
+        name = "since";
+        optional = True;
+    }
+"""
+
+m_cs = """
+    george:Man {
+        weight = 80;
+        nickname = "Curious George";
+        brave = False;
+        action = `print("hi")`;
+        photo = b"\\x00\\xff";
+    }
+    bill:Man
+    teddy:Bear
+    :afraidOf (george -> teddy) { since = 3; }
+"""
+
+# the model of a street, to which the address of a Man refers
+street_mm_cs = """
+    Street:Class
+    House:Class
+    House_number:AttributeLink (House -> Integer) {
+        name = "number";
+        optional = False;
+    }
+    in:Association (House -> Street)
+"""
+
+street_m_cs = """
+    main:Street
+    house:House { number = 1; }
+    :in (house -> main)
+"""
+
+# (the order of the slots of an object may differ)
+def render_sorted(state, m, mm):
+    return sorted(render_od(state, m, mm, hide_names=False).split("\n"))
+
+def test_clone_od_same_as_textual():
+    state = PyState()
+    scd = bootstrap_scd(state)
+    mm = loader.parse_and_check(state, mm_cs, scd, "mm")
+    m = loader.parse_and_check(state, m_cs, mm, "m")
+    # a primitive value stored by reference (as created by the SCD service, or in older models)
+    integer_model = state.create_node()
+    Integer(integer_model, state).create(75)
+    m_od = OD(mm, m, state)
+    m_od.create_model_ref("bill.weight", "Integer", integer_model)
+    m_od.create_slot("weight", "bill", "bill.weight")
+    assert Conformance(state, m, mm).check_nominal() == []
+
+    cloned_m = clone_od(state, m, mm)
+    expected = render_sorted(state, clone_od_textual(state, m, mm), mm)
+    assert render_sorted(state, cloned_m, mm) == expected
+    assert render_sorted(state, m, mm) == expected
+    assert Conformance(state, cloned_m, mm).check_nominal() == []
+
+    # the clone is independent of the original
+    cloned = ODAPI(state, cloned_m, mm)
+    cloned.set_slot_value(cloned.get("bill"), "weight", 90)
+    cloned.delete(cloned.get("teddy"))
+    assert render_sorted(state, m, mm) == expected
+
+def test_clone_od_deep_copies_model_refs():
+    state = PyState()
+    scd = bootstrap_scd(state)
+    street_mm = loader.parse_and_check(state, street_mm_cs, scd, "street mm")
+    mm = loader.parse_and_check(state, mm_cs, scd, "mm")
+    mm_scd = SCD(mm, state)
+    mm_scd.create_model_ref("Street", street_mm)
+    mm_scd.create_attribute_link("Man", "Street", "street", optional=True)
+    m = loader.parse_and_check(state, m_cs, mm, "m")
+    street_m = loader.parse_and_check(state, street_m_cs, street_mm, "street m")
+    m_od = OD(mm, m, state)
+    m_od.create_model_ref("george.street", "Street", street_m)
+    m_od.create_slot("street", "george", "george.street")
+    assert Conformance(state, m, mm).check_nominal() == []
+
+    cloned_m = clone_od(state, m, mm)
+    assert Conformance(state, cloned_m, mm).check_nominal() == []
+    cloned = ODAPI(state, cloned_m, mm)
+    cloned_street_m = UUID(state.read_value(cloned.get_slot(cloned.get("george"), "street")))
+    assert cloned_street_m != street_m
+    expected = render_sorted(state, street_m, street_mm)
+    assert render_sorted(state, cloned_street_m, street_mm) == expected
+
+    # the referred model of the clone is independent of the original
+    cloned_street = ODAPI(state, cloned_street_m, street_mm)
+    cloned_street.set_slot_value(cloned_street.get("house"), "number", 2)
+    cloned_street.delete(cloned_street.get("main"))
+    assert render_sorted(state, street_m, street_mm) == expected
+    assert Conformance(state, m, mm).check_nominal() == []
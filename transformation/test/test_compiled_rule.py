@@ -0,0 +1,55 @@
+from state.pystate import PyState
+from bootstrap.scd import bootstrap_scd
+from util import loader
+from concrete_syntax.textual_od.renderer import render_od
+from transformation import matcher
+from transformation.ramify import ramify
+from transformation.rule import Rule, RuleMatcherRewriter
+
+mm_cs = """
+    Man:Class
+    Man_weight:AttributeLink (Man -> Integer) {
+        name = "weight";
+        optional = False;
+    }
+    Bear:Class
+    afraidOf:Association (Man -> Bear)
+"""
+
+m_cs = """
+    george:Man { weight = 80; }
+    bill:Man { weight = 110; }
+    teddy:Bear
+    :afraidOf (george -> teddy)
+"""
+
+def test_compiled_rule(monkeypatch):
+    state = PyState()
+    scd = bootstrap_scd(state)
+    mm = loader.parse_and_check(state, mm_cs, scd, "mm")
+    m = loader.parse_and_check(state, m_cs, mm, "m")
+    mm_ramified = ramify(state, mm)
+    rule = Rule(
+        nacs=[loader.parse_and_check(state, "m:RAM_Man\nb:RAM_Bear\n:RAM_afraidOf (m -> b)", mm_ramified, "NAC")],
+        lhs=loader.parse_and_check(state, "m:RAM_Man { RAM_weight = `get_value(this) > 100`; }\nb:RAM_Bear", mm_ramified, "LHS"),
+        rhs=loader.parse_and_check(state, "m:RAM_Man { RAM_weight = `get_value(this) - 10`; }\nb:RAM_Bear\n:RAM_afraidOf (m -> b)", mm_ramified, "RHS"),
+    )
+    compiled = rule.compile(state, mm_ramified)
+    assert compiled.compile(state, mm_ramified) is compiled
+    matcher_rewriter = RuleMatcherRewriter(state, mm, mm_ramified)
+    expected = list(matcher_rewriter.match_rule(m, rule.lhs, rule.nacs, "rule"))
+    assert [(match["m"], match["b"]) for match in expected] == [("bill", "teddy")]
+
+    # compiled patterns are used as they are, never compiled again
+    compilations = []
+    init = matcher.CompiledPattern.__init__
+    monkeypatch.setattr(matcher.CompiledPattern, "__init__", lambda self, *args: (compilations.append(args), init(self, *args))[1])
+    for _ in range(2):
+        assert list(matcher_rewriter.match_rule(m, compiled.lhs, compiled.nacs, "rule")) == expected
+    assert compilations == []
+
+    # rewriting with the compiled RHS gives the same result
+    from_compiled, _ = matcher_rewriter.exec_rule(m, compiled.lhs, compiled.rhs, expected[0], "rule")
+    assert compilations == []
+    from_uncompiled, _ = matcher_rewriter.exec_rule(m, rule.lhs, rule.rhs, expected[0], "rule")
+    assert render_od(state, from_compiled, mm, hide_names=False) == render_od(state, from_uncompiled, mm, hide_names=False)
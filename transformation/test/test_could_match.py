@@ -0,0 +1,114 @@
+import pytest
+
+from state.pystate import PyState
+from bootstrap.scd import bootstrap_scd
+from util import loader
+from api.od import ODAPI
+from transformation.ramify import ramify
+from transformation.matcher import CompiledPattern, HostGraph
+from transformation.rule import RuleMatcherRewriter
+
+mm_cs = """
+    Animal:Class { abstract = True; }
+    Man:Class
+    Bear:Class
+    :Inheritance (Man -> Animal)
+    :Inheritance (Bear -> Animal)
+    afraidOf:Association (Man -> Bear)
+"""
+
+m_cs = """
+    george:Man
+    teddy:Bear
+    winnie:Bear
+    :afraidOf (george -> teddy)
+"""
+
+lhs_cs = {
+    # fewer instances than needed
+    "two men": """
+        m1:RAM_Man
+        m2:RAM_Man
+    """,
+    "two men, afraid": """
+        m1:RAM_Man
+        m2:RAM_Man
+        b:RAM_Bear
+        :RAM_afraidOf (m1 -> b)
+    """,
+    "two links": """
+        m:RAM_Man
+        b1:RAM_Bear
+        b2:RAM_Bear
+        :RAM_afraidOf (m -> b1)
+        :RAM_afraidOf (m -> b2)
+    """,
+    # enough instances
+    "two bears": """
+        b1:RAM_Bear
+        b2:RAM_Bear
+    """,
+    # only instances of subtypes
+    "three animals": """
+        a1:RAM_Animal
+        a2:RAM_Animal
+        a3:RAM_Animal
+    """,
+    # enough instances, but no match
+    "afraid of winnie": """
+        m:RAM_Man
+        b:RAM_Bear { condition = `get_name(this) == "winnie"`; }
+        :RAM_afraidOf (m -> b)
+    """,
+}
+
+@pytest.fixture
+def model():
+    state = PyState()
+    scd = bootstrap_scd(state)
+    mm = loader.parse_and_check(state, mm_cs, scd, "mm")
+    m = loader.parse_and_check(state, m_cs, mm, "m")
+    mm_ramified = ramify(state, mm)
+    lhss = { name: CompiledPattern(state, loader.parse_and_check(state, cs, mm_ramified, name), mm_ramified)
+        for name, cs in lhs_cs.items() }
+    return state, m, mm, RuleMatcherRewriter(state, mm, mm_ramified), lhss
+
+def test_could_match(model):
+    state, m, mm, matcher_rewriter, lhss = model
+    od = ODAPI(state, m, mm)
+    could_match = { name: matcher_rewriter.could_match(od, lhs) for name, lhs in lhss.items() }
+    matches = { name: list(matcher_rewriter.match_pattern(m, lhs)) for name, lhs in lhss.items() }
+    assert could_match == {
+        "two men": False,
+        "two men, afraid": False,
+        "two links": False,
+        "two bears": True,
+        "three animals": True,
+        "afraid of winnie": True,
+    }
+    # never skips a pattern that matches
+    for name, lhs in lhss.items():
+        assert could_match[name] or matches[name] == [], name
+    assert len(matches["three animals"]) == 6
+    assert matches["afraid of winnie"] == []
+
+    # after adding instances, they can match
+    od.create_object("bill", "Man")
+    od.create_link(None, "afraidOf", od.get("bill"), od.get("teddy"))
+    for name in ("two men", "two men, afraid"):
+        assert matcher_rewriter.could_match(od, lhss[name])
+        assert len(list(matcher_rewriter.match_pattern(m, lhss[name]))) > 0
+
+def test_candidates(model):
+    state, m, mm, matcher_rewriter, lhss = model
+    host_graph = HostGraph(state, m, mm)
+    names = lambda vtxs: [vtx.name for vtx in vtxs]
+    # instances of the type and its subtypes, in the order of the host graph
+    assert names(host_graph.get_candidates("Bear")) == ["teddy", "winnie"]
+    assert names(host_graph.get_candidates("Man")) == ["george"]
+    animals = names(host_graph.get_candidates("Animal"))
+    assert sorted(animals) == ["george", "teddy", "winnie"]
+    assert animals == [vtx.name for vtx in host_graph.graph.vtxs if vtx.name in animals]
+    # every match of a pattern only uses candidates of the right type
+    for lhs_match in matcher_rewriter.match_pattern(m, lhss["two bears"]):
+        assert {lhs_match["b1"], lhs_match["b2"]} == {"teddy", "winnie"}
@@ -0,0 +1,151 @@
+import pytest
+
+from state.pystate import PyState
+from bootstrap.scd import bootstrap_scd
+from util import loader
+from api.od import ODAPI
+from transformation.ramify import ramify
+from transformation.rule import Rule, RuleMatcherRewriter, ForAllGenerator
+
+mm_cs = """
+    Place:Class
+    Place_tokens:AttributeLink (Place -> Integer) {
+        name = "tokens";
+        optional = False;
+    }
+    Transition:Class
+    arc_in:Association (Place -> Transition)
+    arc_out:Association (Transition -> Place)
+"""
+
+# Only the transition is matched, the places are modified by action code (like in the Petri net example)
+nac_cs = """
+    p:RAM_Place { RAM_tokens = `get_value(this) == 0`; }
+    t:RAM_Transition
+    :RAM_arc_in (p -> t)
+"""
+lhs_cs = """
+    t:RAM_Transition
+"""
+rhs_cs = """
+    t:RAM_Transition {
+        condition = ```
+            for link in get_incoming(this, "arc_in"):
+                p = get_source(link)
+                set_slot_value(p, "tokens", get_slot_value(p, "tokens") - 1)
+            for link in get_outgoing(this, "arc_out"):
+                p = get_target(link)
+                set_slot_value(p, "tokens", get_slot_value(p, "tokens") + 1)
+        ```;
+    }
+"""
+
+def make_net(n, conflict):
+    m_cs = []
+    for i in range(n):
+        m_cs.append(f"""
+            p{i}:Place {{ tokens = 1; }}
+            q{i}:Place {{ tokens = 0; }}
+            t{i}:Transition
+            :arc_in (p{i} -> t{i})
+            :arc_out (t{i} -> q{i})
+        """)
+    if conflict:
+        # u0 and u1 compete for the token in c, u2 depends on the place that u0 and u1 fill
+        m_cs.append("""
+            c:Place { tokens = 1; }
+            d:Place { tokens = 0; }
+            e:Place { tokens = 0; }
+            u0:Transition
+            u1:Transition
+            u2:Transition
+            :arc_in (c -> u0)
+            :arc_in (c -> u1)
+            :arc_out (u0 -> d)
+            :arc_out (u1 -> d)
+            :arc_in (d -> u2)
+            :arc_out (u2 -> e)
+            # no input places, its output place is the input place of t0
+            v:Transition
+            :arc_out (v -> p0)
+        """)
+    return "".join(m_cs)
+
+@pytest.fixture
+def setup():
+    state = PyState()
+    scd = bootstrap_scd(state)
+    mm = loader.parse_and_check(state, mm_cs, scd, "mm")
+    mm_ramified = ramify(state, mm)
+    rule = Rule(
+        nacs=[loader.parse_and_check(state, nac_cs, mm_ramified, "NAC")],
+        lhs=loader.parse_and_check(state, lhs_cs, mm_ramified, "LHS"),
+        rhs=loader.parse_and_check(state, rhs_cs, mm_ramified, "RHS"),
+    ).compile(state, mm_ramified)
+    return state, mm, RuleMatcherRewriter(state, mm, mm_ramified), rule
+
+def get_tokens(state, m, mm):
+    od = ODAPI(state, m, mm)
+    return {name: od.get_slot_value(place, "tokens") for name, place in od.get_all_instances("Place")}
+
+# Executes the rule with exec_rule for every match, one after another, checking that every match is still a match at that time
+def exec_sequentially(matcher_rewriter, rule, m, lhs_matches):
+    for lhs_match in lhs_matches:
+        assert any(True for _ in matcher_rewriter.match_pattern(m, rule.lhs, pivot=lhs_match, check_pivot=True, nacs=rule.nacs))
+        m, _ = matcher_rewriter.exec_rule(m, rule.lhs, rule.rhs, lhs_match, "fire")
+    return m
+
+def test_forall_independent(setup):
+    state, mm, matcher_rewriter, rule = setup
+    m = loader.parse_and_check(state, make_net(5, conflict=False), mm, "m")
+    lhs_matches = list(matcher_rewriter.match_rule(m, rule.lhs, rule.nacs, "fire"))
+    assert len(lhs_matches) == 5
+
+    new_m, applied = matcher_rewriter.exec_rule_forall(m, rule, lhs_matches, "fire")
+    assert [lhs_match for lhs_match, _ in applied] == lhs_matches
+
+    tokens = get_tokens(state, new_m, mm)
+    assert tokens == get_tokens(state, exec_sequentially(matcher_rewriter, rule, m, lhs_matches), mm)
+    assert all(tokens[f"p{i}"] == 0 and tokens[f"q{i}"] == 1 for i in range(5))
+    # original model is unchanged
+    assert all(tokens == 1 for name, tokens in get_tokens(state, m, mm).items() if name.startswith("p"))
+
+def test_forall_conflicts(setup):
+    state, mm, matcher_rewriter, rule = setup
+    m = loader.parse_and_check(state, make_net(3, conflict=True), mm, "m")
+    lhs_matches = list(matcher_rewriter.match_rule(m, rule.lhs, rule.nacs, "fire"))
+    fired = lambda matches: sorted(lhs_match["t"] for lhs_match in matches)
+    assert fired(lhs_matches) == ["t0", "t1", "t2", "u0", "u1", "v"]
+
+    # the outcome depends on the order in which the matches are applied
+    for order in (lhs_matches, lhs_matches[::-1]):
+        new_m, applied = matcher_rewriter.exec_rule_forall(m, rule, order, "fire")
+        applied_matches = [lhs_match for lhs_match, _ in applied]
+        skipped = [lhs_match for lhs_match in order if lhs_match not in applied_matches]
+
+        # only one of u0 and u1 gets the token in c
+        assert len([t for t in fired(applied_matches) if t in ("u0", "u1")]) == 1
+        # firing v changes the input place that t0 depends on, but t0 does not read anything that v depends on
+        if order.index({"t": "v"}) < order.index({"t": "t0"}):
+            assert "t0" in fired(skipped)
+        else:
+            assert "t0" not in fired(skipped)
+        # u2 was not enabled in the original model, and is not fired
+        assert "u2" not in fired(applied_matches)
+
+        assert get_tokens(state, new_m, mm) == get_tokens(state, exec_sequentially(matcher_rewriter, rule, m, applied_matches), mm)
+        # the skipped matches (except the loser of the conflict) are enabled in the next step
+        next_matches = list(matcher_rewriter.match_rule(new_m, rule.lhs, rule.nacs, "fire"))
+        assert set(fired(skipped)) - {"u0", "u1"} <= set(fired(next_matches))
+
+def test_forall_generator(setup):
+    state, mm, matcher_rewriter, rule = setup
+    m = loader.parse_and_check(state, make_net(3, conflict=True), mm, "m")
+    generator = ForAllGenerator(matcher_rewriter, {"fire": rule})
+    actions = list(generator(ODAPI(state, m, mm)))
+    assert len(actions) == 1
+    description, action = actions[0]
+    assert description == "fire (for all 6 matches)"
+    new_od, msgs = action()
+    assert msgs[0].startswith("executed rule 'fire' for 5 of 6 matches")
+    assert get_tokens(state, new_od.m, mm)["c"] == 0
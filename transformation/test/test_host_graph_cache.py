@@ -0,0 +1,42 @@
+from state.pystate import PyState
+from bootstrap.scd import bootstrap_scd
+from util import loader
+from api.od import ODAPI
+from transformation.ramify import ramify
+from transformation.matcher import match_od, HostGraphCache
+
+mm_cs = """
+    Man:Class
+    Bear:Class
+    afraidOf:Association (Man -> Bear)
+"""
+
+m_cs = """
+    george:Man
+    teddy:Bear
+"""
+
+def test_host_graph_cache():
+    state = PyState()
+    scd = bootstrap_scd(state)
+    mm = loader.parse_and_check(state, mm_cs, scd, "mm")
+    m = loader.parse_and_check(state, m_cs, mm, "m")
+    mm_ramified = ramify(state, mm)
+    lhs = loader.parse_and_check(state, "b:RAM_Bear", mm_ramified, "LHS")
+    cache = HostGraphCache()
+
+    # state unchanged: reused
+    host_graph = cache.get(state, m, mm)
+    assert cache.get(state, m, mm) is host_graph
+    assert [match["b"] for match in match_od(state, m, mm, lhs, mm_ramified, host_cache=cache)] == ["teddy"]
+    assert cache.get(state, m, mm) is host_graph
+    assert (cache.hits, cache.misses) == (3, 1)
+
+    # state changed: rebuilt, and matching sees the change
+    ODAPI(state, m, mm).create_object("winnie", "Bear")
+    new_host_graph = cache.get(state, m, mm)
+    assert new_host_graph is not host_graph
+    assert "winnie" in new_host_graph.names and "winnie" not in host_graph.names
+    assert (cache.hits, cache.misses) == (3, 2)
+    assert sorted(match["b"] for match in match_od(state, m, mm, lhs, mm_ramified, host_cache=cache)) == ["teddy", "winnie"]
+    assert (cache.hits, cache.misses) == (4, 2)
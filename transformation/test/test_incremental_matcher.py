@@ -0,0 +1,174 @@
+import pytest
+
+from state.pystate import PyState
+from bootstrap.scd import bootstrap_scd
+from util import loader
+from api.od import ODAPI
+from transformation.ramify import ramify
+from transformation.rule import Rule, RuleMatcherRewriter, IncrementalMatcher
+
+mm_cs = """
+    Man:Class
+    Man_weight:AttributeLink (Man -> Integer) {
+        name = "weight";
+        optional = False;
+    }
+    Bear:Class
+    afraidOf:Association (Man -> Bear)
+"""
+
+m_cs = """
+    george:Man { weight = 80; }
+    bill:Man { weight = 110; }
+    teddy:Bear
+    winnie:Bear
+    :afraidOf (george -> teddy)
+"""
+
+# (NACs, LHS, RHS) of every rule
+rules_cs = {
+    # changes a slot
+    "feed": ([], """
+        m:RAM_Man { RAM_weight = `get_value(this) < 120`; }
+    """, """
+        m:RAM_Man { RAM_weight = `get_value(this) + 30`; }
+    """),
+    # creates a link, has NACs (one of which depends on a slot)
+    "scare": (["""
+        m:RAM_Man
+        b:RAM_Bear
+        :RAM_afraidOf (m -> b)
+    """, """
+        m:RAM_Man { RAM_weight = `get_value(this) >= 140`; }
+    """], """
+        m:RAM_Man
+        b:RAM_Bear
+    """, """
+        m:RAM_Man
+        b:RAM_Bear
+        :RAM_afraidOf (m -> b)
+    """),
+    # deletes a link
+    "calm": ([], """
+        m:RAM_Man
+        b:RAM_Bear
+        l:RAM_afraidOf (m -> b)
+    """, """
+        m:RAM_Man
+        b:RAM_Bear
+    """),
+    # creates an object
+    "spawn": ([], """
+        b:RAM_Bear {
+            condition = `len(get_all_instances("Man")) < 4`;
+        }
+    """, """
+        b:RAM_Bear
+        man:RAM_Man { RAM_weight = `50`; }
+    """),
+    # deletes an object (that nobody is afraid of)
+    "eat": (["""
+        m:RAM_Man
+        other:RAM_Bear
+        :RAM_afraidOf (m -> other)
+    """], """
+        m:RAM_Man { RAM_weight = `get_value(this) >= 140`; }
+        b:RAM_Bear
+    """, """
+        b:RAM_Bear
+    """),
+}
+
+@pytest.fixture
+def model():
+    state = PyState()
+    scd = bootstrap_scd(state)
+    mm = loader.parse_and_check(state, mm_cs, scd, "mm")
+    m = loader.parse_and_check(state, m_cs, mm, "m")
+    mm_ramified = ramify(state, mm)
+    rules = {
+        rule_name: Rule(
+            nacs=[loader.parse_and_check(state, nac_cs, mm_ramified, f"{rule_name} NAC") for nac_cs in nacs_cs],
+            lhs=loader.parse_and_check(state, lhs_cs, mm_ramified, f"{rule_name} LHS"),
+            rhs=loader.parse_and_check(state, rhs_cs, mm_ramified, f"{rule_name} RHS"),
+        ).compile(state, mm_ramified)
+        for rule_name, (nacs_cs, lhs_cs, rhs_cs) in rules_cs.items()
+    }
+    return state, m, mm, RuleMatcherRewriter(state, mm, mm_ramified), rules
+
+def as_set(matches):
+    return set(frozenset(match.items()) for match in matches)
+
+def test_incremental_matcher(model):
+    state, m, mm, matcher_rewriter, rules = model
+    incremental = IncrementalMatcher(matcher_rewriter)
+    od = ODAPI(state, m, mm)
+    executed = []
+    for step in range(30):
+        enabled = []
+        for rule_name, rule in rules.items():
+            matches = incremental.match_rule(od, rule, rule_name)
+            fresh = list(matcher_rewriter.match_pattern(od.m, rule.lhs, nacs=rule.nacs))
+            assert len(as_set(matches)) == len(matches), (step, rule_name)
+            assert as_set(matches) == as_set(fresh), (step, rule_name)
+            enabled += [(rule_name, rule, match) for match in matches]
+        if len(enabled) == 0:
+            break
+        # take turns, so that every rule gets executed
+        rule_name, rule, match = min(enabled, key=lambda action: executed.count(action[0]))
+        new_m, _ = incremental.exec_rule(od, rule, match, rule_name)
+        od = ODAPI(state, new_m, mm)
+        executed.append(rule_name)
+
+    assert set(executed) == set(rules)
+    assert incremental.hits > 0
+
+def test_incremental_matcher_unknown_model(model):
+    state, m, mm, matcher_rewriter, rules = model
+    incremental = IncrementalMatcher(matcher_rewriter)
+    od = ODAPI(state, m, mm)
+    rule = rules["calm"]
+    match = incremental.match_rule(od, rule, "calm")[0]
+
+    # model was not derived through IncrementalMatcher.exec_rule: matched from scratch
+    new_m, _ = matcher_rewriter.exec_rule(od.m, rule.lhs, rule.rhs, match, "calm")
+    incremental.misses = 0
+    assert incremental.match_rule(ODAPI(state, new_m, mm), rule, "calm") == []
+    assert incremental.misses == 1
+
+def test_rewrite_removes_listeners_on_error(model):
+    state, m, mm, matcher_rewriter, rules = model
+    matcher_rewriter.eval_context = {"fail": lambda: 1/0}
+    rhs = loader.parse_and_check(state, """
+        m:RAM_Man { RAM_weight = `fail()`; }
+    """, matcher_rewriter.mm_ramified, "failing RHS")
+    od = ODAPI(state, m, mm)
+    listener = lambda name, element: None
+    with pytest.raises(ZeroDivisionError):
+        matcher_rewriter.exec_rule(od.m, rules["feed"].lhs, rhs, {"m": "george"}, "fail", in_place=True, change_listeners=[listener])
+    # the listeners are attached to an ODAPI created by rewrite, so check one that we pass in
+    from transformation.rewriter import rewrite
+    with pytest.raises(ZeroDivisionError):
+        rewrite(state, rhs, matcher_rewriter.mm_ramified, {"m": "george"}, m, mm,
+            eval_context=matcher_rewriter.eval_context, change_listeners=[listener], host_odapi=od)
+    assert od.change_listeners == []
+
+def test_incremental_matcher_helper_reads(model):
+    state, m, mm, matcher_rewriter, rules = model
+    # a helper that reads the model through its own ODAPI: its reads cannot be recorded
+    current = {}
+    matcher_rewriter.eval_context = {"nobody_afraid": lambda: len(current["od"].get_all_instances("afraidOf")) == 0}
+    peace = Rule(nacs=[], lhs=loader.parse_and_check(state, """
+        b:RAM_Bear { condition = `nobody_afraid()`; }
+    """, matcher_rewriter.mm_ramified, "peace LHS"), rhs=None).compile(state, matcher_rewriter.mm_ramified)
+    incremental = IncrementalMatcher(matcher_rewriter)
+    od = ODAPI(state, m, mm)
+    current["od"] = od
+    assert incremental.match_rule(od, peace, "peace") == []
+
+    # only the link changes
+    match, = incremental.match_rule(od, rules["calm"], "calm")
+    new_m, _ = incremental.exec_rule(od, rules["calm"], match, "calm")
+    od = ODAPI(state, new_m, mm)
+    current["od"] = od
+    assert sorted(match["b"] for match in incremental.match_rule(od, peace, "peace")) == ["teddy", "winnie"]
@@ -0,0 +1,52 @@
+from state.pystate import PyState
+from bootstrap.scd import bootstrap_scd
+from util import loader
+from api.od import ODAPI
+from services import od
+from services.bottom.V0 import Bottom
+from transformation.ramify import ramify
+from transformation.matcher import model_to_graph, match_od, IS_MODELREF
+
+mm_cs = """
+    Man:Class
+    Man_name:AttributeLink (Man -> String) {
+        name = "name";
+        optional = False;
+    }
+    Man_weight:AttributeLink (Man -> Integer) {
+        name = "weight";
+        optional = False;
+    }
+"""
+
+m_cs = """
+    george:Man { name = "George"; weight = 80; }
+"""
+
+def test_modelrefs_detected_by_type():
+    state = PyState()
+    scd = bootstrap_scd(state)
+    mm = loader.parse_and_check(state, mm_cs, scd, "mm")
+    m = loader.parse_and_check(state, m_cs, mm, "m")
+    odapi = ODAPI(state, m, mm)
+    george = odapi.get("george")
+    name_node, weight_node = odapi.get_slot(george, "name"), odapi.get_slot(george, "weight")
+    # inline values, that are not UUIDs
+    assert od.get_referred_model(Bottom(state), name_node) == None
+    assert state.read_value(name_node) == "George"
+
+    names, graph = model_to_graph(state, m, mm)
+    vtxs = { vtx.node_id: vtx for vtx in graph.vtxs }
+    for node, type_name in [(name_node, "String"), (weight_node, "Integer")]:
+        assert vtxs[node].value == IS_MODELREF
+        assert vtxs[node].modelref == odapi.get_type(node)
+        assert odapi.get_type_name(node) == type_name
+    # objects are not ModelRefs
+    assert vtxs[george].value != IS_MODELREF
+
+    # and can be matched by the condition on the attribute
+    mm_ramified = ramify(state, mm)
+    lhs = loader.parse_and_check(state, """
+        m:RAM_Man { RAM_name = `get_value(this) == "George"`; }
+    """, mm_ramified, "LHS")
+    assert [match["m"] for match in match_od(state, m, mm, lhs, mm_ramified)] == ["george"]
@@ -0,0 +1,47 @@
+from state.pystate import PyState
+from bootstrap.scd import bootstrap_scd
+from util import loader
+from transformation.ramify import ramify
+from transformation.matcher import match_od
+
+mm_cs = """
+    Man:Class
+    Man_weight:AttributeLink (Man -> Integer) {
+        name = "weight";
+        optional = False;
+    }
+    Bear:Class
+"""
+
+m_cs = """
+    george:Man { weight = 80; }
+    bill:Man { weight = 110; }
+    teddy:Bear
+    winnie:Bear
+"""
+
+lhs_cs = """
+    b:RAM_Bear
+    m:RAM_Man
+"""
+
+# The condition can only be evaluated during matching if it does not have to call 'matched'.
+# If it does, it is checked once the NAC-match is complete.
+nac_cs = """
+    m:RAM_Man { RAM_weight = `get_value(this) > 100 or get_value(this) > get_slot_value(matched("m"), "weight")`; }
+"""
+
+def test_nac_condition_with_matched():
+    state = PyState()
+    scd = bootstrap_scd(state)
+    mm = loader.parse_and_check(state, mm_cs, scd, "mm")
+    m = loader.parse_and_check(state, m_cs, mm, "m")
+    mm_ramified = ramify(state, mm)
+    lhs = loader.parse_and_check(state, lhs_cs, mm_ramified, "LHS")
+    nac = loader.parse_and_check(state, nac_cs, mm_ramified, "NAC")
+
+    matches = list(match_od(state, m, mm, lhs, mm_ramified, nacs=[nac]))
+
+    # only bill is too heavy
+    # (every man is part of several LHS-matches, so the same NAC vertex is compared with the same host vertex more than once)
+    assert sorted((match["m"], match["b"]) for match in matches) == [("george", "teddy"), ("george", "winnie")]
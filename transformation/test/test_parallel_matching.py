@@ -0,0 +1,130 @@
+from state.pystate import PyState
+from bootstrap.scd import bootstrap_scd
+from util import loader
+from api.od import ODAPI
+from transformation.ramify import ramify
+import multiprocessing
+
+from transformation.rule import Rule, RuleMatcherRewriter, ActionGenerator, PriorityActionGenerator
+
+mm_cs = """
+    Man:Class
+    Man_weight:AttributeLink (Man -> Integer) {
+        name = "weight";
+        optional = False;
+    }
+    Bear:Class
+    afraidOf:Association (Man -> Bear)
+"""
+
+m_cs = """
+    george:Man { weight = 80; }
+    bill:Man { weight = 110; }
+    joe:Man { weight = 60; }
+    teddy:Bear
+    winnie:Bear
+    :afraidOf (george -> teddy)
+    :afraidOf (joe -> winnie)
+"""
+
+# (NACs, LHS, RHS) of every rule
+rules_cs = {
+    "feed": ([], """
+        m:RAM_Man { RAM_weight = `is_light(get_value(this))`; }
+    """, """
+        m:RAM_Man { RAM_weight = `get_value(this) + 30`; }
+    """),
+    "scare": (["""
+        m:RAM_Man
+        b:RAM_Bear
+        :RAM_afraidOf (m -> b)
+    """], """
+        m:RAM_Man
+        b:RAM_Bear
+    """, """
+        m:RAM_Man
+        b:RAM_Bear
+        :RAM_afraidOf (m -> b)
+    """),
+    "calm": ([], """
+        m:RAM_Man
+        b:RAM_Bear
+        l:RAM_afraidOf (m -> b)
+    """, """
+        m:RAM_Man
+        b:RAM_Bear
+    """),
+    "never": ([], """
+        m:RAM_Man { RAM_weight = `get_value(this) > 1000`; }
+    """, """
+        m:RAM_Man
+    """),
+}
+
+def load_rules():
+    state = PyState()
+    scd = bootstrap_scd(state)
+    mm = loader.parse_and_check(state, mm_cs, scd, "mm")
+    m = loader.parse_and_check(state, m_cs, mm, "m")
+    mm_ramified = ramify(state, mm)
+    rules = {
+        rule_name: Rule(
+            nacs=[loader.parse_and_check(state, nac_cs, mm_ramified, f"{rule_name} NAC") for nac_cs in nacs_cs],
+            lhs=loader.parse_and_check(state, lhs_cs, mm_ramified, f"{rule_name} LHS"),
+            rhs=loader.parse_and_check(state, rhs_cs, mm_ramified, f"{rule_name} RHS"),
+        ).compile(state, mm_ramified)
+        for rule_name, (nacs_cs, lhs_cs, rhs_cs) in rules_cs.items()
+    }
+    # eval_context with a lambda: not picklable, the worker processes must be forked
+    matcher_rewriter = RuleMatcherRewriter(state, mm, mm_ramified, eval_context={"is_light": lambda weight: weight < 100})
+    return state, m, mm, rules, matcher_rewriter
+
+def test_parallel_matching_same_actions():
+    state, m, mm, rules, matcher_rewriter = load_rules()
+    serial = ActionGenerator(matcher_rewriter, rules)
+    parallel = ActionGenerator(matcher_rewriter, rules, parallel=True, max_workers=2)
+    od = ODAPI(state, m, mm)
+    for step in range(5):
+        serial_actions = list(serial(od))
+        parallel_actions = list(parallel(od))
+        assert len(serial_actions) > 0
+        assert [description for description, _ in parallel_actions] == [description for description, _ in serial_actions]
+        od, _ = parallel_actions[step % len(parallel_actions)][1]()
+
+    # only the first priority level with a match yields actions
+    priority = PriorityActionGenerator(matcher_rewriter, [{"never": rules["never"]}, rules], parallel=True, max_workers=2)
+    assert [description for description, _ in priority(od)] == [description for description, _ in serial(od)]
+    # the generators of all priority levels share one pool
+    assert priority.generators[0].pool is priority.generators[1].pool
+
+    parallel.shutdown()
+    priority.shutdown()
+
+def test_parallel_matching_reuses_pool():
+    state, m, mm, rules, matcher_rewriter = load_rules()
+    generator = ActionGenerator(matcher_rewriter, rules, parallel=True, max_workers=2)
+    od = ODAPI(state, m, mm)
+
+    actions = list(generator(od))
+    executor = generator.pool.executor
+    assert executor != None
+    # state unchanged: same processes
+    assert [description for description, _ in generator(od)] == [description for description, _ in actions]
+    assert generator.pool.executor is executor
+
+    # state changed: the processes are forked again, to see the new state
+    od, _ = actions[0][1]()
+    assert [description for description, _ in generator(od)] == [description for description, _ in ActionGenerator(matcher_rewriter, rules)(od)]
+    assert generator.pool.executor is not executor
+
+    generator.shutdown()
+    assert generator.pool.executor == None
+
+def test_parallel_matching_without_fork(monkeypatch):
+    monkeypatch.setattr(multiprocessing, "get_all_start_methods", lambda: ["spawn"])
+    state, m, mm, rules, matcher_rewriter = load_rules()
+    od = ODAPI(state, m, mm)
+    generator = ActionGenerator(matcher_rewriter, rules, parallel=True)
+    # falls back to matching in this process
+    assert [description for description, _ in generator(od)] == [description for description, _ in ActionGenerator(matcher_rewriter, rules)(od)]
+    assert generator.pool.executor == None
@@ -0,0 +1,111 @@
+from transformation.vf2 import Graph, Vertex, Edge, MatcherVF2, MatcherState
+
+def make_graph(vtx_values, edges):
+    graph = Graph()
+    vtxs = { value: Vertex(value) for value in vtx_values }
+    graph.vtxs = list(vtxs.values())
+    graph.edges = [Edge(vtxs[src], vtxs[tgt], label) for src, label, tgt in edges]
+    return graph, vtxs
+
+# Host vertex "m1" can be matched with guest vertex "m", etc.
+def make_matcher(host, guest, candidates, compared=None):
+    def compare(g_vtx, h_vtx):
+        if compared != None:
+            compared.append((g_vtx.value, h_vtx.value))
+        return h_vtx.value.startswith(g_vtx.value)
+    return MatcherVF2(host, guest, compare, candidates)
+
+def as_values(matches):
+    return [{ g_vtx.value: h_vtx.value for g_vtx, h_vtx in match.mapping_vtxs.items() } for match in matches]
+
+host, h = make_graph(["m1", "m2", "b1", "b2", "b3"], [
+    ("m1", "afraidOf", "b1"),
+    ("m1", "afraidOf", "b2"),
+    ("m2", "afraidOf", "b2"),
+    ("b3", "friendOf", "m2"),
+])
+guest, g = make_graph(["m", "b"], [("m", "afraidOf", "b")])
+
+def test_search_order_rarest_first():
+    # the vertex with the fewest candidates first, then its neighbours
+    matcher = make_matcher(host, guest, {g["m"]: 2, g["b"]: 3})
+    steps = matcher.make_search_order({})
+    assert [(step.g_vtx.value, step.parent and step.parent.value, step.direction) for step in steps] \
+        == [("m", None, None), ("b", "m", "outgoing")]
+    assert as_values(matcher.match()) == [
+        {"m": "m1", "b": "b1"},
+        {"m": "m1", "b": "b2"},
+        {"m": "m2", "b": "b2"},
+    ]
+
+    matcher = make_matcher(host, guest, {g["m"]: 3, g["b"]: 2})
+    steps = matcher.make_search_order({})
+    assert [(step.g_vtx.value, step.parent and step.parent.value, step.direction) for step in steps] \
+        == [("b", None, None), ("m", "b", "incoming")]
+    assert as_values(matcher.match()) == [
+        {"b": "b1", "m": "m1"},
+        {"b": "b2", "m": "m1"},
+        {"b": "b2", "m": "m2"},
+    ]
+
+def test_pivot():
+    compared = []
+    matcher = make_matcher(host, guest, {g["m"]: 2, g["b"]: 3}, compared)
+    pivot = {g["b"]: h["b2"]}
+    # the pivot comes first, even though it has more candidates
+    steps = matcher.make_search_order(pivot)
+    assert [(step.g_vtx.value, step.parent and step.parent.value, step.direction) for step in steps] \
+        == [("b", None, None), ("m", "b", "incoming")]
+    assert as_values(matcher.match(pivot)) == [
+        {"b": "b2", "m": "m1"},
+        {"b": "b2", "m": "m2"},
+    ]
+    # the pivot itself is not compared, and only the neighbours of the pivot are tried
+    assert compared == [("m", "m1"), ("m", "m2")]
+    # (a pivot that does not fit: no matches)
+    assert as_values(matcher.match({g["b"]: h["b3"]})) == []
+
+def test_back_edges():
+    # cycle: the last vertex also has to match the edge back to the first one
+    guest, g = make_graph(["m", "b"], [("m", "afraidOf", "b"), ("b", "friendOf", "m")])
+    matcher = make_matcher(host, guest, {g["m"]: 2, g["b"]: 3})
+    steps = matcher.make_search_order({})
+    assert [[(edge.label, other.value, direction) for edge, other, direction in step.back_edges] for step in steps] \
+        == [[], [("friendOf", "m", "outgoing"), ("afraidOf", "m", "incoming")]]
+    # (b3 is a friend of m2, but m2 is not afraid of b3)
+    assert as_values(matcher.match()) == []
+
+def test_components():
+    # every component starts at its rarest vertex; matches are found exactly once
+    guest, g = make_graph(["m", "b"], [])
+    matcher = make_matcher(host, guest, {g["m"]: 2, g["b"]: 3})
+    assert [step.g_vtx.value for step in matcher.make_search_order({})] == ["m", "b"]
+    matches = as_values(matcher.match())
+    assert len(matches) == 6
+    assert len(set(frozenset(match.items()) for match in matches)) == 6
+    assert matches[:3] == [{"m": "m1", "b": "b1"}, {"m": "m1", "b": "b2"}, {"m": "m1", "b": "b3"}]
+
+def test_matcher_state_undo():
+    state = MatcherState.make_initial(host, guest, {g["m"]: h["m1"]})
+    edge = h["m1"].outgoing[0]
+    state.grow_vtx(h["b1"], g["b"])
+    state.grow_edge(edge, guest.edges[0])
+    snapshot = state.copy()
+    state.undo()
+    assert state.mapping_edges == {} and state.r_mapping_edges == {}
+    state.undo()
+    assert state.mapping_vtxs == {g["m"]: h["m1"]} and state.r_mapping_vtxs == {h["m1"]: g["m"]}
+    # copies are not affected
+    assert snapshot.mapping_vtxs == {g["m"]: h["m1"], g["b"]: h["b1"]}
+    assert snapshot.mapping_edges == {guest.edges[0]: edge}
+
+def test_matches_are_independent():
+    # the matcher grows and undoes one state in place, the matches it yields must not change afterwards
+    matcher = make_matcher(host, guest, {g["m"]: 2, g["b"]: 3})
+    matches = list(matcher.match())
+    assert as_values(matches) == [
+        {"m": "m1", "b": "b1"},
+        {"m": "m1", "b": "b2"},
+        {"m": "m2", "b": "b2"},
+    ]
+    assert [len(match.mapping_edges) for match in matches] == [1, 1, 1]
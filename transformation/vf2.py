@@ -2,8 +2,6 @@
 # It defines its own Graph type, and can be used standalone (no dependencies on the rest of muMLE framework)
 # Author: Joeri Exelmans
 
-import itertools
-
 from util.timer import Timer, counted
 
 # like finding the 'strongly connected componenets', but edges are navigable in any direction
@@ -21,7 +19,9 @@ def find_connected_components(graph):
         next_component += 1
     return (vtx_to_component, component_to_vtxs)
 
-def add_recursively(vtx, vtxs: list, d: dict, component: int, already_visited: set = set()):
+def add_recursively(vtx, vtxs: list, d: dict, component: int, already_visited: set = None):
+    if already_visited == None:
+        already_visited = set()
     if vtx in already_visited:
         return
     already_visited.add(vtx)
@@ -62,6 +62,8 @@ class Edge:
         else:
             return f"({self.src}->{self.tgt})"
 
+# The (partial) match that is being grown by the matcher.
+# There is only one MatcherState per search: it is grown in-place, and every change can be undone (when backtracking).
 class MatcherState:
     def __init__(self):
         self.mapping_vtxs = {} # guest -> host
@@ -70,77 +72,81 @@ class MatcherState:
         self.r_mapping_vtxs = {} # host -> guest
         self.r_mapping_edges = {} # host -> guest
 
-        self.h_unmatched_vtxs = []
-        self.g_unmatched_vtxs = []
-
-        # boundary is the most recently added (to the mapping) pair of (guest -> host) vertices
-        self.boundary = None
+        # for every change, what is needed to undo it
+        self.undo_log = []
 
     @staticmethod
     def make_initial(host, guest, pivot):
         state = MatcherState()
-        state.h_unmatched_vtxs = [vtx for vtx in host.vtxs if vtx not in pivot.values()]
-        state.g_unmatched_vtxs = [vtx for vtx in guest.vtxs if vtx not in pivot.keys()]
-        # if guest_to_host_candidates != None:
-        #     state.g_unmatched_vtxs.sort(
-        #         # performance thingy:
-        #         # try to match guest vtxs with few candidates first (fail early!):
-        #         key=lambda guest_vtx: guest_to_host_candidates.get(guest_vtx, 0))
-        state.mapping_vtxs = pivot
+        state.mapping_vtxs = dict(pivot)
         state.r_mapping_vtxs = { v: k for k,v in state.mapping_vtxs.items() }
         return state
 
-    # Grow the match set (creating a new copy)
+    # Grow the match set (undo with 'undo')
     def grow_edge(self, host_edge, guest_edge):
-        new_state = MatcherState()
-        new_state.mapping_vtxs  = self.mapping_vtxs
-        new_state.mapping_edges = dict(self.mapping_edges)
-        new_state.mapping_edges[guest_edge] = host_edge
-
-        new_state.r_mapping_vtxs = self.r_mapping_vtxs
-        new_state.r_mapping_edges = dict(self.r_mapping_edges)
-        new_state.r_mapping_edges[host_edge] = guest_edge
-
-        new_state.h_unmatched_vtxs = self.h_unmatched_vtxs
-        new_state.g_unmatched_vtxs = self.g_unmatched_vtxs
-
-        return new_state
+        self.mapping_edges[guest_edge] = host_edge
+        self.r_mapping_edges[host_edge] = guest_edge
+        self.undo_log.append((guest_edge, host_edge, True))
 
-    # Grow the match set (creating a new copy)
+    # Grow the match set (undo with 'undo')
     def grow_vtx(self, host_vtx, guest_vtx):
-        new_state = MatcherState()
-        new_state.mapping_vtxs  = dict(self.mapping_vtxs)
-        new_state.mapping_vtxs[guest_vtx] = host_vtx
-        new_state.mapping_edges = self.mapping_edges
+        self.mapping_vtxs[guest_vtx] = host_vtx
+        self.r_mapping_vtxs[host_vtx] = guest_vtx
+        self.undo_log.append((guest_vtx, host_vtx, False))
+
+    # Undo the most recent grow_edge or grow_vtx
+    def undo(self):
+        guest, host, is_edge = self.undo_log.pop()
+        if is_edge:
+            del self.mapping_edges[guest]
+            del self.r_mapping_edges[host]
+        else:
+            del self.mapping_vtxs[guest]
+            del self.r_mapping_vtxs[host]
 
+    # An independent copy of the mappings (the MatcherState itself will keep changing)
+    def copy(self):
+        new_state = MatcherState()
+        new_state.mapping_vtxs = dict(self.mapping_vtxs)
+        new_state.mapping_edges = dict(self.mapping_edges)
         new_state.r_mapping_vtxs = dict(self.r_mapping_vtxs)
-        new_state.r_mapping_vtxs[host_vtx] = guest_vtx
-        new_state.r_mapping_edges = self.r_mapping_edges
-
-        new_state.h_unmatched_vtxs = [h_vtx for h_vtx in self.h_unmatched_vtxs if h_vtx != host_vtx]
-        new_state.g_unmatched_vtxs = [g_vtx for g_vtx in self.g_unmatched_vtxs if g_vtx != guest_vtx]
-
-        new_state.boundary = (guest_vtx, host_vtx)
-
+        new_state.r_mapping_edges = dict(self.r_mapping_edges)
         return new_state
 
-    def make_hashable(self):
-        return frozenset(itertools.chain(
-            ((gv,hv) for gv,hv in self.mapping_vtxs.items()),
-            ((ge,he) for ge,he in self.mapping_edges.items()),
-        ))
-
     def __repr__(self):
-        # return self.make_hashable().__repr__()
         return "VTXS: "+self.mapping_vtxs.__repr__()+"\nEDGES: "+self.mapping_edges.__repr__()
 
+def read_edge(edge, direction):
+    if direction == "outgoing":
+        return edge.tgt
+    elif direction == "incoming":
+        return edge.src
+    else:
+        raise Exception("wtf!")
+
+# One step in the search order: the guest vertex to match, and how to find host candidates for it
+class SearchStep:
+    def __init__(self, g_vtx, parent=None, parent_edge=None, direction=None):
+        self.g_vtx = g_vtx
+        # The guest vertex (earlier in the search order) via which we got to this one, or None if this is the first vertex of its component.
+        # Candidates are then the host vertices connected to the match of the parent.
+        self.parent = parent
+        self.parent_edge = parent_edge
+        self.direction = direction # direction of parent_edge, seen from the parent
+        # Guest edges between this vertex and vertices earlier in the search order (or itself).
+        # When this vertex is matched, these edges can (and must) be matched as well.
+        self.back_edges = [] # (guest edge, other guest vertex, direction seen from this vertex)
+
 
 class MatcherVF2:
     # Guest is the pattern
-    def __init__(self, host, guest, compare_fn, guest_to_host_candidates=None):
+    # guest_components: optional, the result of find_connected_components(guest), if it was already computed
+    # host_candidates: optional, maps guest vertex to the host vertices it could possibly be matched with (e.g., because they have a compatible type), in the same order as host.vtxs. Guest vertices without an entry are tried with all host vertices.
+    def __init__(self, host, guest, compare_fn, guest_to_host_candidates=None, guest_components=None, host_candidates={}):
         self.host = host
         self.guest = guest
         self.compare_fn = compare_fn
+        self.host_candidates = host_candidates
 
         # map guest vertex to number of candidate vertices in host graph:
         if guest_to_host_candidates != None:
@@ -149,155 +155,149 @@ class MatcherVF2:
             # atttempt to match every guest vertex with every host vertex (slow!)
             self.guest_to_host_candidates = { g_vtx : len(host.vtxs) for g_vtx in guest.vtxs }
 
-        # with Timer("find_connected_components - guest"):
-        self.guest_vtx_to_component, self.guest_component_to_vtxs = find_connected_components(guest)
-
-        for component in self.guest_component_to_vtxs:
-            pass
-            # sort vertices in component such that the vertices of the rarest type (with the fewest element) occurs first
-            component.sort(key=lambda guest_vtx: guest_to_host_candidates[guest_vtx])
+        if guest_components == None:
+            # with Timer("find_connected_components - guest"):
+            guest_components = find_connected_components(guest)
+        self.guest_vtx_to_component, guest_component_to_vtxs = guest_components
+
+        # sort vertices in component such that the vertices of the rarest type (with the fewest element) occurs first
+        # (sorted copies - the components may be shared with other matchers)
+        self.guest_component_to_vtxs = [
+            sorted(component, key=lambda guest_vtx: self.guest_to_host_candidates[guest_vtx])
+                for component in guest_component_to_vtxs
+        ]
         if len(self.guest_component_to_vtxs) > 1:
             print("warning: pattern has multiple components:", len(self.guest_component_to_vtxs))
 
+    # Similar to VF2++, guest vertices are matched in a fixed order:
+    #  - first the vertices of the pivot (already matched),
+    #  - then, breadth-first, the vertices connected to them,
+    #  - then, for every remaining component, breadth-first starting at the vertex with the fewest candidates.
+    # Every vertex (except for the first of its component) is connected to a vertex earlier in the order, which restricts its candidates to the neighbours of that vertex's match.
+    # Because the order is fixed, every (partial) match can only be reached in one way, so every match is found exactly once.
+    def make_search_order(self, pivot):
+        steps = []
+        placed = set()
+
+        def place(step):
+            placed.add(step.g_vtx)
+            steps.append(step)
+
+        def breadth_first(queue):
+            while len(queue) > 0:
+                vtx = queue.pop(0)
+                neighbours = ([(edge, edge.tgt, "outgoing") for edge in vtx.outgoing]
+                    + [(edge, edge.src, "incoming") for edge in vtx.incoming])
+                # visit the rarest neighbours first (stable sort: ties keep the order of the edges)
+                neighbours.sort(key=lambda n: self.guest_to_host_candidates[n[1]])
+                for edge, neighbour, direction in neighbours:
+                    if neighbour not in placed:
+                        place(SearchStep(neighbour, vtx, edge, direction))
+                        queue.append(neighbour)
+
+        for g_vtx in pivot:
+            place(SearchStep(g_vtx))
+        breadth_first(list(pivot))
+
+        for component in self.guest_component_to_vtxs:
+            root = component[0]
+            if root not in placed:
+                place(SearchStep(root))
+                breadth_first([root])
+
+        position = { step.g_vtx: i for i, step in enumerate(steps) }
+        for i, step in enumerate(steps):
+            for edge in step.g_vtx.outgoing:
+                if position[edge.tgt] <= i: # includes self-loops
+                    step.back_edges.append((edge, edge.tgt, "outgoing"))
+            for edge in step.g_vtx.incoming:
+                if position[edge.src] < i:
+                    step.back_edges.append((edge, edge.src, "incoming"))
+
+        return steps
+
     def match(self, pivot={}):
+        steps = self.make_search_order(pivot)
         yield from self._match(
             state=MatcherState.make_initial(self.host, self.guest, pivot),
-            already_visited=set())
-
-    # @counted
-    def _match(self, state, already_visited, indent=0):
-        # input()
-
-        num_matches = 0
+            steps=steps,
+            i=0,
+            pivot=pivot)
 
+    # Match the guest vertex of steps[i]
+    def _match(self, state, steps, i, pivot, indent=0):
         def print_debug(*args):
             pass
             # print("  "*indent, *args) # uncomment to see a trace of the matching process
 
-        print_debug("match")
-
-        # Keep track of the states in the search space that we already visited
-        hashable = state.make_hashable()
-        if hashable in already_visited:
-            print_debug("    SKIP - ALREADY VISITED")
-            # print_debug("   ", hashable)
-            return 0
-        # print_debug("   ", [hash(a) for a in already_visited])
-        # print_debug("    ADD STATE")
-        # print_debug("   ", hash(hashable))
-        already_visited.add(hashable)
-
-
-        if len(state.mapping_vtxs) == len(self.guest.vtxs) and len(state.mapping_edges) == len(self.guest.edges):
+        if i == len(steps):
             print_debug("GOT MATCH:")
             print_debug(" ", state.mapping_vtxs)
             print_debug(" ", state.mapping_edges)
-            yield state
-            return 1
-
-        def read_edge(edge, direction):
-            if direction == "outgoing":
-                return edge.tgt
-            elif direction == "incoming":
-                return edge.src
-            else:
-                raise Exception("wtf!")
-
-        def attempt_grow(direction, indent):
-            num_matches = 0
-            for g_matched_vtx, h_matched_vtx in state.mapping_vtxs.items():
-                print_debug('attempt_grow', direction)
-                for g_candidate_edge in getattr(g_matched_vtx, direction):
-                    print_debug('g_candidate_edge:', g_candidate_edge)
-                    g_candidate_vtx = read_edge(g_candidate_edge, direction)
-                    # g_to_skip_vtxs.add(g_candidate_vtx)
-                    if g_candidate_edge in state.mapping_edges:
-                        print_debug("  skip, guest edge already matched")
-                        continue # skip already matched guest edge
-                    for h_candidate_edge in getattr(h_matched_vtx, direction):
-                        if g_candidate_edge.label != h_candidate_edge.label:
-                            print_debug("  labels differ")
-                            continue
-                        print_debug('h_candidate_edge:', h_candidate_edge)
-                        if h_candidate_edge in state.r_mapping_edges:
-                            print_debug("  skip, host edge already matched")
-                            continue # skip already matched host edge
-                        print_debug('grow edge', g_candidate_edge, ':', h_candidate_edge, id(g_candidate_edge), id(h_candidate_edge))
-                        new_state = state.grow_edge(h_candidate_edge, g_candidate_edge)
-                        h_candidate_vtx = read_edge(h_candidate_edge, direction)
-                        num_matches += yield from attempt_match_vtxs(
-                            new_state,
-                            g_candidate_vtx,
-                            h_candidate_vtx,
-                            indent+1)
-                        print_debug('backtrack edge', g_candidate_edge, ':', h_candidate_edge, id(g_candidate_edge), id(h_candidate_edge))
-            return num_matches
-
-        def attempt_match_vtxs(state, g_candidate_vtx, h_candidate_vtx, indent):
-            print_debug('attempt_match_vtxs')
-            if g_candidate_vtx in state.mapping_vtxs:
-                if state.mapping_vtxs[g_candidate_vtx] != h_candidate_vtx:
-                    print_debug("  nope, guest already mapped (mismatch)")
-                    return 0 # guest vtx is already mapped but doesn't match host vtx
-            if h_candidate_vtx in state.r_mapping_vtxs:
-                if state.r_mapping_vtxs[h_candidate_vtx] != g_candidate_vtx:
-                    print_debug("  nope, host already mapped (mismatch)")
-                    return 0 # host vtx is already mapped but doesn't match guest vtx
-            g_outdegree = len(g_candidate_vtx.outgoing)
-            h_outdegree = len(h_candidate_vtx.outgoing)
-            if g_outdegree > h_outdegree:
+            yield state.copy()
+            return
+
+        step = steps[i]
+        g_vtx = step.g_vtx
+
+        if g_vtx in pivot:
+            # already matched, but its edges still need to be matched
+            yield from self._match_edges(state, steps, i, 0, pivot, indent+1)
+            return
+
+        if step.parent != None:
+            h_parent = state.mapping_vtxs[step.parent]
+            # dict: no duplicates (if there are parallel host edges), but preserve the order
+            h_candidate_vtxs = dict.fromkeys(read_edge(h_edge, step.direction)
+                for h_edge in getattr(h_parent, step.direction)
+                    if h_edge.label == step.parent_edge.label)
+        elif g_vtx in self.host_candidates:
+            h_candidate_vtxs = self.host_candidates[g_vtx]
+        else:
+            h_candidate_vtxs = self.host.vtxs
+
+        g_outdegree = len(g_vtx.outgoing)
+        g_indegree = len(g_vtx.incoming)
+
+        for h_vtx in h_candidate_vtxs:
+            if h_vtx in state.r_mapping_vtxs:
+                print_debug("  nope, host already mapped")
+                continue
+            if g_outdegree > len(h_vtx.outgoing):
                 print_debug("  nope, outdegree")
-                return 0
-            g_indegree = len(g_candidate_vtx.incoming)
-            h_indegree = len(h_candidate_vtx.incoming)
-            if g_indegree > h_indegree:
+                continue
+            if g_indegree > len(h_vtx.incoming):
                 print_debug("  nope, indegree")
-                return 0
-            if not self.compare_fn(g_candidate_vtx, h_candidate_vtx):
+                continue
+            if not self.compare_fn(g_vtx, h_vtx):
                 print_debug("  nope, bad compare")
-                return 0
-            new_state = state.grow_vtx(
-                h_candidate_vtx,
-                g_candidate_vtx)
-            print_debug('grow vtx', g_candidate_vtx, ':', h_candidate_vtx, id(g_candidate_vtx), id(h_candidate_vtx))
-            num_matches = yield from self._match(new_state, already_visited, indent+1)
-            print_debug('backtrack vtx', g_candidate_vtx, ':', h_candidate_vtx, id(g_candidate_vtx), id(h_candidate_vtx))
-            return num_matches
-
-        print_debug('preferred...')
-        num_matches += yield from attempt_grow('outgoing', indent+1)
-        num_matches += yield from attempt_grow('incoming', indent+1)
-
-        if num_matches == 0:
-            print_debug('least preferred...')
-            if state.boundary != None:
-                g_boundary_vtx, _ = state.boundary
-                guest_boundary_component = self.guest_vtx_to_component[g_boundary_vtx]
-                # only try guest vertices that are in a different component (all vertices in the same component are already discovered via 'attempt_grow')
-                guest_components_to_try = (c for i,c in enumerate(self.guest_component_to_vtxs) if i != guest_boundary_component)
-                # for the host vertices however, we have to try them from all components, because different connected components of our pattern (=guest) could be mapped onto the same connected component in the host
-            else:
-                guest_components_to_try = self.guest_component_to_vtxs
-
-            for g_component in guest_components_to_try:
-                    # we only need to pick ONE vertex from the component
-                    # in the future, this can be optimized further by picking the vertex of the type with the fewest instances
-                    g_candidate_vtx = g_component[0]
-                    g_vtx_matches = 0
-                    g_vtx_max = self.guest_to_host_candidates[g_candidate_vtx]
-                    # print(' guest vtx has', g_vtx_max, ' host candidates')
-                    if g_candidate_vtx in state.mapping_vtxs:
-                        print_debug("skip (already matched)", g_candidate_vtx)
-                        continue
-                    for h_candidate_vtx in state.h_unmatched_vtxs:
-                        N = yield from attempt_match_vtxs(state, g_candidate_vtx, h_candidate_vtx, indent+1)
-                        g_vtx_matches += N > 0
-                        num_matches += N
-                        if g_vtx_matches == g_vtx_max:
-                            # print("EARLY STOP")
-                            break # found all matches
-
-        return num_matches
+                continue
+            print_debug('grow vtx', g_vtx, ':', h_vtx)
+            state.grow_vtx(h_vtx, g_vtx)
+            yield from self._match_edges(state, steps, i, 0, pivot, indent+1)
+            state.undo()
+            print_debug('backtrack vtx', g_vtx, ':', h_vtx)
+
+    # Match back-edge j of the guest vertex of steps[i] (that vertex has already been matched)
+    def _match_edges(self, state, steps, i, j, pivot, indent):
+        back_edges = steps[i].back_edges
+        if j == len(back_edges):
+            yield from self._match(state, steps, i+1, pivot, indent)
+            return
+
+        g_edge, g_other_vtx, direction = back_edges[j]
+        h_vtx = state.mapping_vtxs[steps[i].g_vtx]
+        h_other_vtx = state.mapping_vtxs[g_other_vtx]
+        for h_edge in getattr(h_vtx, direction):
+            if h_edge.label != g_edge.label:
+                continue
+            if read_edge(h_edge, direction) is not h_other_vtx:
+                continue
+            if h_edge in state.r_mapping_edges:
+                continue # host edge already matched
+            state.grow_edge(h_edge, g_edge)
+            yield from self._match_edges(state, steps, i, j+1, pivot, indent)
+            state.undo()
 
 # demo time...
 if __name__ == "__main__":
@@ -2,19 +2,38 @@
 # Parses and executes a block of Python code, and returns the eval result of the last statement
 
 from concrete_syntax.common import indent
+from util.timer import register_cache
 
 import ast
+import functools
+
+# The same fragments of user code (conditions, constraints, actions) are evaluated over and over again,
+# so we only parse and compile every fragment once.
+CACHE_SIZE = 4096
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _compile_exec_then_eval(code):
+    block = ast.parse(code, mode='exec')
+    # assumes last node is an expression
+    last = ast.Expression(block.body.pop().value)
+    return compile(block, '<string>', mode='exec'), compile(last, '<string>', mode='eval')
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _compile_exec(code):
+    return compile(code, '<string>', mode='exec')
+
+register_cache("exec_then_eval (compiled code)", _compile_exec_then_eval)
+register_cache("simply_exec (compiled code)", _compile_exec)
+
 def exec_then_eval(code, _globals={}, _locals={}):
     try:
-        block = ast.parse(code, mode='exec')
-        # assumes last node is an expression
-        last = ast.Expression(block.body.pop().value)
+        compiled_block, compiled_last = _compile_exec_then_eval(code)
         extended_globals = {
             '__builtins__': __builtins__,
             **_globals,
         }
-        exec(compile(block, '<string>', mode='exec'), extended_globals, _locals)
-        result = eval(compile(last, '<string>', mode='eval'), extended_globals, _locals)
+        exec(compiled_block, extended_globals, _locals)
+        result = eval(compiled_last, extended_globals, _locals)
         return result
     except Exception as e:
         e.add_note("In the following user code fragment:\n"+indent(code, 4))
@@ -22,12 +41,12 @@ def exec_then_eval(code, _globals={}, _locals={}):
 
 def simply_exec(code, _globals={}, _locals={}):
     try:
-        block = ast.parse(code, mode='exec')
+        compiled_block = _compile_exec(code)
         extended_globals = {
             '__builtins__': __builtins__,
             **_globals,
         }
-        exec(compile(block, '<string>', mode='exec'), extended_globals, _locals)
+        exec(compiled_block, extended_globals, _locals)
     except Exception as e:
         e.add_note("In the following user code fragment:\n"+indent(code, 4))
         raise
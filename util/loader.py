@@ -86,7 +86,7 @@ def load_rules(state, get_filename, rt_mm_ramified, rule_names, check_conformanc
                         descr="'"+filename+"'",
                         check_conformance=check_conformance)
 
-        rules[rule_name] = Rule(*(parse(kind) for kind in KINDS))
+        rules[rule_name] = Rule(*(parse(kind) for kind in KINDS)).compile(state, rt_mm_ramified)
 
     print("Rules loaded:\n" + indent('\n'.join(files_read), 4))
 
@@ -0,0 +1,21 @@
+from util.eval import exec_then_eval, simply_exec, _compile_exec_then_eval, _compile_exec
+
+def test_exec_then_eval_cached():
+    code = "y = x * 2\ny + 1"
+    _compile_exec_then_eval.cache_clear()
+    # the same code object, with different locals
+    assert [exec_then_eval(code, _locals={'x': x}) for x in range(5)] == [1, 3, 5, 7, 9]
+    info = _compile_exec_then_eval.cache_info()
+    assert (info.hits, info.misses) == (4, 1)
+    # (the cached code must not be affected by evaluating it)
+    assert exec_then_eval(code, _globals={'x': 10}) == 21
+
+def test_simply_exec_cached():
+    code = "result.append(x)"
+    _compile_exec.cache_clear()
+    result = []
+    for x in range(3):
+        simply_exec(code, _globals={'result': result}, _locals={'x': x})
+    assert result == [0, 1, 2]
+    info = _compile_exec.cache_info()
+    assert (info.hits, info.misses) == (2, 1)
@@ -0,0 +1,24 @@
+import functools
+
+from util.eval import exec_then_eval, _compile_exec_then_eval
+from util.timer import register_cache, get_cache_stats, caches
+
+def test_cache_stats():
+    _compile_exec_then_eval.cache_clear()
+    exec_then_eval("1 + 1")
+    exec_then_eval("1 + 1")
+    hits, misses, maxsize, currsize = get_cache_stats()["exec_then_eval (compiled code)"]
+    assert (hits, misses, currsize) == (1, 1, 1)
+    assert "simply_exec (compiled code)" in get_cache_stats()
+
+def test_register_cache():
+    @functools.lru_cache(maxsize=2)
+    def square(x):
+        return x * x
+    register_cache("squares", square)
+    try:
+        for x in [1, 2, 1, 3]:
+            square(x)
+        assert get_cache_stats()["squares"] == (1, 3, 2, 2)
+    finally:
+        del caches["squares"]
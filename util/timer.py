@@ -1,6 +1,16 @@
 import os
 import atexit
 
+# Caches (functions decorated with functools.lru_cache) whose hit/miss counts we want to report
+caches = {}
+
+def register_cache(text, cached_function):
+    caches[text] = cached_function
+
+# Returns, for every registered cache, its (hits, misses, maxsize, currsize)
+def get_cache_stats():
+    return { text: cached_function.cache_info() for text, cached_function in caches.items() }
+
 if "MUMLE_PROFILER" in os.environ:
     import time
 
@@ -24,6 +34,11 @@ if "MUMLE_PROFILER" in os.environ:
             tuples.sort(key=lambda tup: -tup[1][0])
             for text, (duration, count) in tuples:
                 print(f'  {text}  {round(duration/1000000)} ms ({count} times, {round(duration/count/1000000)} ms avg.)')
+        stats = get_cache_stats()
+        if len(stats)>0:
+            print(f'Caches:')
+            for text, info in stats.items():
+                print(f'  {text}  {info.hits} hits, {info.misses} misses ({info.currsize}/{info.maxsize} entries)')
 
     atexit.register(__print_timings)
 